@@ -1,12 +1,45 @@
 import os
 import sqlite3
 import datetime
-import io
 import logging # Added for more explicit logging configuration
-from flask import Flask, g, render_template_string, request, redirect, url_for, session, send_file
-from werkzeug.security import generate_password_hash, check_password_hash
-from ics import Calendar, Event
+import logging.handlers
+import atexit
+import csv
+import io
+import random
+import glob
+import queue
+import threading
+import re
+import sys
+import click
+import secrets
+import time
+import json
+import functools
+import gzip
+import hashlib
+import zlib
+import zoneinfo
+import multiprocessing
+import importlib
+import smtplib
+from email.message import EmailMessage
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from flask import Flask, current_app, g, has_request_context, render_template, request, redirect, url_for, session, Response, stream_with_context, jsonify
+from jinja2 import DictLoader, FileSystemBytecodeCache
+from flask.cli import with_appcontext
+from flask.logging import default_handler
+from werkzeug.security import generate_password_hash
+from werkzeug.http import is_resource_modified, http_date
 from dotenv import load_dotenv
+import password_hashing
+try:
+    import brotli  # optional: br Content-Encoding
+except ImportError:
+    brotli = None
 
 # Load environment variables from .env file, if present
 load_dotenv()
@@ -16,26 +49,138 @@ load_dotenv()
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 # Define the database file path, defaulting to 'app.db' if DB environment variable is not set
 DATABASE_FILE = os.path.join(BASE_DIR, os.getenv("DB", "app.db"))
+# Connection pool and SQLite tuning (per gunicorn worker process); pool size 0 = a connection per request
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-16000"))  # negative = KiB, so ~16 MB
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "128"))
+# Optional per-clinic sharding: a directory database mapping logins and calendar tokens to one
+# database file per clinic (unset = everything in DATABASE_FILE); threads for cross-shard queries
+SHARD_DIRECTORY = os.getenv("SHARD_DIRECTORY")
+SHARD_QUERY_THREADS = int(os.getenv("SHARD_QUERY_THREADS", "8"))
+# Numbered schema migrations, applied by `flask --app app migrate`
+MIGRATIONS_DIR = os.path.join(BASE_DIR, "migrations")
+# Optional on-disk Jinja bytecode cache so fresh workers skip template compilation
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR")
+# Template output chunks buffered per flush when streaming the patient table
+TEMPLATE_STREAM_BUFFER = int(os.getenv("TEMPLATE_STREAM_BUFFER", "8"))
+# Response compression for HTML, JSON and ICS: smallest body worth compressing, gzip level and
+# brotli quality (br is offered only when the Brotli package is installed). Static assets are
+# compressed once at the highest settings and cached by browsers for STATIC_MAX_AGE seconds.
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "512"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", str(365 * 86400)))
+# Serialized ICS bodies kept per worker, keyed by patient and feed version
+ICS_CACHE_SIZE = int(os.getenv("ICS_CACHE_SIZE", "64"))
+# Per-worker read caches (picker pages, patient day lists): entries per cache (0 = off) and max age
+READ_CACHE_SIZE = int(os.getenv("READ_CACHE_SIZE", "1024"))
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", "300"))
+# Completions are written by a per-worker group-commit thread: extra wait for more jobs, jobs per
+# transaction, commit durability, and how long a request waits for its acknowledgement
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "256"))
+GROUP_COMMIT_SYNCHRONOUS = os.getenv("GROUP_COMMIT_SYNCHRONOUS", "FULL")
+GROUP_COMMIT_TIMEOUT = float(os.getenv("GROUP_COMMIT_TIMEOUT", "10"))
+# Most schedule items one /done/batch call may update
+DONE_BATCH_MAX_ITEMS = int(os.getenv("DONE_BATCH_MAX_ITEMS", "500"))
+# Live dashboard updates: open streams per worker (gunicorn.conf.py adds a thread for each),
+# change-log poll interval, heartbeat, stream lifetime before the browser reconnects, log retention
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", "64"))
+SSE_POLL_INTERVAL = float(os.getenv("SSE_POLL_INTERVAL", "1"))
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+SSE_MAX_STREAM_SECONDS = float(os.getenv("SSE_MAX_STREAM_SECONDS", "600"))
+CHANGE_LOG_RETENTION = int(os.getenv("CHANGE_LOG_RETENTION", "86400"))
+# Exercise reminders: sent REMINDER_LEAD_MINUTES ahead through REMINDER_SENDER ('log', 'smtp', 'off'
+# or 'module:factory'); skipped once more than REMINDER_MAX_LATE seconds overdue. Rows claimed per
+# transaction, how long a claim blocks other senders, and the longest sleep between passes.
+REMINDER_SENDER = os.getenv("REMINDER_SENDER", "log")
+REMINDER_LEAD_MINUTES = int(os.getenv("REMINDER_LEAD_MINUTES", "15"))
+REMINDER_MAX_LATE = int(os.getenv("REMINDER_MAX_LATE", "3600"))
+REMINDER_BATCH = int(os.getenv("REMINDER_BATCH", "500"))
+REMINDER_LEASE = int(os.getenv("REMINDER_LEASE", "300"))
+REMINDER_POLL_INTERVAL = float(os.getenv("REMINDER_POLL_INTERVAL", "30"))
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "25"))
+REMINDER_FROM = os.getenv("REMINDER_FROM", "reminders@localhost")
+# Weeks shown in the physio adherence report, the current one included
+ADHERENCE_REPORT_WEEKS = int(os.getenv("ADHERENCE_REPORT_WEEKS", "12"))
+# History archive: rows scheduled more than ARCHIVE_AFTER_DAYS ago move from schedule to
+# schedule_archive, ARCHIVE_BATCH rows per short write transaction, pausing ARCHIVE_PAUSE_MS between
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "2000"))
+ARCHIVE_PAUSE_MS = float(os.getenv("ARCHIVE_PAUSE_MS", "20"))
+# Bulk export/import: rows read per keyset page of an export, rows written per import transaction
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "5000"))
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "5000"))
+# Options per page in the physio patient/exercise pickers
+PICKER_PAGE_SIZE = int(os.getenv("PICKER_PAGE_SIZE", "20"))
+# Upper bound on schedule rows a single bulk assignment may generate
+BULK_ASSIGN_MAX_ROWS = int(os.getenv("BULK_ASSIGN_MAX_ROWS", "200000"))
+# Metrics: per-worker snapshots are written here and summed by /metrics (unset = this process only)
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # if set, /metrics requires 'Authorization: Bearer <token>'; unset = loopback only
+# Logging: 'json' (one object per line) or 'text'; records are written from a background thread
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Fraction of INFO-and-below records kept for the hot endpoints listed in LOG_SAMPLE_ENDPOINTS
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+LOG_SAMPLE_ENDPOINTS = set(filter(None, os.getenv(
+    "LOG_SAMPLE_ENDPOINTS", "patient_dashboard,done,done_batch,ics,calendar_feed,physio_search").split(",")))
+# Password hashing: werkzeug method string; stored hashes with other parameters are upgraded on login
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+# Hashing runs in a small per-worker process pool at lowered CPU priority (0 = hash inline)
+LOGIN_HASH_PROCESSES = int(os.getenv("LOGIN_HASH_PROCESSES", "1"))
+LOGIN_HASH_NICE = int(os.getenv("LOGIN_HASH_NICE", "10"))
+# In-flight hashes per worker before fast 503s; keep below GUNICORN_THREADS so other routes always get a thread
+LOGIN_HASH_QUEUE_DEPTH = int(os.getenv("LOGIN_HASH_QUEUE_DEPTH", "2"))
+LOGIN_HASH_TIMEOUT = float(os.getenv("LOGIN_HASH_TIMEOUT", "5"))
+# Login throttling: attempts allowed per email / per client IP within the window
+LOGIN_THROTTLE_WINDOW = int(os.getenv("LOGIN_THROTTLE_WINDOW", "300"))
+LOGIN_MAX_ATTEMPTS_PER_EMAIL = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_EMAIL", "10"))
+LOGIN_MAX_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_IP", "50"))
 
-# Initialize Flask application
-app = Flask(__name__)
-# Set the secret key for session management, defaulting if not set in environment
-app.secret_key = os.getenv("SECRET_KEY", "a_default_dev_secret_key_longer_and_more_random") # Made default key a bit better
+# --- HTML Templates ---
+# One stylesheet for every page, served from /assets under a content fingerprint (see Static
+# Assets); rules for a single page are scoped by the template name set as the body class
+STYLESHEET = '''
+body { font-family: sans-serif; margin: 20px; background-color: #f4f4f4; color: #333; }
+h2 { color: #333; }
+a { color: #007bff; text-decoration: none; }
+a:hover { text-decoration: underline; }
+button { color: white; padding: 10px 15px; border: none; border-radius: 4px; cursor: pointer; }
+input[type="email"], input[type="password"], input[type="date"], input[type="time"], input[type="search"], select { width: calc(100% - 22px); padding: 10px; margin-bottom: 10px; border: 1px solid #ddd; border-radius: 4px; }
+table { width: 100%; border-collapse: collapse; margin-bottom: 20px; }
+th, td { padding: 10px; border: 1px solid #ddd; text-align: left; }
+th { background-color: #e9ecef; }
+.container { max-width: 800px; margin: 20px auto; padding: 20px; background-color: #fff; border-radius: 8px; box-shadow: 0 0 10px rgba(0,0,0,0.1); }
+.logout-link { display: block; text-align: right; margin-top: 20px;}
 
-# Configure logging
-# Gunicorn typically handles logging, but this ensures Flask's logger is also active.
-if not app.debug: # Only configure this if not in debug mode (Gunicorn will set debug=False)
-    app.logger.setLevel(logging.INFO)
-    # You can add handlers here if needed, but Render should capture stdout/stderr
-    # For example, to ensure logs go to stdout for Render to pick up:
-    # stream_handler = logging.StreamHandler()
-    # stream_handler.setLevel(logging.INFO)
-    # app.logger.addHandler(stream_handler)
+.login form { background-color: #fff; padding: 20px; border-radius: 8px; box-shadow: 0 0 10px rgba(0,0,0,0.1); max-width: 400px; margin: 40px auto; }
+.login button { background-color: #007bff; width: 100%; }
+.login button:hover { background-color: #0056b3; }
+.login .error { color: red; margin-top: 10px; text-align: center; }
 
-app.logger.info("Flask application initialized.")
+.physio form { background-color: #fff; padding: 20px; margin-bottom:20px; border-radius: 8px; }
+.physio button { background-color: #28a745; }
+.physio button:hover { background-color: #1e7e34; }
 
+.adherence .container { max-width: 1100px; }
+.adherence th, .adherence td { padding: 6px 8px; }
+.adherence td.week { text-align: center; font-size: 0.85em; }
+.adherence td.full { background-color: #d4edda; }
+.adherence td.partial { background-color: #fff3cd; }
+.adherence td.missed { background-color: #f8d7da; }
+
+.patient button { background-color: #17a2b8; padding: 5px 10px; }
+.patient button:hover { background-color: #117a8b; }
+.patient .completed { text-decoration: line-through; color: #6c757d; }
+.patient .actions { margin-top: 20px; }
+'''
 
-# --- HTML Templates ---
 TEMPLATES = {
     'login': '''<!DOCTYPE html>
 <html lang="en">
@@ -43,17 +188,9 @@ TEMPLATES = {
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Login</title>
-    <style>
-        body { font-family: sans-serif; margin: 20px; background-color: #f4f4f4; color: #333; }
-        h2 { color: #333; }
-        form { background-color: #fff; padding: 20px; border-radius: 8px; box-shadow: 0 0 10px rgba(0,0,0,0.1); max-width: 400px; margin: 40px auto; }
-        input[type="email"], input[type="password"] { width: calc(100% - 22px); padding: 10px; margin-bottom: 10px; border: 1px solid #ddd; border-radius: 4px; }
-        button { background-color: #007bff; color: white; padding: 10px 15px; border: none; border-radius: 4px; cursor: pointer; width: 100%; }
-        button:hover { background-color: #0056b3; }
-        .error { color: red; margin-top: 10px; text-align: center; }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
 </head>
-<body>
+<body class="login">
     <h2>Login</h2>
     <form method="post">
         Email <input name="email" type="email" required><br>
@@ -71,31 +208,22 @@ TEMPLATES = {
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Physio Dashboard</title>
-    <style>
-        body { font-family: sans-serif; margin: 20px; background-color: #f4f4f4; color: #333; }
-        h2 { color: #333; }
-        .container { max-width: 800px; margin: 20px auto; padding: 20px; background-color: #fff; border-radius: 8px; box-shadow: 0 0 10px rgba(0,0,0,0.1); }
-        form { background-color: #fff; padding: 20px; margin-bottom:20px; border-radius: 8px; /*box-shadow: 0 0 10px rgba(0,0,0,0.1);*/ }
-        select, input[type="date"], input[type="time"] { width: calc(100% - 22px); padding: 10px; margin-bottom: 10px; border: 1px solid #ddd; border-radius: 4px; }
-        button { background-color: #28a745; color: white; padding: 10px 15px; border: none; border-radius: 4px; cursor: pointer; }
-        button:hover { background-color: #1e7e34; }
-        a { color: #007bff; text-decoration: none; }
-        a:hover { text-decoration: underline; }
-        .logout-link { display: block; text-align: right; margin-top: 20px;}
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
 </head>
-<body>
+<body class="physio">
     <div class="container">
         <h2>Assign Exercise</h2>
         <form method="post" action="{{ url_for('assign') }}">
-            Patient: <select name="patient_id">
+            Patient: <input type="search" placeholder="Search patients by name or email" data-picker="patients" data-target="patient-select" autocomplete="off">
+            <select name="patient_id" id="patient-select">
                 {% for p in patients %}
                     <option value="{{ p.id }}">{{ p.email }} ({{p.name or 'N/A'}})</option>
                 {% else %}
                     <option value="">No patients found</option>
                 {% endfor %}
             </select><br>
-            Exercise: <select name="exercise_id">
+            Exercise: <input type="search" placeholder="Search exercises" data-picker="exercises" data-target="exercise-select" autocomplete="off">
+            <select name="exercise_id" id="exercise-select">
                 {% for e in exercises %}
                     <option value="{{ e.id }}">{{ e.name }}</option>
                 {% else %}
@@ -106,7 +234,88 @@ TEMPLATES = {
             Time: <input type="time" name="time" required><br>
             <button type="submit">Assign</button>
         </form>
-        <p class="logout-link"><a href="{{ url_for('logout') }}">Logout ({{ session.get('user_name', 'Physio') }})</a></p>
+        <p class="logout-link"><a href="{{ url_for('physio_adherence') }}">Adherence report</a> · <a href="{{ url_for('logout') }}">Logout ({{ session.get('user_name', 'Physio') }})</a></p>
+    </div>
+    <script>
+    // Replace picker options with search results as the physio types.
+    document.querySelectorAll('input[data-picker]').forEach(function (input) {
+        var select = document.getElementById(input.dataset.target), timer = null;
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                var url = '{{ url_for('physio_search') }}?kind=' + input.dataset.picker + '&q=' + encodeURIComponent(input.value);
+                fetch(url).then(function (r) { return r.json(); }).then(function (data) {
+                    select.innerHTML = '';
+                    data.results.forEach(function (item) {
+                        select.add(new Option(item.email ? item.email + ' (' + (item.name || 'N/A') + ')' : item.name, item.id));
+                    });
+                    if (!data.results.length) { select.add(new Option('No matches', '')); }
+                });
+            }, 150);
+        });
+    });
+    </script>
+</body>
+</html>''',
+    'adherence': '''<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Adherence</title>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
+</head>
+<body class="adherence">
+    <div class="container">
+        {% macro week_cells(summary) %}
+            {% for week in summary.weeks %}
+                {% set css = '' if not week.assigned else 'full' if week.completed >= week.assigned else 'missed' if not week.completed else 'partial' %}
+                <td class="week {{ css }}">{{ '%d/%d' % (week.completed, week.assigned) if week.assigned else '' }}</td>
+            {% endfor %}
+        {% endmacro %}
+        {% macro totals(summary) %}
+            <td>{{ summary.completed }}/{{ summary.due }}</td>
+            <td>{{ '%d%%' % (summary.rate * 100) if summary.rate is not none else '–' }}</td>
+            <td>{{ summary.streak_weeks }}</td>
+            <td>{{ summary.overdue }}</td>
+        {% endmacro %}
+        {% if report.patient %}
+            {% set p = report.patient %}
+            <h2>Adherence: {{ p.name or p.email }}</h2>
+            <table>
+                <thead>
+                    <tr><th>Exercise</th><th>Done/due</th><th>Rate</th><th>Streak (wk)</th><th>Overdue</th>
+                        {% for week in report.weeks %}<th>{{ week[5:] }}</th>{% endfor %}</tr>
+                </thead>
+                <tbody>
+                    <tr><th>All exercises</th>{{ totals(p) }}{{ week_cells(p) }}</tr>
+                    {% for e in p.exercises %}
+                    <tr><td>{{ e.name }}</td>{{ totals(e) }}{{ week_cells(e) }}</tr>
+                    {% endfor %}
+                </tbody>
+            </table>
+            <p><a href="{{ url_for('physio_adherence') }}">All patients</a> · <a href="{{ url_for('physio_adherence_json', patient=p.id) }}">JSON</a></p>
+        {% else %}
+            <h2>Adherence, last {{ report.weeks|length }} weeks</h2>
+            <form method="get"><input type="search" name="q" value="{{ request.args.get('q', '') }}" placeholder="Search patients by name or email"></form>
+            <table>
+                <thead>
+                    <tr><th>Patient</th><th>Done/due</th><th>Rate</th><th>Streak (wk)</th><th>Overdue</th>
+                        {% for week in report.weeks %}<th>{{ week[5:] }}</th>{% endfor %}</tr>
+                </thead>
+                <tbody>
+                    {% for p in report.patients %}
+                    <tr><td><a href="{{ url_for('physio_adherence', patient=p.id) }}">{{ p.name or p.email }}</a></td>{{ totals(p) }}{{ week_cells(p) }}</tr>
+                    {% else %}
+                    <tr><td colspan="{{ 5 + report.weeks|length }}">No patients found.</td></tr>
+                    {% endfor %}
+                </tbody>
+            </table>
+            {% if report.next %}
+                <p><a href="{{ url_for('physio_adherence', after=report.next, q=request.args.get('q') or None) }}">Next page</a></p>
+            {% endif %}
+        {% endif %}
+        <p class="logout-link"><a href="{{ url_for('physio_dashboard') }}">Assign exercises</a> · <a href="{{ url_for('logout') }}">Logout ({{ session.get('user_name', 'Physio') }})</a></p>
     </div>
 </body>
 </html>''',
@@ -116,23 +325,9 @@ TEMPLATES = {
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Patient Dashboard</title>
-    <style>
-        body { font-family: sans-serif; margin: 20px; background-color: #f4f4f4; color: #333; }
-        .container { max-width: 800px; margin: 20px auto; padding: 20px; background-color: #fff; border-radius: 8px; box-shadow: 0 0 10px rgba(0,0,0,0.1); }
-        h2 { color: #333; }
-        table { width: 100%; border-collapse: collapse; margin-bottom: 20px; /*background-color: #fff; box-shadow: 0 0 10px rgba(0,0,0,0.1);*/ }
-        th, td { padding: 10px; border: 1px solid #ddd; text-align: left; }
-        th { background-color: #e9ecef; }
-        button { background-color: #17a2b8; color: white; padding: 5px 10px; border: none; border-radius: 4px; cursor: pointer; }
-        button:hover { background-color: #117a8b; }
-        a { color: #007bff; text-decoration: none; }
-        a:hover { text-decoration: underline; }
-        .completed { text-decoration: line-through; color: #6c757d; }
-        .actions { margin-top: 20px; }
-        .logout-link { display: block; text-align: right; margin-top: 20px;}
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
 </head>
-<body>
+<body class="patient">
     <div class="container">
         <h2>Today's Schedule ({{ session.get('user_name', 'Patient') }})</h2>
         <table border="1">
@@ -145,8 +340,8 @@ TEMPLATES = {
             </thead>
             <tbody>
                 {% for item in items %}
-                <tr>
-                    <td class="{{ 'completed' if item.completed else '' }}">{{ item.scheduled_at.strftime('%I:%M %p') if item.scheduled_at else 'N/A' }}</td>
+                <tr data-item="{{ item.id }}" data-at="{{ item.scheduled_at.timestamp()|int if item.scheduled_at else '' }}">
+                    <td class="{{ 'completed' if item.completed else '' }}">{{ item.scheduled_at.astimezone(tz).strftime('%I:%M %p') if item.scheduled_at else 'N/A' }}</td>
                     <td class="{{ 'completed' if item.completed else '' }}">{{ item.name }}</td>
                     <td>
                         {% if not item.completed %}
@@ -158,319 +353,3138 @@ TEMPLATES = {
                         {% endif %}
                     </td>
                 </tr>
-                {% endfor %}
-                {% if not items %}
-                <tr>
+                {% else %}
+                <tr id="no-items">
                     <td colspan="3" style="text-align:center;">No exercises scheduled for today.</td>
                 </tr>
-                {% endif %}
+                {% endfor %}
             </tbody>
         </table>
         <div class="actions">
             <a href="{{ url_for('ics') }}">Download Calendar (ICS)</a>
+            {% if feed_token %}
+                <p>Subscribe in your calendar app: <code>{{ url_for('calendar_feed', token=feed_token, _external=True) }}</code></p>
+            {% endif %}
         </div>
         <p class="logout-link"><a href="{{ url_for('logout') }}">Logout</a></p>
     </div>
+    <script>
+    (function () {
+        var tbody = document.querySelector('tbody'), doneUrl = '{{ url_for('done', id=0) }}'.slice(0, -1);
+        var pending = {}, timer = null;
+
+        // Tick items off without reloading the page; clicks within 300 ms are saved in one request.
+        function save() {
+            var rows = pending, ids = Object.keys(rows).map(Number);
+            pending = {};
+            fetch('{{ url_for('done_batch') }}', {
+                method: 'POST', headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({ids: ids, completed: true})
+            }).then(function (r) {
+                if (!r.ok) { throw new Error(r.status); }
+                ids.forEach(function (id) { showStatus(rows[id], true); });
+            }).catch(function () { window.location.reload(); });
+        }
+        function onSubmit(event) {
+            var row = event.target.closest('tr');
+            event.preventDefault();
+            event.target.querySelector('button').disabled = true;
+            pending[row.dataset.item] = row;
+            clearTimeout(timer);
+            timer = setTimeout(save, 300);
+        }
+        function showStatus(row, completed) {
+            var cells = row.querySelectorAll('td'), status = cells[2];
+            cells[0].className = cells[1].className = completed ? 'completed' : '';
+            status.textContent = completed ? 'Completed' : '';
+            if (!completed) {
+                var form = document.createElement('form'), button = document.createElement('button');
+                form.method = 'post';
+                form.action = doneUrl + row.dataset.item;
+                form.style.cssText = 'margin:0; padding:0; box-shadow:none; background:none; display:inline;';
+                button.type = 'submit';
+                button.textContent = '\u2714 Mark as Done';
+                form.appendChild(button);
+                form.addEventListener('submit', onSubmit);
+                status.appendChild(form);
+            }
+        }
+        function addRow(change) {
+            var row = document.createElement('tr'), next = null, empty = document.getElementById('no-items');
+            row.dataset.item = change.id;
+            row.dataset.at = change.at;
+            row.insertCell().textContent = change.time;
+            row.insertCell().textContent = change.name;
+            row.insertCell();
+            showStatus(row, false);
+            tbody.querySelectorAll('tr[data-at]').forEach(function (other) {
+                if (!next && Number(other.dataset.at) > change.at) { next = other; }
+            });
+            tbody.insertBefore(row, next);
+            if (empty) { empty.remove(); }
+        }
+        tbody.querySelectorAll('form').forEach(function (form) { form.addEventListener('submit', onSubmit); });
+
+        // Rows the physio adds, or items ticked off on another device, arrive as server-sent events.
+        if (window.EventSource) {
+            var events = new EventSource('{{ url_for('patient_events', after=change_cursor) }}');
+            events.addEventListener('schedule', function (message) {
+                var change = JSON.parse(message.data);
+                var row = tbody.querySelector('tr[data-item="' + change.id + '"]');
+                if (!row) {
+                    if (change.change === 'added') { addRow(change); }
+                } else if (change.change !== 'added') {
+                    showStatus(row, change.change === 'completed');
+                }
+            });
+        }
+    })();
+    </script>
 </body>
 </html>'''
 }
 
+# --- Instrumentation ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def current_endpoint():
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    thread = threading.current_thread()
+    return 'cli' if thread is threading.main_thread() else thread.name
+
+class Metrics:
+    """Per-process request and SQL counters, exported in Prometheus text format.
+
+    With METRICS_DIR set each worker periodically writes its totals to
+    worker-<pid>.json there, and /metrics sums every file, so any worker
+    can answer for the whole gunicorn server.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.requests = {}   # "endpoint|method|status" -> count
+        self.latency = {}    # "endpoint|method" -> [bucket counts..., +Inf count, sum]
+        self.queries = {}    # "endpoint" -> [count, seconds]
+        self.cache = {}      # "cache|hit" or "cache|miss" -> count
+        self._last_flush = 0.0
+
+    def _check_pid(self):
+        if self.pid != os.getpid():  # forked: start from zero in the child
+            self.reset()
+
+    def observe_request(self, endpoint, method, status, seconds):
+        with self._lock:
+            self._check_pid()
+            key = f"{endpoint}|{method}|{status}"
+            self.requests[key] = self.requests.get(key, 0) + 1
+            series = self.latency.setdefault(f"{endpoint}|{method}", [0] * (len(LATENCY_BUCKETS) + 2))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += seconds
+
+    def observe_query(self, endpoint, seconds):
+        with self._lock:
+            self._check_pid()
+            series = self.queries.setdefault(endpoint, [0, 0.0])
+            series[0] += 1
+            series[1] += seconds
+
+    def observe_cache(self, name, hit):
+        with self._lock:
+            self._check_pid()
+            key = f"{name}|{'hit' if hit else 'miss'}"
+            self.cache[key] = self.cache.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            self._check_pid()
+            return {'requests': dict(self.requests),
+                    'latency': {k: list(v) for k, v in self.latency.items()},
+                    'queries': {k: list(v) for k, v in self.queries.items()},
+                    'cache': dict(self.cache)}
+
+    def maybe_flush(self, force=False):
+        if not METRICS_DIR:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < METRICS_FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        path = os.path.join(METRICS_DIR, f"worker-{os.getpid()}.json")
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            current_app.logger.warning("Could not write metrics snapshot: %s", e)
+
+    def collect(self):
+        """Sum every worker's snapshot (or just this process without METRICS_DIR)."""
+        if not METRICS_DIR:
+            return self.snapshot()
+        self.maybe_flush(force=True)
+        total = {'requests': {}, 'latency': {}, 'queries': {}, 'cache': {}}
+        for path in glob.glob(os.path.join(METRICS_DIR, 'worker-*.json')):
+            try:
+                with open(path) as f:
+                    snap = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for section in ('requests', 'cache'):
+                for key, value in snap.get(section, {}).items():
+                    total[section][key] = total[section].get(key, 0) + value
+            for section in ('latency', 'queries'):
+                for key, values in snap[section].items():
+                    acc = total[section].setdefault(key, [0] * len(values))
+                    for i, v in enumerate(values):
+                        acc[i] += v
+        return total
+
+    def render_prometheus(self):
+        data = self.collect()
+        out = ['# HELP http_requests_total Requests by endpoint, method and status.',
+               '# TYPE http_requests_total counter']
+        for key, value in sorted(data['requests'].items()):
+            endpoint, method, status = key.split('|')
+            out.append(f'http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {value}')
+        out += ['# HELP http_request_duration_seconds Time to produce a response, by endpoint.',
+                '# TYPE http_request_duration_seconds histogram']
+        for key, series in sorted(data['latency'].items()):
+            endpoint, method = key.split('|')
+            labels = f'endpoint="{endpoint}",method="{method}"'
+            for bound, count in zip(LATENCY_BUCKETS, series):
+                out.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            out.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {series[-2]}')
+            out.append(f'http_request_duration_seconds_count{{{labels}}} {series[-2]}')
+            out.append(f'http_request_duration_seconds_sum{{{labels}}} {series[-1]:.6f}')
+        out += ['# HELP db_queries_total SQL statements and commits executed, by endpoint.',
+                '# TYPE db_queries_total counter']
+        out += [f'db_queries_total{{endpoint="{k}"}} {v[0]}' for k, v in sorted(data['queries'].items())]
+        out += ['# HELP db_query_seconds_total Time spent executing SQL statements, by endpoint.',
+                '# TYPE db_query_seconds_total counter']
+        out += [f'db_query_seconds_total{{endpoint="{k}"}} {v[1]:.6f}' for k, v in sorted(data['queries'].items())]
+        out += ['# HELP read_cache_lookups_total Read cache lookups by cache and result (hit or miss).',
+                '# TYPE read_cache_lookups_total counter']
+        for key, value in sorted(data['cache'].items()):
+            name, result = key.split('|')
+            out.append(f'read_cache_lookups_total{{cache="{name}",result="{result}"}} {value}')
+        out += ['# HELP read_cache_hit_ratio Fraction of read cache lookups served from memory.',
+                '# TYPE read_cache_hit_ratio gauge']
+        for name in sorted({key.split('|')[0] for key in data['cache']}):
+            hits, misses = data['cache'].get(f"{name}|hit", 0), data['cache'].get(f"{name}|miss", 0)
+            out.append(f'read_cache_hit_ratio{{cache="{name}"}} {hits / (hits + misses):.4f}')
+        return '\n'.join(out) + '\n'
+
+metrics = Metrics()
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection that times every statement and commit for the metrics registry."""
+
+    def execute(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            self._record(start)
+
+    def executemany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            self._record(start)
+
+    def executescript(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executescript(*args)
+        finally:
+            self._record(start)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            self._record(start)
+
+    def _record(self, start):
+        elapsed = time.perf_counter() - start
+        metrics.observe_query(current_endpoint(), elapsed)
+        if has_request_context():
+            g.db_queries = g.get('db_queries', 0) + 1
+            g.db_seconds = g.get('db_seconds', 0.0) + elapsed
+
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+def record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        metrics.observe_request(current_endpoint(), request.method, response.status_code, elapsed)
+        metrics.maybe_flush()
+        if current_app.logger.isEnabledFor(logging.INFO):
+            current_app.logger.info("%s %s %s", request.method, request.path, response.status_code, extra={
+                'method': request.method, 'path': request.path, 'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 2), 'db_queries': g.get('db_queries', 0),
+                'db_ms': round(g.get('db_seconds', 0.0) * 1000, 2)})
+    return response
+
+def metrics_endpoint():
+    if METRICS_TOKEN:
+        allowed = request.headers.get('Authorization') == f"Bearer {METRICS_TOKEN}"
+    else:
+        allowed = request.remote_addr in ('127.0.0.1', '::1')
+    if not allowed:
+        return Response("Forbidden\n", status=403, mimetype='text/plain')
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        for field in ('endpoint', 'method', 'path', 'status', 'duration_ms', 'db_queries', 'db_ms'):
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RequestContextFilter(logging.Filter):
+    """Tag records with the current endpoint and sample INFO-and-below on hot endpoints."""
+
+    def filter(self, record):
+        if not has_request_context():
+            return True
+        record.endpoint = request.endpoint
+        if record.levelno < logging.WARNING and request.endpoint in LOG_SAMPLE_ENDPOINTS:
+            return random.random() < LOG_SAMPLE_RATE
+        return True
+
+class BackgroundLogHandler(logging.handlers.QueueHandler):
+    """Hands records to a per-process listener thread that formats and writes them.
+
+    Message formatting is deferred to the listener, and the thread is
+    (re)started lazily so workers forked from a preloading master log too.
+    """
+
+    def __init__(self, target):
+        super().__init__(queue.SimpleQueue())
+        self.target = target
+        self._pid = None
+        self._listener = None
+        self._start_lock = threading.Lock()
+
+    def prepare(self, record):
+        return record  # formatted by the listener thread, not the request thread
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self.queue = queue.SimpleQueue()
+                    self._listener = logging.handlers.QueueListener(self.queue, self.target,
+                                                                    respect_handler_level=True)
+                    self._listener.start()
+                    self._pid = os.getpid()
+                    atexit.register(self._stop_listener)
+        super().emit(record)
+
+    def _stop_listener(self):
+        """Flush and stop this process's listener thread, if it started one."""
+        with self._start_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+    def close(self):
+        atexit.unregister(self._stop_listener)
+        self._stop_listener()
+        super().close()
+
+def configure_logging(app):
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s in %(module)s: %(message)s"))
+    handler = BackgroundLogHandler(stream_handler)
+    handler.addFilter(RequestContextFilter())
+    app.logger.removeHandler(default_handler)
+    # app.logger is shared by every app built from this module; replace, don't stack, earlier handlers
+    for previous in [h for h in app.logger.handlers if isinstance(h, BackgroundLogHandler)]:
+        app.logger.removeHandler(previous)
+        previous.close()
+    app.logger.addHandler(handler)
+
 # --- Database Functions ---
+class ConnectionPool:
+    """A small per-process pool of long-lived SQLite connections.
+
+    Connections stay open across requests so SQLite's page cache and the
+    sqlite3 module's prepared-statement cache survive between page hits.
+    The pool remembers the PID that created it, so a pool inherited over a
+    gunicorn fork is discarded rather than sharing file handles.
+    """
+
+    def __init__(self, database, size):
+        self.database = database
+        self.size = size
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000.0,
+            cached_statements=DB_STATEMENT_CACHE,
+            check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            factory=InstrumentedConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}")
+        conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size = {DB_CACHE_SIZE}")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self.size <= 0:  # a LifoQueue of maxsize 0 would keep every connection
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool_lock = threading.Lock()
+
+def process_local(kind, database, factory):
+    """This process's `kind` object (pool, writer, feed) for `database`, made by factory() after a fork."""
+    objects = current_app.extensions.setdefault(kind, {})
+    obj = objects.get(database)
+    if obj is None or obj.pid != os.getpid():
+        with _pool_lock:
+            obj = objects.get(database)
+            if obj is None or obj.pid != os.getpid():
+                obj = objects[database] = factory()
+    return obj
+
+def get_pool(database=None):
+    database = database or current_database()
+
+    def create():
+        current_app.logger.debug("Creating connection pool for %s (pid %s)", database, os.getpid())
+        return ConnectionPool(database, DB_POOL_SIZE)
+    return process_local('db_pool', database, create)
+
 def get_db():
     if 'db_conn' not in g:
-        app.logger.debug(f"Connecting to database: {DATABASE_FILE}")
-        g.db_conn = sqlite3.connect(DATABASE_FILE)
-        g.db_conn.row_factory = sqlite3.Row
+        g.db_pool = get_pool()
+        g.db_conn = g.db_pool.acquire()
     return g.db_conn
 
-@app.teardown_appcontext
 def close_db(error):
     db_conn = g.pop('db_conn', None)
+    pool = g.pop('db_pool', None)
     if db_conn is not None:
-        app.logger.debug("Closing database connection.")
-        db_conn.close()
-    if error:
-        app.logger.error(f"Teardown appcontext error: {error}")
+        try:
+            pool.release(db_conn)
+        except sqlite3.Error as e:
+            current_app.logger.error("Discarding pooled connection after error: %s", e)
+            db_conn.close()
+    # GeneratorExit here is a client leaving a streamed response early, not a failure
+    if isinstance(error, Exception):
+        current_app.logger.error("Teardown appcontext error: %s", error)
 
+# --- Sharding ---
+# Written by split-shards next to the shard files; shard paths are relative to its folder
+DIRECTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards(name TEXT PRIMARY KEY, path TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_shards(email TEXT PRIMARY KEY, shard TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS feed_shards(token TEXT PRIMARY KEY, shard TEXT NOT NULL) WITHOUT ROWID;
+"""
 
-@app.before_request
-def init_db_and_user():
-    if not hasattr(app, '_database_initialized'):
-        app.logger.info("Attempting database initialization (once per app instance)...")
-        db = get_db()
-        schema_path = os.path.join(BASE_DIR, 'schema.sql')
+class ShardDirectory:
+    """Maps login emails and calendar tokens to shards, and shards to database files.
+
+    Each clinic's users, schedule and calendars live in their own SQLite
+    file, so writes in one clinic never wait on another clinic's writer
+    lock. Lookups are primary-key reads on a pooled connection; the shard
+    list is cached per process and reloaded when an unknown name appears.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.pool = ConnectionPool(path, DB_POOL_SIZE)
+        self._shards = None
+
+    def _query(self, sql, params=()):
+        conn = self.pool.acquire()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            self.pool.release(conn)
+
+    def shards(self):
+        """{name: database path} of every shard."""
+        if self._shards is None:
+            base = os.path.dirname(os.path.abspath(self.path))
+            self._shards = {name: os.path.join(base, path)
+                            for name, path in self._query("SELECT name, path FROM shards ORDER BY name")}
+        return self._shards
+
+    def database(self, shard):
+        if shard not in self.shards():
+            self._shards = None  # added since the list was read?
+        return self.shards()[shard]
+
+    def shard_for_email(self, email):
+        rows = self._query("SELECT shard FROM user_shards WHERE email = ?", (email,))
+        return rows[0][0] if rows else None
+
+    def shards_for_emails(self, emails):
+        """{email: shard} for those of `emails` the directory already routes."""
+        return dict(self._query("SELECT email, shard FROM user_shards WHERE email IN (SELECT value FROM json_each(?))",
+                                (json.dumps(list(emails)),)))
+
+    def shard_for_token(self, token):
+        rows = self._query("SELECT shard FROM feed_shards WHERE token = ?", (token,))
+        return rows[0][0] if rows else None
+
+    def add_feed_token(self, token, shard):
+        conn = self.pool.acquire()
+        try:
+            conn.execute("INSERT OR REPLACE INTO feed_shards (token, shard) VALUES (?, ?)", (token, shard))
+            conn.commit()
+        finally:
+            self.pool.release(conn)
+
+    def add_users(self, emails, shard):
+        """Route logins of newly imported users; emails already in the directory keep their shard."""
+        conn = self.pool.acquire()
+        try:
+            conn.executemany("INSERT OR IGNORE INTO user_shards (email, shard) VALUES (?, ?)",
+                             ((email, shard) for email in emails))
+            conn.commit()
+        finally:
+            self.pool.release(conn)
+
+    def move_user(self, email, token, shard):
+        """Route a user, and their calendar token if they have one, to another shard."""
+        conn = self.pool.acquire()
+        try:
+            conn.execute("UPDATE user_shards SET shard = ? WHERE email = ?", (shard, email))
+            if token:
+                conn.execute("INSERT OR REPLACE INTO feed_shards (token, shard) VALUES (?, ?)", (token, shard))
+            conn.commit()
+        finally:
+            self.pool.release(conn)
+
+    def add_shard(self, name, path):
+        """Register a shard database; `path` is relative to the directory file."""
+        conn = self.pool.acquire()
+        try:
+            conn.execute("INSERT INTO shards (name, path) VALUES (?, ?)", (name, path))
+            conn.commit()
+        finally:
+            self.pool.release(conn)
+        self._shards = None
+
+def get_shard_directory():
+    path = current_app.config['SHARD_DIRECTORY']
+    return process_local('shard_directory', path, lambda: ShardDirectory(path))
+
+def current_shard():
+    """The shard this request works on (set at login, or by a calendar token); None when unsharded."""
+    if not current_app.config.get('SHARD_DIRECTORY'):
+        return None
+    return g.get('shard') or (session.get('shard') if has_request_context() else None)
+
+def current_database():
+    """The database file get_db() and the per-database workers use for this request."""
+    if not current_app.config.get('SHARD_DIRECTORY'):
+        return current_app.config['DATABASE']
+    shard = current_shard()
+    if shard is None:
+        raise RuntimeError("Sharding is on but no shard was chosen for this request.")
+    return get_shard_directory().database(shard)
+
+def all_databases(app):
+    """[(name, path)] of every database the app serves: each shard, or just DATABASE."""
+    if not app.config.get('SHARD_DIRECTORY'):
+        return [('main', app.config['DATABASE'])]
+    with app.app_context():
+        return list(get_shard_directory().shards().items())
+
+def drop_unsharded_session():
+    """Sessions from before sharding was switched on name no shard; make them log in again."""
+    if current_app.config.get('SHARD_DIRECTORY') and session.get('uid') and not session.get('shard'):
+        session.clear()
+
+def query_shards(databases, sql, params=()):
+    """Run one read-only query on every database at once; return [(name, rows)] in the given order.
+
+    Each database gets its own connection on a thread pool. sqlite3 drops
+    the GIL while a statement runs, so the shards are read in parallel.
+    """
+    def run(item):
+        name, path = item
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=DB_BUSY_TIMEOUT_MS / 1000.0)
+        conn.row_factory = sqlite3.Row
         try:
-            app.logger.info(f"Looking for schema at: {schema_path}")
-            if not os.path.exists(schema_path):
-                app.logger.error(f"CRITICAL: schema.sql not found at {schema_path}. Database cannot be initialized.")
+            return name, conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(SHARD_QUERY_THREADS, len(databases)))) as executor:
+        return list(executor.map(run, databases))
+
+def shard_name(clinic):
+    return re.sub(r'[^a-z0-9]+', '-', clinic.lower()).strip('-') or 'clinic'
+
+def shard_clinic(conn, shard):
+    """The clinic a shard database holds (split-shards makes one per clinic); its name while it has no users."""
+    row = conn.execute("SELECT clinic FROM users GROUP BY clinic ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+    return row[0] if row else shard
+
+def split_into_shards(source, dest_dir):
+    """Copy each clinic of `source` into DEST_DIR/<clinic>.db and write DEST_DIR/directory.db.
+
+    Shards are created by the migrations, so triggers rebuild the search
+    indexes as rows are copied; ids are kept. Archived rows go straight
+    into schedule_archive, so adherence is recounted from both tables.
+    Exercises are shared by all clinics and copied into every shard.
+    Returns [(shard, users, schedule rows including archived ones)].
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    directory_path = os.path.join(dest_dir, 'directory.db')
+    if os.path.exists(directory_path):
+        raise click.ClickException(f"{directory_path} already exists.")
+    src = sqlite3.connect(source)
+    try:
+        clinics = [row[0] for row in src.execute("SELECT DISTINCT clinic FROM users ORDER BY clinic")]
+    finally:
+        src.close()
+
+    directory = sqlite3.connect(directory_path)
+    directory.executescript(DIRECTORY_SCHEMA)
+    directory.execute("ATTACH DATABASE ? AS src", (source,))
+    summary, names = [], set()
+    try:
+        for clinic in clinics:
+            name = shard_name(clinic)
+            while name in names:
+                name += '-x'
+            names.add(name)
+            filename = name + '.db'
+            conn = sqlite3.connect(os.path.join(dest_dir, filename))
+            try:
+                run_migrations(conn)
+                conn.execute("ATTACH DATABASE ? AS src", (source,))
+                conn.execute("INSERT INTO users SELECT * FROM src.users WHERE clinic = ?", (clinic,))
+                conn.execute("INSERT INTO exercises SELECT * FROM src.exercises")
+                rows = conn.execute("""INSERT INTO schedule SELECT s.* FROM src.schedule s
+                                       JOIN src.users u ON u.id = s.patient_id WHERE u.clinic = ?""",
+                                    (clinic,)).rowcount
+                rows += conn.execute("""INSERT INTO schedule_archive SELECT a.* FROM src.schedule_archive a
+                                        JOIN src.users u ON u.id = a.patient_id WHERE u.clinic = ?""",
+                                     (clinic,)).rowcount
+                # Archived ids came from the schedule sequence and must never be handed out again
+                conn.execute("DELETE FROM sqlite_sequence WHERE name = 'schedule'")
+                conn.execute("INSERT INTO sqlite_sequence SELECT name, seq FROM src.sqlite_sequence"
+                             " WHERE name = 'schedule'")
+                conn.execute(ADHERENCE_CLEAR_SQL, (0, sys.maxsize))
+                conn.execute(ADHERENCE_BACKFILL_SQL, (0, sys.maxsize))
+                conn.execute("""INSERT INTO calendar_feeds SELECT f.* FROM src.calendar_feeds f
+                                JOIN src.users u ON u.id = f.patient_id WHERE u.clinic = ?""", (clinic,))
+                conn.execute("DELETE FROM schedule_changes")  # copied rows aren't news to anyone
+                users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+                conn.commit()
+                conn.execute("DETACH DATABASE src")
+                conn.execute("ANALYZE")
+                conn.commit()
+            finally:
+                conn.close()
+            directory.execute("INSERT INTO shards (name, path) VALUES (?, ?)", (name, filename))
+            directory.execute("INSERT INTO user_shards SELECT email, ? FROM src.users WHERE clinic = ?", (name, clinic))
+            directory.execute("""INSERT INTO feed_shards SELECT f.token, ? FROM src.calendar_feeds f
+                                 JOIN src.users u ON u.id = f.patient_id
+                                 WHERE u.clinic = ? AND f.token IS NOT NULL""", (name, clinic))
+            directory.commit()
+            summary.append((name, users, rows))
+    finally:
+        directory.close()
+    return summary
+
+# set-clinic when sharded: ids are only unique within a shard, so a moved user and their
+# schedule get new ids in the target shard, and their exercises are matched by name
+MOVE_USER_SQL = """
+        INSERT INTO users (email, password_hash, role, name, timezone, clinic)
+        SELECT email, password_hash, role, name, timezone, ?2 FROM src.users WHERE id = ?1
+    """
+MOVE_EXERCISES_SQL = """
+        INSERT INTO main.exercises (name)
+        SELECT DISTINCT e.name FROM src.exercises e
+        WHERE e.id IN (SELECT exercise_id FROM src.schedule WHERE patient_id = ?1
+                       UNION SELECT exercise_id FROM src.schedule_archive WHERE patient_id = ?1)
+          AND NOT EXISTS (SELECT 1 FROM main.exercises d WHERE d.name IS e.name)
+    """
+MOVED_EXERCISE_ID = ("(SELECT MIN(d.id) FROM src.exercises e JOIN main.exercises d ON d.name IS e.name"
+                     " WHERE e.id = s.exercise_id)")
+MOVE_SCHEDULE_SQL = f"""
+        INSERT INTO main.schedule (patient_id, exercise_id, scheduled_at, completed, reminded_at, reminder_lease)
+        SELECT ?2, {MOVED_EXERCISE_ID}, s.scheduled_at, s.completed, s.reminded_at, s.reminder_lease
+        FROM src.schedule s WHERE s.patient_id = ?1 ORDER BY s.id
+    """
+MOVED_ARCHIVE_SQL = f"""
+        SELECT {MOVED_EXERCISE_ID}, s.scheduled_at, s.completed, s.reminded_at, s.archived_at
+        FROM src.schedule_archive s WHERE s.patient_id = ? ORDER BY s.id
+    """
+MOVE_TO_ARCHIVE_SQL = """
+        INSERT INTO main.schedule_archive (id, patient_id, exercise_id, scheduled_at, completed, reminded_at, archived_at)
+        SELECT id, patient_id, exercise_id, scheduled_at, completed, reminded_at, ?1 FROM main.schedule WHERE id = ?2
+    """
+MOVE_FEED_SQL = """
+        INSERT INTO main.calendar_feeds (patient_id, version, updated_at, token)
+        SELECT ?2, version + 1, ?3, token FROM src.calendar_feeds WHERE patient_id = ?1
+        RETURNING token
+    """
+
+def clinic_shard(directory, clinic, exercises_from):
+    """The shard holding `clinic`'s users; a new shard, with the exercises of `exercises_from`, if none does."""
+    for name, rows in query_shards(list(directory.shards().items()),
+                                   "SELECT 1 FROM users WHERE clinic = ? LIMIT 1", (clinic,)):
+        if rows:
+            return name
+    name = shard_name(clinic)
+    while name in directory.shards():
+        name += '-x'
+    filename = name + '.db'
+    path = os.path.join(os.path.dirname(os.path.abspath(directory.path)), filename)
+    if os.path.exists(path):
+        raise click.ClickException(f"{path} already exists but is not in the shard directory.")
+    conn = sqlite3.connect(path)
+    try:
+        run_migrations(conn)
+        conn.execute("ATTACH DATABASE ? AS src", (exercises_from,))
+        conn.execute("INSERT INTO exercises SELECT * FROM src.exercises")  # as split-shards does
+        conn.commit()
+    finally:
+        conn.close()
+    directory.add_shard(name, filename)
+    return name
+
+def move_user(directory, email, source, target, clinic):
+    """Move a user with their schedule, archive and calendar feed from shard `source` to `target`.
+
+    Rows are copied and deleted in one transaction across both files, with
+    the copies going through the target's triggers like new rows (the
+    change log they write is dropped again), then the directory routes the
+    user's logins and calendar token to `target`. Returns the schedule rows
+    moved.
+    """
+    now = int(time.time())
+    conn = sqlite3.connect(directory.database(target), timeout=DB_BUSY_TIMEOUT_MS / 1000.0)
+    try:
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("ATTACH DATABASE ? AS src", (directory.database(source),))
+        conn.execute("BEGIN IMMEDIATE")
+        old_id = conn.execute("SELECT id FROM src.users WHERE email = ?", (email,)).fetchone()[0]
+        if conn.execute("SELECT 1 FROM main.users WHERE email = ?", (email,)).fetchone():
+            raise click.ClickException(f"{email} already exists in shard {target}.")
+        last_change = conn.execute(CHANGE_CURSOR_SQL).fetchone()[0] or 0
+        new_id = conn.execute(MOVE_USER_SQL, (old_id, clinic)).lastrowid
+        conn.execute(MOVE_EXERCISES_SQL, (old_id,))
+        rows = conn.execute(MOVE_SCHEDULE_SQL, (old_id, new_id)).rowcount
+        # Archived rows enter the schedule first so adherence counts them and they draw
+        # schedule ids, then leave it the way archive_history moves rows
+        archived = conn.execute(MOVED_ARCHIVE_SQL, (old_id,)).fetchall()
+        for exercise_id, scheduled_at, completed, reminded_at, archived_at in archived:
+            schedule_id = conn.execute(
+                "INSERT INTO main.schedule (patient_id, exercise_id, scheduled_at, completed, reminded_at)"
+                " VALUES (?, ?, ?, ?, ?)", (new_id, exercise_id, scheduled_at, completed, reminded_at)).lastrowid
+            conn.execute(MOVE_TO_ARCHIVE_SQL, (archived_at, schedule_id))
+            conn.execute("DELETE FROM main.schedule WHERE id = ?", (schedule_id,))
+        conn.execute("DELETE FROM main.schedule_changes WHERE id > ?", (last_change,))
+        token = (conn.execute(MOVE_FEED_SQL, (old_id, new_id, now)).fetchone() or (None,))[0]
+        conn.execute("DELETE FROM src.adherence_weekly WHERE patient_id = ?", (old_id,))
+        conn.execute("DELETE FROM src.schedule_changes WHERE patient_id = ?", (old_id,))
+        conn.execute("DELETE FROM src.users WHERE id = ?", (old_id,))  # cascades to schedule, archive and feed
+        conn.commit()
+    finally:
+        conn.close()
+    directory.move_user(email, token, target)
+    return rows + len(archived)
+
+@click.command('split-shards')
+@with_appcontext
+@click.argument('dest_dir')
+def split_shards_command(dest_dir):
+    """Split DATABASE into one database per clinic in DEST_DIR.
+
+    Run it with the app stopped, then start the app with
+    SHARD_DIRECTORY=DEST_DIR/directory.db.
+    """
+    for name, users, rows in split_into_shards(current_app.config['DATABASE'], dest_dir):
+        click.echo(f"{name}: {users} users, {rows} schedule rows")
+    click.echo(f"Set SHARD_DIRECTORY={os.path.join(dest_dir, 'directory.db')} to serve the shards.")
+
+SHARD_STATS_SQL = """
+        SELECT (SELECT COUNT(*) FROM users WHERE role = 'physio') AS physios,
+               (SELECT COUNT(*) FROM users WHERE role = 'patient') AS patients,
+               (SELECT COUNT(*) FROM schedule) AS schedule_rows,
+               (SELECT COUNT(*) FROM schedule WHERE completed = 0) AS open_items
+    """
+
+@click.command('shard-stats')
+@with_appcontext
+def shard_stats_command():
+    """Count users and schedule rows in every shard, querying them in parallel."""
+    started = time.perf_counter()
+    results = query_shards(all_databases(current_app), SHARD_STATS_SQL)
+    totals = [0, 0, 0, 0]
+    for name, rows in results:
+        row = rows[0]
+        totals = [t + v for t, v in zip(totals, row)]
+        click.echo(f"{name:20} physios={row[0]} patients={row[1]} schedule_rows={row[2]} open_items={row[3]}")
+    click.echo(f"{'total':20} physios={totals[0]} patients={totals[1]} schedule_rows={totals[2]} open_items={totals[3]}"
+               f" ({len(results)} databases in {time.perf_counter() - started:.2f}s)")
+
+@click.command('shard-query')
+@with_appcontext
+@click.argument('sql')
+def shard_query_command(sql):
+    """Run a read-only SQL query on every shard in parallel; rows are printed tab-separated after the shard name."""
+    try:
+        results = query_shards(all_databases(current_app), sql)
+    except sqlite3.Error as e:
+        raise click.ClickException(str(e))
+    for name, rows in results:
+        for row in rows:
+            click.echo('\t'.join([name] + ['' if v is None else str(v) for v in row]))
+
+# --- Read Cache ---
+class ReadCache:
+    """Per-worker LRU cache whose entries are tagged with a data generation.
+
+    Workers cannot see each other's memory, so callers read the current
+    generation from the database (a one-row primary-key lookup) and pass it
+    in; an entry stored under any other generation, or older than `ttl`
+    seconds, is reloaded. Writes in one worker thereby invalidate every
+    worker's copy without any cross-process signalling.
+    """
+
+    def __init__(self, name, maxsize, ttl):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (generation, stored_at, value)
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, generation, load):
+        if self.maxsize <= 0:
+            return load()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            hit = entry is not None and entry[0] == generation and now - entry[1] < self.ttl
+            if hit:
+                self._entries.move_to_end(key)
+        metrics.observe_cache(self.name, hit)
+        if hit:
+            return entry[2]
+        value = load()
+        with self._lock:
+            self._entries[key] = (generation, now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+def cache_generation(db, name):
+    """Current generation of a cached table group ('patients' or 'exercises')."""
+    return db.execute(CACHE_GENERATION_SQL, (name,)).fetchone()[0]
+
+picker_cache = ReadCache('picker', READ_CACHE_SIZE, READ_CACHE_TTL)
+today_cache = ReadCache('patient_today', READ_CACHE_SIZE, READ_CACHE_TTL)
+
+# --- Group Commit ---
+class GroupCommitWriter:
+    """Runs small write jobs from many request threads in shared transactions.
+
+    A background thread collects whatever jobs queued up while the previous
+    batch was committing, waits up to `window` seconds for more, and runs
+    them inside one BEGIN IMMEDIATE ... COMMIT, each job in its own
+    savepoint so a failing job is rolled back alone. submit() returns only
+    after that commit, made with GROUP_COMMIT_SYNCHRONOUS (FULL by default),
+    so an acknowledged write is durable at the cost of one fsync per batch.
+    A job whose caller stops waiting before its batch starts is cancelled
+    and never runs.
+    """
+
+    def __init__(self, database, window, max_batch, logger):
+        self.database = database
+        self.window = window
+        self.max_batch = max_batch
+        self.logger = logger
+        self.pid = os.getpid()
+        self._jobs = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, func, *args, timeout=None):
+        """Run func(conn, *args) in the next batch and return its result once committed."""
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='group_commit', daemon=True)
+                    self._thread.start()
+        future = Future()
+        self._jobs.put((func, args, future))
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise
+            return future.result()  # already inside a transaction; its outcome is imminent
+
+    def _next_batch(self):
+        batch = [self._jobs.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._jobs.get(timeout=remaining) if remaining > 0 else self._jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _connect(self):
+        conn = ConnectionPool(self.database, 1).acquire()
+        conn.execute(f"PRAGMA synchronous = {GROUP_COMMIT_SYNCHRONOUS}")
+        return conn
+
+    def _run(self):
+        conn, delay = None, 0
+        while True:
+            batch = self._next_batch()
+            try:
+                if conn is None:
+                    time.sleep(delay)
+                    conn = self._connect()
+                    delay = 0
+                self._commit(conn, batch)
+            except Exception as e:
+                self.logger.exception("Group commit of %s jobs failed", len(batch))
+                if conn is None:
+                    delay = min(max(delay * 2, 0.1), 5.0)  # back off before reconnecting
+                elif conn.in_transaction:
+                    try:
+                        conn.rollback()
+                    except sqlite3.Error:
+                        conn = None
+                self._fail(batch, e)
+
+    @staticmethod
+    def _fail(batch, error):
+        for _, _, future in batch:
+            if future.done():
+                continue
+            if future.running() or future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def _commit(self, conn, batch):
+        outcomes = []
+        conn.execute("BEGIN IMMEDIATE")
+        for func, args, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue  # its caller timed out and gave up on it
+            conn.execute("SAVEPOINT job")
+            try:
+                outcomes.append((future, func(conn, *args), None))
+            except Exception as e:
+                conn.execute("ROLLBACK TO job")
+                outcomes.append((future, None, e))
+            conn.execute("RELEASE job")
+        conn.commit()
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
             else:
-                with open(schema_path, 'r') as f:
-                    db.executescript(f.read())
-                app.logger.info("Database schema executed.")
-
-                # Create default Physio User
-                cursor = db.execute('SELECT id FROM users WHERE email = ?', ("physio@example.com",))
-                if cursor.fetchone() is None:
-                    app.logger.info("Default physio user not found, creating...")
-                    db.execute("INSERT INTO users (email, password_hash, role, name) VALUES (?, ?, ?, ?)",
-                                 ("physio@example.com", generate_password_hash("secret"), "physio", "Dr. Physio"))
-                    db.commit()
-                    app.logger.info("Default physio user created.")
-                else:
-                    app.logger.info("Default physio user already exists.")
-
-                # Create default Patient User <<-- ADDED THIS SECTION -->>
-                cursor = db.execute('SELECT id FROM users WHERE email = ?', ("patient@example.com",))
-                if cursor.fetchone() is None:
-                    app.logger.info("Default patient user not found, creating...")
-                    db.execute("INSERT INTO users (email, password_hash, role, name) VALUES (?, ?, ?, ?)",
-                                 ("patient@example.com", generate_password_hash("secret"), "patient", "Pat Patient"))
-                    db.commit()
-                    app.logger.info("Default patient user created.")
-                else:
-                    app.logger.info("Default patient user already exists.")
-                # <<-- END OF ADDED SECTION -->>
-
-                # Create default Exercise
-                cursor = db.execute('SELECT id FROM exercises WHERE name = ?', ("Cat-Camel",))
-                if cursor.fetchone() is None:
-                    app.logger.info("Default exercise 'Cat-Camel' not found, creating...")
-                    db.execute("INSERT INTO exercises (name) VALUES (?)", ("Cat-Camel",))
-                    db.commit()
-                    app.logger.info("Default exercise 'Cat-Camel' created.")
-                else:
-                    app.logger.info("Default exercise 'Cat-Camel' already exists.")
-            
-            app._database_initialized = True
-            app.logger.info("Database initialization process completed.")
-        except sqlite3.Error as e:
-            app.logger.error(f"SQLite error during database initialization: {e}")
-        except FileNotFoundError:
-            app.logger.error(f"CRITICAL: schema.sql file not found at {schema_path} during open().")
-        except Exception as e:
-            app.logger.error(f"An unexpected error occurred during database initialization: {e}")
+                future.set_exception(error)
+
+def get_writer():
+    database = current_database()
+    return process_local('group_commit', database, lambda: GroupCommitWriter(
+        database, GROUP_COMMIT_WINDOW_MS / 1000.0, GROUP_COMMIT_MAX_BATCH, current_app.logger))
+
+
+# --- Time Storage ---
+# schedule.scheduled_at holds integer UTC epoch seconds (declared type EPOCH);
+# the converter below hands rows back as aware UTC datetimes.
+sqlite3.register_converter("EPOCH", lambda value: datetime.datetime.fromtimestamp(int(value), datetime.timezone.utc))
+
+@functools.lru_cache(maxsize=None)
+def get_zone(name):
+    try:
+        return zoneinfo.ZoneInfo(name or 'UTC')
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        current_app.logger.error("Unknown timezone %r, falling back to UTC.", name)
+        return datetime.timezone.utc
+
+def to_epoch(local_dt, zone):
+    """Interpret a naive wall-clock datetime in `zone` and return UTC epoch seconds."""
+    return int(local_dt.replace(tzinfo=zone).timestamp())
+
+def day_window(day, zone):
+    """Return the [start, end) epoch range of a calendar day in `zone`."""
+    start = datetime.datetime.combine(day, datetime.time.min)
+    return to_epoch(start, zone), to_epoch(start + datetime.timedelta(days=1), zone)
+
+
+# --- Schema Migrations ---
+def list_migrations():
+    """Return [(version, name, path)] for migrations/NNNN_name.sql, in order."""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = re.match(r'^(\d+)_(\w+)\.sql$', filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return migrations
+
+def schema_version(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS schema_migrations(
+        version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TEXT NOT NULL)""")
+    row = conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()
+    return row[0] or 0
+
+# Rows a migration could not carry over and set aside: version -> (count query, warning)
+MIGRATION_LEFTOVERS = {
+    4: ("SELECT COUNT(*) FROM schedule_unreadable",
+        "%s schedule row(s) had no readable scheduled_at and were moved to schedule_unreadable."),
+}
+
+def pending_migrations(conn):
+    current = schema_version(conn)
+    return [m for m in list_migrations() if m[0] > current]
+
+def run_migrations(conn):
+    """Apply every pending migration, each in its own transaction.
+
+    Foreign key enforcement is switched off while tables are rebuilt and
+    checked afterwards, which is the procedure SQLite documents for
+    ALTER TABLE work. Returns the list of applied (version, name) pairs.
+    """
+    applied = []
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for version, name, path in pending_migrations(conn):
+            with open(path, 'r') as f:
+                sql = f.read()
+            current_app.logger.info("Applying migration %04d_%s", version, name)
+            try:
+                conn.executescript(
+                    "BEGIN;\n" + sql +
+                    f"\nINSERT INTO schema_migrations (version, name, applied_at)"
+                    f" VALUES ({version}, '{name}', datetime('now'));\nCOMMIT;"
+                )
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            applied.append((version, name))
+            leftover = MIGRATION_LEFTOVERS.get(version)
+            count = leftover and conn.execute(leftover[0]).fetchone()[0]
+            if count:
+                current_app.logger.warning(leftover[1], count)
+        for violation in conn.execute("PRAGMA foreign_key_check").fetchall():
+            current_app.logger.warning("Foreign key violation after migration: %s", tuple(violation))
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+    return applied
+
+@click.command('migrate')
+@with_appcontext
+def migrate_command():
+    """Apply pending schema migrations to the configured database (every shard when sharded)."""
+    sharded = bool(current_app.config.get('SHARD_DIRECTORY'))
+    for shard, database in all_databases(current_app):
+        prefix = f"{shard}: " if sharded else ""
+        conn = sqlite3.connect(database)
+        try:
+            applied = run_migrations(conn)
+            for version, name in applied:
+                click.echo(f"{prefix}Applied {version:04d}_{name}")
+            click.echo(f"{prefix}Schema is at version {schema_version(conn)}.")
+        finally:
+            conn.close()
+
+# Route queries, kept here so `check-query-plans` inspects exactly what the routes run
+LOGIN_USER_SQL = "SELECT * FROM users WHERE email = ?"
+# Physio pickers: keyset-paginated by id, optionally filtered through the FTS5 search tables
+PATIENT_PAGE_SQL = "SELECT rowid AS id, email, name FROM patient_search WHERE rowid > ? ORDER BY rowid LIMIT ?"
+PATIENT_SEARCH_SQL = """
+        SELECT rowid AS id, email, name FROM patient_search
+        WHERE patient_search MATCH ? AND rowid > ? ORDER BY rowid LIMIT ?
+    """
+EXERCISE_PAGE_SQL = "SELECT id, name FROM exercises WHERE id > ? ORDER BY id LIMIT ?"
+EXERCISE_SEARCH_SQL = """
+        SELECT rowid AS id, name FROM exercise_search
+        WHERE exercise_search MATCH ? AND rowid > ? ORDER BY rowid LIMIT ?
+    """
+ASSIGN_SQL = "INSERT INTO schedule (patient_id, exercise_id, scheduled_at) VALUES (?, ?, ?)"
+PATIENT_TODAY_SQL = """
+        SELECT s.id, e.name, s.scheduled_at, s.completed 
+        FROM schedule s
+        JOIN exercises e ON e.id = s.exercise_id 
+        WHERE s.patient_id = ? AND s.scheduled_at >= ? AND s.scheduled_at < ?
+        ORDER BY s.scheduled_at ASC
+    """
+DONE_SQL = """
+        UPDATE schedule SET completed = ?
+        WHERE patient_id = ? AND completed != ? AND id IN (SELECT value FROM json_each(?))
+        RETURNING id
+    """
+ICS_OPEN_ITEMS_SQL = """
+        SELECT s.id, e.name, s.scheduled_at 
+        FROM schedule s
+        JOIN exercises e ON e.id = s.exercise_id
+        WHERE s.patient_id = ? AND s.completed = 0 
+    """
+# CAST keeps scheduled_at a raw epoch int here (the EPOCH converter skips expressions)
+ASSIGN_CONFLICTS_SQL = """
+        SELECT patient_id, exercise_id, CAST(scheduled_at AS INTEGER) FROM schedule
+        WHERE patient_id IN (SELECT value FROM json_each(?)) AND scheduled_at BETWEEN ? AND ?
+    """
+CHANGE_CURSOR_SQL = "SELECT MAX(id) FROM schedule_changes"
+# Changes for the patients with open streams (walked in id order; the unary + keeps the
+# planner off the patient index), and a single patient's backlog on reconnect
+CHANGES_SQL = """
+        SELECT c.id, c.patient_id, c.schedule_id, c.kind, c.scheduled_at, e.name
+        FROM schedule_changes c
+        LEFT JOIN schedule s ON s.id = c.schedule_id
+        LEFT JOIN exercises e ON e.id = s.exercise_id
+        WHERE c.id > ? AND c.id <= ? AND +c.patient_id IN (SELECT value FROM json_each(?))
+        ORDER BY c.id
+    """
+PATIENT_CHANGES_SQL = """
+        SELECT c.id, c.patient_id, c.schedule_id, c.kind, c.scheduled_at, e.name
+        FROM schedule_changes c
+        LEFT JOIN schedule s ON s.id = c.schedule_id
+        LEFT JOIN exercises e ON e.id = s.exercise_id
+        WHERE c.patient_id = ? AND c.id > ? AND c.id <= ?
+        ORDER BY c.id
+    """
+# Everything before the first change young enough to keep
+CHANGE_PRUNE_SQL = """
+        DELETE FROM schedule_changes WHERE id < COALESCE(
+            (SELECT id FROM schedule_changes WHERE changed_at >= ? ORDER BY id LIMIT 1),
+            (SELECT MAX(id) + 1 FROM schedule_changes))
+    """
+# Due reminders, all walked through idx_schedule_reminder_due: lease the next rows coming due,
+# load what the message needs, mark delivered rows sent, and skip rows too late to be useful
+REMINDER_CLAIM_SQL = """
+        UPDATE schedule SET reminder_lease = ?
+        WHERE id IN (SELECT id FROM schedule
+                     WHERE reminded_at IS NULL AND completed = 0 AND scheduled_at >= ? AND scheduled_at <= ?
+                       AND (reminder_lease IS NULL OR reminder_lease < ?)
+                     ORDER BY scheduled_at LIMIT ?)
+        RETURNING id
+    """
+REMINDER_DETAILS_SQL = """
+        SELECT s.id, CAST(s.scheduled_at AS INTEGER) AS scheduled_at, e.name AS exercise,
+               u.email, u.name, u.timezone
+        FROM schedule s
+        JOIN users u ON u.id = s.patient_id
+        JOIN exercises e ON e.id = s.exercise_id
+        WHERE s.id IN (SELECT value FROM json_each(?))
+    """
+REMINDER_SENT_SQL = """
+        UPDATE schedule SET reminded_at = ?, reminder_lease = NULL
+        WHERE id IN (SELECT value FROM json_each(?)) AND reminded_at IS NULL
+    """
+REMINDER_EXPIRE_SQL = """
+        UPDATE schedule SET reminded_at = 0
+        WHERE id IN (SELECT id FROM schedule
+                     WHERE reminded_at IS NULL AND completed = 0 AND scheduled_at < ?
+                     ORDER BY scheduled_at LIMIT ?)
+    """
+REMINDER_NEXT_SQL = """
+        SELECT MIN(scheduled_at) FROM schedule
+        WHERE reminded_at IS NULL AND completed = 0 AND scheduled_at > ?
+    """
+# Adherence report: a window of weekly aggregates and this week's open rows for a page of patients
+PATIENT_BY_ID_SQL = "SELECT id, email, name FROM users WHERE id = ? AND role = 'patient'"
+ADHERENCE_WEEKS_SQL = """
+        SELECT patient_id, week_start, exercise_id, assigned, completed FROM adherence_weekly
+        WHERE patient_id IN (SELECT value FROM json_each(?)) AND week_start >= ? AND week_start <= ?
+    """
+ADHERENCE_OPEN_SQL = """
+        SELECT patient_id, exercise_id, CAST(scheduled_at AS INTEGER) AS scheduled_at FROM schedule
+        WHERE patient_id IN (SELECT value FROM json_each(?)) AND completed = 0
+          AND scheduled_at >= ? AND scheduled_at < ?
+    """
+EXERCISE_NAMES_SQL = "SELECT id, name FROM exercises WHERE id IN (SELECT value FROM json_each(?))"
+# backfill-adherence: recount a range of patient ids (same week arithmetic as the 0009 triggers)
+ADHERENCE_CLEAR_SQL = "DELETE FROM adherence_weekly WHERE patient_id >= ? AND patient_id < ?"
+ADHERENCE_BACKFILL_SQL = """
+        INSERT INTO adherence_weekly (patient_id, week_start, exercise_id, assigned, completed)
+        SELECT patient_id, (scheduled_at / 86400 - (scheduled_at / 86400 + 3) % 7) * 86400 AS week,
+               exercise_id, COUNT(*), SUM(completed != 0)
+        FROM (SELECT patient_id, scheduled_at, exercise_id, completed FROM schedule
+              WHERE patient_id >= ?1 AND patient_id < ?2
+              UNION ALL
+              SELECT patient_id, scheduled_at, exercise_id, completed FROM schedule_archive
+              WHERE patient_id >= ?1 AND patient_id < ?2)
+        GROUP BY patient_id, week, exercise_id
+    """
+# Archiving: the next ids old enough (walked in id order, read outside the write transaction),
+# then copy and delete them in one short one; the age is checked again in case a row moved
+ARCHIVE_CANDIDATES_SQL = "SELECT id FROM schedule WHERE id > ? AND scheduled_at < ? ORDER BY id LIMIT ?"
+ARCHIVE_COPY_SQL = """
+        INSERT INTO schedule_archive (id, patient_id, exercise_id, scheduled_at, completed, reminded_at, archived_at)
+        SELECT id, patient_id, exercise_id, scheduled_at, completed, reminded_at, ?1 FROM schedule
+        WHERE id IN (SELECT value FROM json_each(?2)) AND scheduled_at < ?3
+        RETURNING patient_id
+    """
+ARCHIVE_DELETE_SQL = """
+        DELETE FROM schedule WHERE id IN (SELECT value FROM json_each(?)) AND scheduled_at < ?
+    """
+# Export: one keyset page of a clinic's history in id order, or of one patient's in time order,
+# merged from the live and archive tables (ids never repeat between them)
+EXPORT_CLINIC_SQL = """
+        SELECT id, patient_id, exercise_id, CAST(scheduled_at AS INTEGER), completed, archived FROM (
+            SELECT id, patient_id, exercise_id, scheduled_at, completed, 1 AS archived FROM schedule_archive
+            WHERE id > ?1
+            UNION ALL
+            SELECT id, patient_id, exercise_id, scheduled_at, completed, 0 FROM schedule WHERE id > ?1
+            ORDER BY id LIMIT ?2)
+    """
+EXPORT_PATIENT_SQL = """
+        SELECT id, patient_id, exercise_id, CAST(scheduled_at AS INTEGER), completed, archived FROM (
+            SELECT id, patient_id, exercise_id, scheduled_at, completed, 1 AS archived FROM schedule_archive
+            WHERE patient_id = ?1 AND (scheduled_at, id) > (?2, ?3)
+            UNION ALL
+            SELECT id, patient_id, exercise_id, scheduled_at, completed, 0 FROM schedule
+            WHERE patient_id = ?1 AND (scheduled_at, id) > (?2, ?3)
+            ORDER BY scheduled_at, id LIMIT ?4)
+    """
+EXPORT_PATIENTS_SQL = "SELECT id, email FROM users WHERE role = 'patient'"
+EXPORT_EXERCISES_SQL = "SELECT id, name FROM exercises"
+# Import: new patients (existing emails are left alone), exercises, and schedule rows;
+# imported rows already in the past never get a reminder
+IMPORT_PATIENT_SQL = """
+        INSERT INTO users (email, password_hash, role, name, timezone, clinic) VALUES (?, ?, 'patient', ?, ?, ?)
+        ON CONFLICT(email) DO NOTHING
+    """
+IMPORT_EXERCISE_SQL = "INSERT INTO exercises (name) VALUES (?)"
+IMPORT_SCHEDULE_SQL = """
+        INSERT INTO schedule (patient_id, exercise_id, scheduled_at, completed, reminded_at)
+        VALUES (?, ?, ?, ?, CASE WHEN ?3 < ?5 THEN 0 END)
+    """
+IMPORT_QUIET_CHANGES_SQL = "DELETE FROM schedule_changes WHERE id > ? AND scheduled_at < ?"
+CACHE_GENERATION_SQL = "SELECT generation FROM cache_generations WHERE name = ?"
+FEED_BY_PATIENT_SQL = "SELECT patient_id, version, updated_at, token FROM calendar_feeds WHERE patient_id = ?"
+FEED_BY_TOKEN_SQL = "SELECT patient_id, version, updated_at, token FROM calendar_feeds WHERE token = ?"
+FEED_BUMP_SQL = """
+        INSERT INTO calendar_feeds (patient_id, version, updated_at) VALUES (?, 1, ?)
+        ON CONFLICT(patient_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at
+    """
+
+ROUTE_QUERIES = {
+    'login': (LOGIN_USER_SQL, ('x@example.com',)),
+    'physio.patients': (PATIENT_PAGE_SQL, (0, 20)),
+    'physio.search.patients': (PATIENT_SEARCH_SQL, ('"pat"*', 0, 20)),
+    'physio.exercises': (EXERCISE_PAGE_SQL, (0, 20)),
+    'physio.search.exercises': (EXERCISE_SEARCH_SQL, ('"cat"*', 0, 20)),
+    'patient.today': (PATIENT_TODAY_SQL, (1, 946684800, 946771200)),
+    'done': (DONE_SQL, (1, 1, 1, '[1, 2]')),
+    'calendar.ics': (ICS_OPEN_ITEMS_SQL, (1,)),
+    'calendar.feed': (FEED_BY_TOKEN_SQL, ('token',)),
+    'cache.generation': (CACHE_GENERATION_SQL, ('patients',)),
+    'patient.cursor': (CHANGE_CURSOR_SQL, ()),
+    'events.changes': (CHANGES_SQL, (0, 100, '[1, 2]')),
+    'events.replay': (PATIENT_CHANGES_SQL, (1, 0, 100)),
+    'assign.bulk.conflicts': (ASSIGN_CONFLICTS_SQL, ('[1, 2]', 946684800, 978307199)),
+    'adherence.patient': (PATIENT_BY_ID_SQL, (1,)),
+    'adherence.weeks': (ADHERENCE_WEEKS_SQL, ('[1, 2]', 946252800, 952905600)),
+    'adherence.open': (ADHERENCE_OPEN_SQL, ('[1, 2]', 952905600, 953510400)),
+    'adherence.exercises': (EXERCISE_NAMES_SQL, ('[1, 2]',)),
+    'reminders.claim': (REMINDER_CLAIM_SQL, (946685100, 946684800, 946685700, 946684800, 500)),
+    'reminders.details': (REMINDER_DETAILS_SQL, ('[1, 2]',)),
+    'reminders.sent': (REMINDER_SENT_SQL, (946684800, '[1, 2]')),
+    'reminders.expire': (REMINDER_EXPIRE_SQL, (946681200, 500)),
+    'reminders.next': (REMINDER_NEXT_SQL, (946685700,)),
+    'archive.candidates': (ARCHIVE_CANDIDATES_SQL, (0, 946684800, 2000)),
+    'archive.copy': (ARCHIVE_COPY_SQL, (946684800, '[1, 2]', 946684800)),
+    'archive.delete': (ARCHIVE_DELETE_SQL, ('[1, 2]', 946684800)),
+    'export.clinic': (EXPORT_CLINIC_SQL, (0, 5000)),
+    'export.patient': (EXPORT_PATIENT_SQL, (1, 0, 0, 5000)),
+}
+# Route queries that read a whole table by design
+ALLOWED_FULL_SCANS = set()
+
+def unindexed_plan_steps(conn, sql, params):
+    """Return EXPLAIN QUERY PLAN steps that read a table without any index or sort in a temp b-tree."""
+    plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return [row[3] for row in plan
+            if (row[3].startswith('SCAN') and 'INDEX' not in row[3] and not row[3].startswith('SCAN (subquery'))
+            or 'TEMP B-TREE' in row[3]]
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans_command():
+    """Fail if any route query plan contains an unexpected full table scan."""
+    conn = sqlite3.connect(all_databases(current_app)[0][1])  # shards share one schema
+    try:
+        failures = 0
+        for route, (sql, params) in ROUTE_QUERIES.items():
+            bad_steps = unindexed_plan_steps(conn, sql, params)
+            if not bad_steps:
+                status = 'ok'
+            elif route in ALLOWED_FULL_SCANS:
+                status = 'ok (full scan allowed)'
+            else:
+                status = 'FULL SCAN: ' + '; '.join(bad_steps)
+                failures += 1
+            click.echo(f"{route:24} {status}")
+    finally:
+        conn.close()
+    if failures:
+        raise SystemExit(1)
+
+@click.command('set-timezone')
+@with_appcontext
+@click.argument('email')
+@click.argument('timezone')
+def set_timezone_command(email, timezone):
+    """Set the IANA timezone (e.g. Europe/Zurich) a user's schedule is shown in."""
+    try:
+        zoneinfo.ZoneInfo(timezone)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise click.BadParameter(f"Unknown timezone: {timezone}")
+    database = current_app.config['DATABASE']
+    if current_app.config.get('SHARD_DIRECTORY'):
+        directory = get_shard_directory()
+        shard = directory.shard_for_email(email)
+        database = directory.database(shard) if shard else database
+    conn = sqlite3.connect(database)
+    try:
+        updated = conn.execute("UPDATE users SET timezone = ? WHERE email = ?", (timezone, email)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    click.echo(f"Updated {updated} user(s); takes effect at their next login.")
+
+@click.command('set-clinic')
+@with_appcontext
+@click.argument('email')
+@click.argument('clinic')
+def set_clinic_command(email, clinic):
+    """Put a user in a clinic; split-shards gives every clinic its own database.
+
+    When sharded, a user whose shard holds no one else from CLINIC moves,
+    with their history, to the shard that does (a new one if none does).
+    """
+    database = current_app.config['DATABASE']
+    if current_app.config.get('SHARD_DIRECTORY'):
+        directory = get_shard_directory()
+        shard = directory.shard_for_email(email)
+        if shard is None:
+            raise click.ClickException(f"No user with email {email}.")
+        target = clinic_shard(directory, clinic, directory.database(shard))
+        if target != shard:
+            rows = move_user(directory, email, shard, target, clinic)
+            click.echo(f"Moved {email} from {shard} to {target} with {rows} schedule rows;"
+                       " takes effect at their next login.")
+            return
+        database = directory.database(shard)
+    conn = sqlite3.connect(database)
+    try:
+        updated = conn.execute("UPDATE users SET clinic = ? WHERE email = ?", (clinic, email)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    if current_app.config.get('SHARD_DIRECTORY'):
+        click.echo(f"Updated {updated} user(s).")
+    else:
+        click.echo(f"Updated {updated} user(s); takes effect at the next split-shards.")
+
+
+# --- Seed Data ---
+DEFAULT_USERS = [
+    ("physio@example.com", "secret", "physio", "Dr. Physio"),
+    ("patient@example.com", "secret", "patient", "Pat Patient"),
+]
+DEFAULT_EXERCISES = ["Cat-Camel"]
+
+def seed_defaults(conn, users=DEFAULT_USERS, clinic='main'):
+    """Create the default physio, patient and exercise if missing; return what was created."""
+    created = []
+    for email, password, role, name in users:
+        if conn.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone() is None:
+            conn.execute("INSERT INTO users (email, password_hash, role, name, clinic) VALUES (?, ?, ?, ?, ?)",
+                         (email, generate_password_hash(password, method=PASSWORD_HASH_METHOD), role, name, clinic))
+            created.append(f"{role} {email}")
+    for name in DEFAULT_EXERCISES:
+        if conn.execute('SELECT id FROM exercises WHERE name = ?', (name,)).fetchone() is None:
+            conn.execute("INSERT INTO exercises (name) VALUES (?)", (name,))
+            created.append(f"exercise {name}")
+    conn.commit()
+    return created
+
+def seed_shard(conn, shard):
+    """seed_defaults for one of all_databases().
+
+    When sharded, each demo user lives in the shard the directory routes
+    their email to (the first shard if it has no entry) and is registered
+    there; the demo exercise goes into every shard, as split-shards copies
+    exercises.
+    """
+    if not current_app.config.get('SHARD_DIRECTORY'):
+        return seed_defaults(conn)
+    directory = get_shard_directory()
+    first = min(directory.shards())
+    users = [user for user in DEFAULT_USERS if (directory.shard_for_email(user[0]) or first) == shard]
+    created = seed_defaults(conn, users, shard_clinic(conn, shard))
+    directory.add_users([user[0] for user in users], shard)
+    return created
+
+@click.command('seed')
+@with_appcontext
+def seed_command():
+    """Create the default demo users and exercise if they are missing (in every shard when sharded)."""
+    sharded = bool(current_app.config.get('SHARD_DIRECTORY'))
+    for shard, database in all_databases(current_app):
+        conn = sqlite3.connect(database)
+        try:
+            for item in seed_shard(conn, shard):
+                click.echo(f"{shard + ': ' if sharded else ''}Created {item}")
+        finally:
+            conn.close()
+
+@click.command('init-db')
+@click.option('--seed/--no-seed', default=True, help="Also create the default demo users and exercise.")
+@with_appcontext
+def init_db_command(seed):
+    """Apply pending migrations and, by default, seed demo data. Run once per deploy."""
+    sharded = bool(current_app.config.get('SHARD_DIRECTORY'))
+    for shard, database in all_databases(current_app):
+        prefix = f"{shard}: " if sharded else ""
+        conn = sqlite3.connect(database)
+        try:
+            for version, name in run_migrations(conn):
+                click.echo(f"{prefix}Applied {version:04d}_{name}")
+            if seed:
+                for item in seed_shard(conn, shard):
+                    click.echo(f"{prefix}Created {item}")
+            click.echo(f"{prefix}Database ready at schema version {schema_version(conn)}.")
+        finally:
+            conn.close()
+
+def warn_if_pending_migrations(app):
+    """Log once at startup (in the gunicorn master when preloading) if the schema is behind."""
+    if app.config.get('SHARD_DIRECTORY') and not os.path.exists(app.config['SHARD_DIRECTORY']):
+        app.logger.error("CRITICAL: shard directory %s not found. Run 'flask --app app split-shards'.",
+                         app.config['SHARD_DIRECTORY'])
+        return
+    for shard, database in all_databases(app):
+        try:
+            conn = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+        except sqlite3.Error:
+            app.logger.error("CRITICAL: database %s not found. Run 'flask --app app init-db'.", database)
+            continue
+        try:
+            current = conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()[0] or 0
+        except sqlite3.Error:
+            current = 0
+        finally:
+            conn.close()
+        pending = [m for m in list_migrations() if m[0] > current]
+        if pending:
+            app.logger.error("CRITICAL: %s schema migration(s) pending in %s. Run 'flask --app app init-db'.",
+                             len(pending), database)
 
 
 # --- Helper Functions ---
 def render_custom_template(template_name, **context):
     context['session'] = session
-    return render_template_string(TEMPLATES[template_name], **context)
+    return render_template(template_name, **context)
+
+def stream_custom_template(template_name, **context):
+    """Render a template as a streamed response, flushing in small buffered chunks."""
+    context['session'] = session
+    current_app.update_template_context(context)
+    stream = current_app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(TEMPLATE_STREAM_BUFFER)
+    return hand_over_connection(Response(stream_with_context(stream), mimetype='text/html'))
+
+def hand_over_connection(response):
+    """Give the request's pooled connection to a streamed response, returned to the pool on close."""
+    # The app context is torn down before the body is sent, so the response
+    # takes over the request's connection and returns it to the pool once the
+    # server closes it; otherwise another thread could reuse it mid-stream.
+    db_conn = g.pop('db_conn', None)
+    if db_conn is not None:
+        response.call_on_close(functools.partial(g.pop('db_pool').release, db_conn))
+    return response
+
+# --- Static Assets and Compression ---
+COMPRESSIBLE_MIMETYPES = {'text/html', 'application/json', 'text/calendar', 'text/css', 'text/plain',
+                          'text/csv', 'application/x-ndjson'}
+
+def accepted_encoding():
+    """'br' or 'gzip', whichever the client accepts with the higher weight (br on a tie); None for neither."""
+    accepted = request.accept_encodings
+    options = [(accepted.quality(name), name == 'br', name)
+               for name in (('br', 'gzip') if brotli else ('gzip',))]
+    quality, _, name = max(options)
+    return name if quality > 0 else None
+
+def compress_bytes(data, encoding, level=None):
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY if level is None else level)
+    return gzip.compress(data, COMPRESS_GZIP_LEVEL if level is None else level, mtime=0)
+
+def compress_chunks(chunks, encoding):
+    """Compress a streamed body chunk by chunk, flushing after each so the page still renders progressively."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip framing
+        compress, flush, finish = compressor.compress, functools.partial(compressor.flush, zlib.Z_SYNC_FLUSH), compressor.flush
+    try:
+        for chunk in chunks:
+            if chunk:
+                yield compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk) + flush()
+        yield finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()  # stream_with_context tears the request context down on close
+
+def compress_response(response):
+    """after_request: gzip or brotli encode HTML, JSON, ICS and plain text bodies the client accepts."""
+    if (response.status_code != 200 or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress_bytes(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)  # same content, different bytes
+    return response
+
+class StaticAsset:
+    """A text asset held in memory with its gzip and brotli encodings, compressed once at import.
+
+    It is served under a name carrying a hash of its content, so browsers
+    may cache it for a year without revalidating: a changed file gets a
+    new URL through asset_url().
+    """
+
+    def __init__(self, name, mimetype, text):
+        self.mimetype = mimetype
+        self.body = text.encode('utf-8')
+        self.fingerprint = hashlib.sha256(self.body).hexdigest()[:12]
+        stem, ext = os.path.splitext(name)
+        self.filename = f"{stem}.{self.fingerprint}{ext}"
+        self.encoded = {'gzip': compress_bytes(self.body, 'gzip', 9)}
+        if brotli:
+            self.encoded['br'] = compress_bytes(self.body, 'br', 11)
+
+    def response(self):
+        encoding = accepted_encoding()
+        body = self.encoded.get(encoding, self.body)
+        etag = self.fingerprint + ('-' + encoding if body is not self.body else '')
+        headers = {'ETag': f'"{etag}"', 'Vary': 'Accept-Encoding',
+                   'Cache-Control': f'public, max-age={STATIC_MAX_AGE}, immutable'}
+        if not is_resource_modified(request.environ, etag=etag):
+            return Response(status=304, headers=headers)
+        if body is not self.body:
+            headers['Content-Encoding'] = encoding
+        return Response(body, mimetype=self.mimetype, headers=headers)
+
+STATIC_ASSETS = {'app.css': StaticAsset('app.css', 'text/css', STYLESHEET)}
+ASSETS_BY_FILENAME = {asset.filename: asset for asset in STATIC_ASSETS.values()}
+# Part of every page ETag, so a deploy that changes a template or the stylesheet invalidates cached pages
+PAGE_FINGERPRINT = hashlib.sha256(json.dumps(TEMPLATES, sort_keys=True).encode('utf-8')
+                                  + STYLESHEET.encode('utf-8')).hexdigest()[:12]
+
+def asset_url(name):
+    """URL of a static asset under its current fingerprint; a template global."""
+    return url_for('static_asset', filename=STATIC_ASSETS[name].filename)
+
+def static_asset(filename):
+    asset = ASSETS_BY_FILENAME.get(filename)
+    if asset is None:
+        return Response("Not found.\n", status=404, mimetype='text/plain')
+    return asset.response()
+
+def page_validators(*versions):
+    """(ETag, headers) for a page rendered from `versions`; browsers must revalidate before reuse."""
+    etag = hashlib.sha256(repr((PAGE_FINGERPRINT, current_shard()) + versions).encode('utf-8')).hexdigest()[:20]
+    return etag, {'ETag': f'W/"{etag}"', 'Cache-Control': 'private, no-cache'}
+
+def page_not_modified(etag, headers):
+    """A 304 if the request's If-None-Match already holds `etag`, else None."""
+    if not is_resource_modified(request.environ, etag=etag):
+        return Response(status=304, headers=headers)
+    return None
+
+# --- Password Hashing ---
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already queued in this worker."""
+
+class AttemptThrottle:
+    """Fixed-window attempt counters that expire after `window` seconds.
+
+    Entries live in insertion order, so expired keys are purged from the
+    front on each call and memory stays bounded by recent traffic.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._entries = OrderedDict()  # key -> [window_start, count]
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        while self._entries:
+            key, (start, _) = next(iter(self._entries.items()))
+            if now - start < self.window:
+                break
+            del self._entries[key]
+
+    def hit(self, key, limit):
+        """Record an attempt; return False if `key` is over `limit` for this window."""
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [now, 0]
+            entry[1] += 1
+            return entry[1] <= limit
+
+    def reset(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+login_throttle = AttemptThrottle(LOGIN_THROTTLE_WINDOW)
+
+_hash_pool = None
+_hash_pool_pid = None
+_hash_slots = threading.BoundedSemaphore(LOGIN_HASH_QUEUE_DEPTH)
+
+def get_hash_pool():
+    global _hash_pool, _hash_pool_pid
+    with _pool_lock:
+        if _hash_pool is None or _hash_pool_pid != os.getpid():
+            _hash_pool = ProcessPoolExecutor(
+                max_workers=LOGIN_HASH_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=password_hashing.init_worker, initargs=(LOGIN_HASH_NICE,),
+            )
+            _hash_pool_pid = os.getpid()
+    return _hash_pool
+
+def run_hashing(func, *args):
+    """Run a werkzeug hashing function off the request thread, or raise HashingBusy."""
+    global _hash_pool
+    if not _hash_slots.acquire(blocking=False):
+        raise HashingBusy()
+    release_slot = True
+    try:
+        if LOGIN_HASH_PROCESSES <= 0:
+            return func(*args)
+        future = get_hash_pool().submit(func, *args)
+        # A hash this request gives up waiting for still occupies the pool, so it keeps its slot until done
+        future.add_done_callback(lambda _: _hash_slots.release())
+        release_slot = False
+        return future.result(timeout=LOGIN_HASH_TIMEOUT)
+    except BrokenProcessPool:
+        current_app.logger.error("Password hashing pool died; hashing inline and recreating it.")
+        _hash_pool = None
+        return func(*args)
+    except FutureTimeoutError:
+        raise HashingBusy()
+    finally:
+        if release_slot:
+            _hash_slots.release()
+
+def needs_rehash(password_hash):
+    """True if a stored hash was made with different parameters than PASSWORD_HASH_METHOD."""
+    return password_hash.split('$', 1)[0] != password_hashing.full_method(PASSWORD_HASH_METHOD)
+
+# --- Calendar Feed ---
+ics_cache = ReadCache('ics', ICS_CACHE_SIZE, READ_CACHE_TTL)
+
+def bump_calendar_version(db, patient_id):
+    """Invalidate a patient's cached calendar; call inside the writing transaction."""
+    db.execute(FEED_BUMP_SQL, (patient_id, int(time.time())))
+
+def get_calendar_feed(db, patient_id):
+    feed = db.execute(FEED_BY_PATIENT_SQL, (patient_id,)).fetchone()
+    if feed is None:
+        db.execute("INSERT OR IGNORE INTO calendar_feeds (patient_id, updated_at) VALUES (?, ?)",
+                   (patient_id, int(time.time())))
+        db.commit()
+        feed = db.execute(FEED_BY_PATIENT_SQL, (patient_id,)).fetchone()
+    return feed
+
+def get_feed_token(db, patient_id):
+    feed = get_calendar_feed(db, patient_id)
+    if feed['token']:
+        return feed['token']
+    token = secrets.token_urlsafe(24)
+    created = db.execute("UPDATE calendar_feeds SET token = ? WHERE patient_id = ? AND token IS NULL",
+                         (token, patient_id)).rowcount
+    db.commit()
+    if created and current_shard():
+        get_shard_directory().add_feed_token(token, current_shard())
+    return get_calendar_feed(db, patient_id)['token']
+
+def _ics_escape(text):
+    return (text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+                .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+def _ics_line(line):
+    """Fold a content line at 75 octets as RFC 5545 requires."""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts, start, limit = [], 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1  # never split a UTF-8 sequence
+        parts.append(encoded[start:end].decode('utf-8'))
+        start, limit = end, 74
+    return '\r\n '.join(parts) + '\r\n'
+
+def write_ics(rows, stamp):
+    """Serialize schedule rows straight to ICS text, without building Event objects."""
+    dtstamp = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(stamp))
+    out = ['BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//my-scolio//exercises//EN\r\n']
+    for row in rows:
+        out.append(
+            f"BEGIN:VEVENT\r\nUID:schedule-{row['id']}@my-scolio\r\nDTSTAMP:{dtstamp}\r\n"
+            f"DTSTART:{row['scheduled_at'].strftime('%Y%m%dT%H%M%SZ')}\r\nDURATION:PT30M\r\n"
+            + _ics_line('SUMMARY:' + _ics_escape(row['name'] or '')) +
+            "END:VEVENT\r\n"
+        )
+    out.append('END:VCALENDAR\r\n')
+    return ''.join(out).encode('utf-8')
+
+def calendar_response(db, feed, as_attachment):
+    """Serve a patient's calendar, answering conditional GETs with 304 from the feed row alone."""
+    patient_id, version = feed['patient_id'], feed['version']
+    shard = current_shard()  # patient ids repeat across shards
+    etag = f"{shard}-{patient_id}-{version}" if shard else f"{patient_id}-{version}"
+    last_modified = datetime.datetime.fromtimestamp(feed['updated_at'], datetime.timezone.utc)
+    headers = {'ETag': f'"{etag}"', 'Last-Modified': http_date(last_modified),
+               'Cache-Control': 'private, no-cache'}
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return Response(status=304, headers=headers)
+
+    body = ics_cache.get_or_load((current_shard(), patient_id), version, lambda: write_ics(
+        db.execute(ICS_OPEN_ITEMS_SQL, (patient_id,)), feed['updated_at']))
+    if as_attachment:
+        headers['Content-Disposition'] = 'attachment; filename=exercises.ics'
+    return Response(body, mimetype='text/calendar', headers=headers)
+
+# --- Picker Search ---
+def fts_prefix_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix."""
+    return ' '.join('"' + word + '"*' for word in re.findall(r'\w+', text))
+
+def search_picker(db, kind, text, after, limit):
+    """Return (rows, next_after) for one keyset page of patients or exercises."""
+    match = fts_prefix_query(text)
+    if kind == 'patients':
+        sql, params = (PATIENT_SEARCH_SQL, (match,)) if match else (PATIENT_PAGE_SQL, ())
+    else:
+        sql, params = (EXERCISE_SEARCH_SQL, (match,)) if match else (EXERCISE_PAGE_SQL, ())
+
+    def load():
+        rows = db.execute(sql, params + (after, limit + 1)).fetchall()
+        next_after = rows[limit - 1]['id'] if len(rows) > limit else None
+        return rows[:limit], next_after
+
+    return picker_cache.get_or_load((current_shard(), kind, match, after, limit), cache_generation(db, kind), load)
+
+# --- Recurring Assignments ---
+WEEKDAYS = {'MO': 0, 'TU': 1, 'WE': 2, 'TH': 3, 'FR': 4, 'SA': 5, 'SU': 6}
+
+class RecurrenceError(ValueError):
+    pass
+
+def count_recurrence(start_date, end_date, weekdays, times):
+    """How many datetimes expand_recurrence() returns, counted without building them."""
+    if end_date < start_date:
+        raise RecurrenceError("end_date is before start_date")
+    weeks, extra_days = divmod((end_date - start_date).days + 1, 7)
+    days = weeks * len(weekdays) + sum((start_date.weekday() + i) % 7 in weekdays for i in range(extra_days))
+    return days * len(set(times))
+
+def expand_recurrence(start_date, end_date, weekdays, times):
+    """Return naive wall-clock datetimes for every weekday/time between two dates, inclusive."""
+    if end_date < start_date:
+        raise RecurrenceError("end_date is before start_date")
+    day_count = (end_date - start_date).days + 1
+    dates = [start_date + datetime.timedelta(days=i) for i in range(day_count)]
+    clock_times = sorted(set(times))
+    return [datetime.datetime.combine(d, t) for d in dates if d.weekday() in weekdays for t in clock_times]
+
+def parse_recurrence(spec, max_rows):
+    """Validate a JSON recurrence spec into (patient_ids, exercise_ids, occurrences).
+
+    The rows it would create are counted first, so a spec over `max_rows`
+    is rejected before any occurrence is built.
+    """
+    try:
+        patient_ids = sorted({int(p) for p in spec['patient_ids']})
+        exercise_ids = sorted({int(e) for e in spec['exercise_ids']})
+        start_date = datetime.date.fromisoformat(spec['start_date'])
+        end_date = datetime.date.fromisoformat(spec.get('end_date') or spec['start_date'])
+        weekdays = {WEEKDAYS[d.upper()] if isinstance(d, str) else int(d) % 7
+                    for d in spec.get('days') or WEEKDAYS}
+        times = [datetime.time.fromisoformat(t) for t in spec['times']]
+    except KeyError as e:
+        raise RecurrenceError(f"Missing or unknown field: {e.args[0]}")
+    except (TypeError, ValueError) as e:
+        raise RecurrenceError(f"Invalid recurrence: {e}")
+    if not patient_ids or not exercise_ids or not times:
+        raise RecurrenceError("patient_ids, exercise_ids and times must be non-empty")
+    total = len(patient_ids) * len(exercise_ids) * count_recurrence(start_date, end_date, weekdays, times)
+    if total > max_rows:
+        raise RecurrenceError(f"Recurrence expands to {total} rows; limit is {max_rows}.")
+    occurrences = expand_recurrence(start_date, end_date, weekdays, times)
+    return patient_ids, exercise_ids, occurrences
+
+def bulk_assign(db, patient_zones, exercise_ids, occurrences, skip_conflicts=True):
+    """Insert every patient x exercise x occurrence row in one transaction.
+
+    `patient_zones` maps patient id to timezone name; occurrences are wall
+    clock times in each patient's own zone. Rows already scheduled for the
+    same patient, exercise and time are found with a single indexed range
+    query and skipped. Returns (created, conflicts).
+    """
+    if not occurrences:
+        return 0, 0
+    patient_ids = sorted(patient_zones)
+    epochs = {name: [to_epoch(dt, get_zone(name)) for dt in occurrences]
+              for name in set(patient_zones.values())}
+    existing = set()
+    if skip_conflicts:
+        first = min(times[0] for times in epochs.values())
+        last = max(times[-1] for times in epochs.values())
+        existing = {tuple(row) for row in db.execute(
+            ASSIGN_CONFLICTS_SQL, (json.dumps(patient_ids), first, last))}
+    rows = ((p, e, t) for p in patient_ids for e in exercise_ids for t in epochs[patient_zones[p]])
+    if existing:
+        rows = (row for row in rows if row not in existing)
+    try:
+        cursor = db.executemany(ASSIGN_SQL, rows)
+        created = cursor.rowcount
+        db.executemany(FEED_BUMP_SQL, ((p, int(time.time())) for p in patient_ids))
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+    conflicts = len(patient_ids) * len(exercise_ids) * len(occurrences) - created
+    return created, conflicts
+
+# --- Completions ---
+def set_completion(conn, patient_id, item_ids, completed):
+    """Group-commit job: set a patient's schedule items done or not done; return the ids changed."""
+    changed = [row[0] for row in conn.execute(
+        DONE_SQL, (int(completed), patient_id, int(completed), json.dumps(item_ids))).fetchall()]
+    if changed:
+        bump_calendar_version(conn, patient_id)
+    return changed
+
+# --- Live Updates ---
+class EventStream:
+    """One open /patient/events response: the patient's pending deltas and resume point."""
+
+    def __init__(self, patient_id, zone, after):
+        self.patient_id = patient_id
+        self.zone = zone
+        self.last_sent = after
+        self.events = queue.SimpleQueue()
+
+    def accept(self, change):
+        """Skip changes already sent and rows not on today's dashboard."""
+        if change['id'] <= self.last_sent:
+            return False
+        start, end = day_window(datetime.datetime.now(self.zone).date(), self.zone)
+        if not start <= change['scheduled_at'] < end:
+            return False
+        self.last_sent = change['id']
+        return True
+
+    def format(self, change):
+        local = datetime.datetime.fromtimestamp(change['scheduled_at'], self.zone)
+        data = {'change': change['kind'], 'id': change['schedule_id'], 'name': change['name'],
+                'at': change['scheduled_at'], 'time': local.strftime('%I:%M %p')}
+        return f"id: {change['id']}\nevent: schedule\ndata: {json.dumps(data)}\n\n"
+
+    def iter_events(self, backlog):
+        yield "retry: 5000\n\n"
+        for change in backlog:
+            if self.accept(change):
+                yield self.format(change)
+        deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return  # the browser reconnects with Last-Event-ID
+            try:
+                change = self.events.get(timeout=min(SSE_HEARTBEAT, remaining))
+            except queue.Empty:
+                yield ": ping\n\n"  # keeps proxies open and notices dead clients
+                continue
+            if self.accept(change):
+                yield self.format(change)
+
+class ChangeFeed:
+    """Tails schedule_changes and fans deltas out to this worker's event streams.
+
+    One watcher thread per worker, started by the first stream. With no
+    stream open it sleeps until one subscribes; otherwise it reads PRAGMA
+    data_version every SSE_POLL_INTERVAL (or at once when a local write
+    calls notify()) and only queries the log after some connection, in any
+    process, has committed, or when a stream opens on an idle feed. Idle
+    streams just wait on their own queue.
+    """
+
+    PRUNE_INTERVAL = 600
+
+    def __init__(self, database, logger):
+        self.database = database
+        self.logger = logger
+        self.pid = os.getpid()
+        self.last_id = None  # newest change already dispatched; None while no stream is open
+        self._seen_version = None  # data_version at the last dispatch; None forces the next poll to read the log
+        self._streams = {}   # patient_id -> set of EventStream
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def subscribe(self, patient_id, zone, after):
+        """Open a stream resuming after change `after`.
+
+        Returns (stream, dispatched_upto); the caller replays the patient's
+        changes in (after, dispatched_upto] itself. (None, None) when full.
+        """
+        with self._lock:
+            if not stream_slots.acquire(blocking=False):
+                return None, None
+            if self.last_id is None:
+                # Idle until now: the watcher must catch this stream up even if nothing has been committed since
+                self.last_id = after
+                self._seen_version = None
+            stream = EventStream(patient_id, zone, after)
+            self._streams.setdefault(patient_id, set()).add(stream)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='change_feed', daemon=True)
+                self._thread.start()
+            dispatched_upto = self.last_id
+        self._wake.set()
+        return stream, dispatched_upto
+
+    def unsubscribe(self, stream):
+        with self._lock:
+            streams = self._streams.get(stream.patient_id)
+            if streams is not None and stream in streams:
+                streams.discard(stream)
+                stream_slots.release()
+                if not streams:
+                    del self._streams[stream.patient_id]
+            if not self._streams:
+                self.last_id = None
+
+    def notify(self):
+        self._wake.set()
+
+    def _run(self):
+        conn = ConnectionPool(self.database, 1).acquire()
+        last_prune = 0.0
+        while True:
+            self._wake.wait(SSE_POLL_INTERVAL if self._streams else None)
+            self._wake.clear()
+            try:
+                version = conn.execute("PRAGMA data_version").fetchone()[0]
+                if version != self._seen_version:
+                    self._seen_version = version
+                    self._dispatch(conn)
+                if time.monotonic() - last_prune > self.PRUNE_INTERVAL:
+                    last_prune = time.monotonic()
+                    conn.execute(CHANGE_PRUNE_SQL, (int(time.time()) - CHANGE_LOG_RETENTION,))
+                    conn.commit()
+            except sqlite3.Error as e:
+                self.logger.error("Change feed poll failed: %s", e)
+
+    def _dispatch(self, conn):
+        # Held throughout so a stream subscribing mid-poll can't fall between replay and dispatch
+        with self._lock:
+            if self.last_id is None:
+                return
+            newest = conn.execute(CHANGE_CURSOR_SQL).fetchone()[0] or 0
+            if newest <= self.last_id:
+                return
+            for change in conn.execute(CHANGES_SQL, (self.last_id, newest, json.dumps(list(self._streams)))):
+                for stream in self._streams.get(change['patient_id'], ()):
+                    stream.events.put(change)
+            self.last_id = newest
+
+# Open streams per worker, shared by the change feeds of every shard
+stream_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+def get_change_feed():
+    database = current_database()
+    return process_local('change_feed', database, lambda: ChangeFeed(database, current_app.logger))
+
+def notify_schedule_change():
+    """Wake this worker's change feed so its streams see a local write without waiting for the poll."""
+    feed = current_app.extensions.get('change_feed', {}).get(current_database())
+    if feed is not None and feed.pid == os.getpid():
+        feed.notify()
+
+# --- Reminders ---
+class LogSender:
+    """Writes each reminder to the app log; the default, and what tests and benchmarks use."""
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def send(self, reminders):
+        for r in reminders:
+            self.logger.info("Reminder to %s: %s at %s", r['email'], r['exercise'], r['local_time'])
+        return [r['id'] for r in reminders]
+
+class SmtpSender:
+    """Delivers reminders as plain-text mail over one SMTP connection per batch.
+
+    The Message-ID is derived from the schedule item, so a reminder resent
+    after a lapsed claim can be recognised as a duplicate downstream.
+    """
+
+    def __init__(self, host, port, from_address, logger):
+        self.host = host
+        self.port = port
+        self.from_address = from_address
+        self.logger = logger
+
+    def message(self, reminder):
+        msg = EmailMessage()
+        msg['From'] = self.from_address
+        msg['To'] = reminder['email']
+        msg['Subject'] = f"Reminder: {reminder['exercise']} at {reminder['local_time']}"
+        msg['Message-ID'] = f"<reminder-{reminder['id']}@{self.from_address.rpartition('@')[2]}>"
+        msg.set_content(f"Hello {reminder['name'] or ''},\n\n"
+                        f"{reminder['exercise']} is scheduled for {reminder['local_time']}.\n")
+        return msg
+
+    def send(self, reminders):
+        """Return the ids handled; the rest stay claimed and are retried when the claim lapses."""
+        delivered = []
+        try:
+            with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+                for r in reminders:
+                    try:
+                        smtp.send_message(self.message(r))
+                    except smtplib.SMTPRecipientsRefused as e:
+                        self.logger.warning("Dropping reminder %s, recipient refused: %s", r['id'], e)
+                    delivered.append(r['id'])
+        except (OSError, smtplib.SMTPException) as e:
+            self.logger.error("SMTP delivery stopped after %s of %s reminders: %s", len(delivered), len(reminders), e)
+        return delivered
+
+def build_sender(spec, logger):
+    """Sender for REMINDER_SENDER: 'log', 'smtp', 'off' (None) or 'package.module:factory'.
+
+    A factory is called with the app logger and must return an object whose
+    send(reminders) returns the ids it delivered.
+    """
+    if spec == 'off':
+        return None
+    if spec == 'log':
+        return LogSender(logger)
+    if spec == 'smtp':
+        return SmtpSender(SMTP_HOST, SMTP_PORT, REMINDER_FROM, logger)
+    module_name, _, factory = spec.partition(':')
+    if not factory:
+        raise ValueError(f"Unknown REMINDER_SENDER {spec!r}")
+    return getattr(importlib.import_module(module_name), factory)(logger)
+
+class ReminderScheduler:
+    """Sends a reminder `lead` seconds before each open schedule item.
+
+    The due queue is the partial index idx_schedule_reminder_due: it holds
+    only open rows not yet reminded, by time, so each pass is a range scan
+    over what is coming due and sleeping until the next item is an index
+    seek. Rows are claimed `batch_size` at a time by one UPDATE that sets a
+    lease, which SQLite's write lock makes exclusive: any number of workers
+    or processes can run a scheduler without sending a reminder twice. Sent
+    rows get reminded_at and leave the index. A sender that fails or dies
+    leaves its lease to lapse, and the rows are claimed again. Memory stays
+    at one batch however many rows are due.
+    """
+
+    def __init__(self, database, sender, logger, lead=REMINDER_LEAD_MINUTES * 60, batch_size=REMINDER_BATCH,
+                 lease=REMINDER_LEASE, max_late=REMINDER_MAX_LATE):
+        self.database = database
+        self.sender = sender
+        self.logger = logger
+        self.lead = lead
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_late = max_late
+        self.pid = os.getpid()
+        self.conn = ConnectionPool(database, 1).acquire()
+
+    def run_once(self, now=None):
+        """Send every reminder due at `now` (epoch seconds, default the clock); return how many."""
+        now = int(time.time() if now is None else now)
+        while self.conn.execute(REMINDER_EXPIRE_SQL, (now - self.max_late, self.batch_size)).rowcount:
+            self.conn.commit()
+        self.conn.commit()
+        sent = 0
+        while True:
+            claimed = [row[0] for row in self.conn.execute(REMINDER_CLAIM_SQL, (
+                now + self.lease, now - self.max_late, now + self.lead, now, self.batch_size)).fetchall()]
+            self.conn.commit()
+            if not claimed:
+                break
+            sent += self._deliver(claimed, now)
+            if len(claimed) < self.batch_size:
+                break
+        return sent
+
+    def _deliver(self, claimed, now):
+        reminders = []
+        for row in self.conn.execute(REMINDER_DETAILS_SQL, (json.dumps(claimed),)):
+            local = datetime.datetime.fromtimestamp(row['scheduled_at'], get_zone(row['timezone']))
+            reminders.append({'id': row['id'], 'email': row['email'], 'name': row['name'],
+                              'exercise': row['exercise'], 'scheduled_at': row['scheduled_at'],
+                              'local_time': local.strftime('%I:%M %p')})
+        try:
+            delivered = list(self.sender.send(reminders))
+        except Exception:
+            self.logger.exception("Reminder sender failed; %s reminders will be retried.", len(reminders))
+            return 0
+        if delivered:
+            self.conn.execute(REMINDER_SENT_SQL, (now, json.dumps(delivered)))
+            self.conn.commit()
+        return len(delivered)
+
+    def seconds_until_due(self, now=None):
+        """How long nothing new comes due, capped at REMINDER_POLL_INTERVAL so new rows are noticed."""
+        now = int(time.time() if now is None else now)
+        next_at = self.conn.execute(REMINDER_NEXT_SQL, (now + self.lead,)).fetchone()[0]
+        if next_at is None:
+            return REMINDER_POLL_INTERVAL
+        return min(REMINDER_POLL_INTERVAL, max(1, next_at - self.lead - now))
+
+    def run_forever(self):
+        while True:
+            try:
+                sent = self.run_once()
+                if sent:
+                    self.logger.info("Sent %s reminder(s).", sent)
+                delay = self.seconds_until_due()
+            except sqlite3.Error as e:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                self.logger.error("Reminder pass failed: %s", e)
+                delay = REMINDER_POLL_INTERVAL
+            time.sleep(delay)
+
+def run_reminders_in_thread(app, scheduler):
+    def run():
+        with app.app_context():
+            scheduler.run_forever()
+    thread = threading.Thread(target=run, name='reminders', daemon=True)
+    thread.start()
+    return thread
+
+def start_reminder_scheduler(app):
+    """Run this worker's reminder schedulers, a daemon thread per database (gunicorn.conf.py calls this per worker)."""
+    sender = build_sender(REMINDER_SENDER, app.logger)
+    if sender is None:
+        return []
+
+    def start(database):
+        scheduler = ReminderScheduler(database, sender, app.logger)
+        run_reminders_in_thread(app, scheduler)
+        return scheduler
+    with app.app_context():
+        return [process_local('reminders', database, functools.partial(start, database))
+                for _, database in all_databases(app)]
+
+@click.command('send-reminders')
+@with_appcontext
+@click.option('--once', is_flag=True, help="Send what is due now and exit, e.g. from cron.")
+def send_reminders_command(once):
+    """Send due exercise reminders through REMINDER_SENDER until interrupted."""
+    sender = build_sender(REMINDER_SENDER, current_app.logger)
+    if sender is None:
+        raise click.UsageError("REMINDER_SENDER is 'off'.")
+    schedulers = [ReminderScheduler(database, sender, current_app.logger)
+                  for _, database in all_databases(current_app)]
+    if once:
+        click.echo(f"Sent {sum(scheduler.run_once() for scheduler in schedulers)} reminder(s).")
+        return
+    app = current_app._get_current_object()
+    for thread in [run_reminders_in_thread(app, scheduler) for scheduler in schedulers]:
+        thread.join()
+
+# --- Adherence ---
+WEEK = 7 * 86400
+
+def week_start(epoch):
+    """UTC Monday 00:00 of the week holding `epoch`; the week key of adherence_weekly."""
+    day = epoch // 86400
+    return (day - (day + 3) % 7) * 86400
+
+def summarize_adherence(series, week_starts, overdue_now, upcoming):
+    """Report figures from {week_start: (assigned, completed)} over the window.
+
+    `overdue_now` and `upcoming` count this week's open items already past
+    and still ahead; everything else assigned in the window is due.
+    """
+    weeks = [series.get(w, (0, 0)) for w in week_starts]
+    assigned = sum(a for a, _ in weeks)
+    completed = sum(c for _, c in weeks)
+    due = assigned - upcoming
+    streak = 0
+    for a, c in reversed(weeks[:-1]):  # finished weeks, newest first; empty weeks don't break a streak
+        if not a:
+            continue
+        if c < a:
+            break
+        streak += 1
+    return {
+        'assigned': assigned, 'completed': completed, 'due': due,
+        'rate': round(completed / due, 3) if due > 0 else None,
+        'overdue': sum(a - c for a, c in weeks[:-1]) + overdue_now,
+        'streak_weeks': streak,
+        'weeks': [{'week_start': week_label(w), 'assigned': a, 'completed': c} for w, (a, c) in zip(week_starts, weeks)],
+    }
+
+def week_label(week):
+    return datetime.datetime.fromtimestamp(week, datetime.timezone.utc).date().isoformat()
+
+def adherence_summaries(db, patient_ids, now, weeks=ADHERENCE_REPORT_WEEKS, by_exercise=False):
+    """{patient_id: summary} over the last `weeks` weeks, the current one included.
+
+    Reads at most weeks x exercises aggregate rows per patient plus the
+    patient's open items of the current week, so the cost does not grow
+    with the length of the history.
+    """
+    current = week_start(now)
+    week_starts = [current - (weeks - 1 - i) * WEEK for i in range(weeks)]
+    ids = json.dumps(patient_ids)
+    cells = {}  # patient_id -> exercise_id -> {week_start: (assigned, completed)}
+    for row in db.execute(ADHERENCE_WEEKS_SQL, (ids, week_starts[0], current)):
+        cells.setdefault(row['patient_id'], {}).setdefault(row['exercise_id'], {})[row['week_start']] = (
+            row['assigned'], row['completed'])
+    open_now = {}  # (patient_id, exercise_id) -> [overdue, upcoming]
+    for row in db.execute(ADHERENCE_OPEN_SQL, (ids, current, current + WEEK)):
+        counts = open_now.setdefault((row['patient_id'], row['exercise_id']), [0, 0])
+        counts[0 if row['scheduled_at'] < now else 1] += 1
+
+    names = {}
+    if by_exercise:
+        exercise_ids = sorted({e for per_exercise in cells.values() for e in per_exercise})
+        names = dict(db.execute(EXERCISE_NAMES_SQL, (json.dumps(exercise_ids),)).fetchall())
+    summaries = {}
+    for patient_id in patient_ids:
+        per_exercise = cells.get(patient_id, {})
+        totals, overdue, upcoming = {}, 0, 0
+        exercises = []
+        for exercise_id, series in per_exercise.items():
+            for w, (a, c) in series.items():
+                ta, tc = totals.get(w, (0, 0))
+                totals[w] = (ta + a, tc + c)
+            o, u = open_now.get((patient_id, exercise_id), (0, 0))
+            overdue, upcoming = overdue + o, upcoming + u
+            if by_exercise:
+                exercises.append({'id': exercise_id, 'name': names.get(exercise_id),
+                                  **summarize_adherence(series, week_starts, o, u)})
+        summary = summarize_adherence(totals, week_starts, overdue, upcoming)
+        if by_exercise:
+            summary['exercises'] = sorted(exercises, key=lambda e: (e['name'] or '', e['id']))
+        summaries[patient_id] = summary
+    return summaries
+
+def adherence_report(db, args, now):
+    """The physio report for request args: one patient by exercise (?patient=id) or a page of patients.
+
+    Returns None for an unknown patient.
+    """
+    weeks = [week_label(week_start(now) - i * WEEK) for i in reversed(range(ADHERENCE_REPORT_WEEKS))]
+    patient_id = args.get('patient', type=int)
+    if patient_id is not None:
+        patient = db.execute(PATIENT_BY_ID_SQL, (patient_id,)).fetchone()
+        if patient is None:
+            return None
+        summary = adherence_summaries(db, [patient_id], now, by_exercise=True)[patient_id]
+        return {'weeks': weeks, 'patient': {**dict(patient), **summary}}
+    after = args.get('after', 0, type=int)
+    limit = max(1, min(args.get('limit', PICKER_PAGE_SIZE, type=int), 100))
+    rows, next_after = search_picker(db, 'patients', args.get('q', ''), after, limit)
+    summaries = adherence_summaries(db, [row['id'] for row in rows], now)
+    return {'weeks': weeks, 'patients': [{**dict(row), **summaries[row['id']]} for row in rows], 'next': next_after}
+
+@click.command('backfill-adherence')
+@with_appcontext
+@click.option('--batch', default=1000, show_default=True, help="Patient ids recounted per transaction.")
+def backfill_adherence_command(batch):
+    """Rebuild the adherence aggregates from the schedule and schedule_archive tables.
+
+    Works through patient ids in ranges, each recounted in its own short
+    write transaction, so it can run while the app keeps serving.
+    """
+    sharded = bool(current_app.config.get('SHARD_DIRECTORY'))
+    for shard, database in all_databases(current_app):
+        conn = sqlite3.connect(database, timeout=DB_BUSY_TIMEOUT_MS / 1000.0)
+        try:
+            max_id = conn.execute("SELECT MAX(COALESCE((SELECT MAX(patient_id) FROM schedule), 0),"
+                                  " COALESCE((SELECT MAX(patient_id) FROM schedule_archive), 0))").fetchone()[0]
+            rows = 0
+            for low in range(0, max_id + 1, batch):
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(ADHERENCE_CLEAR_SQL, (low, low + batch))
+                rows += conn.execute(ADHERENCE_BACKFILL_SQL, (low, low + batch)).rowcount
+                conn.commit()
+        finally:
+            conn.close()
+        click.echo(f"{shard + ': ' if sharded else ''}Rebuilt {rows} adherence rows for patient ids up to {max_id}.")
+
+# --- Archive and Bulk Export/Import ---
+def archive_history(conn, cutoff, batch_size=ARCHIVE_BATCH, pause=ARCHIVE_PAUSE_MS / 1000.0):
+    """Move schedule rows scheduled before `cutoff` into schedule_archive.
+
+    Candidate ids are read in id order outside any write transaction; each
+    batch is then copied and deleted in its own short BEGIN IMMEDIATE, with
+    a pause in between, so app writes wait for one batch at most. Returns
+    (rows moved, longest write transaction in seconds).
+    """
+    moved, longest, after = 0, 0.0, 0
+    while True:
+        ids = [row[0] for row in conn.execute(ARCHIVE_CANDIDATES_SQL, (after, cutoff, batch_size))]
+        if not ids:
+            break
+        after = ids[-1]
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = int(time.time())
+            copied = conn.execute(ARCHIVE_COPY_SQL, (now, json.dumps(ids), cutoff)).fetchall()
+            conn.execute(ARCHIVE_DELETE_SQL, (json.dumps(ids), cutoff))
+            # Rows that were still open leave the patient's calendar feed
+            conn.executemany(FEED_BUMP_SQL, ((patient_id, now) for patient_id in {row[0] for row in copied}))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        longest = max(longest, time.perf_counter() - started)
+        moved += len(copied)
+        time.sleep(pause)
+    return moved, longest
+
+@click.command('archive-history')
+@with_appcontext
+@click.option('--older-than-days', default=ARCHIVE_AFTER_DAYS, show_default=True,
+              help="Archive rows scheduled more than this many days ago.")
+@click.option('--batch', default=ARCHIVE_BATCH, show_default=True, help="Rows moved per write transaction.")
+def archive_history_command(older_than_days, batch):
+    """Move old schedule rows into schedule_archive; safe to run from cron while the app serves."""
+    cutoff = int(time.time()) - older_than_days * 86400
+    sharded = bool(current_app.config.get('SHARD_DIRECTORY'))
+    for shard, database in all_databases(current_app):
+        conn = sqlite3.connect(database, timeout=DB_BUSY_TIMEOUT_MS / 1000.0)
+        try:
+            moved, longest = archive_history(conn, cutoff, batch)
+        finally:
+            conn.close()
+        click.echo(f"{shard + ': ' if sharded else ''}Archived {moved} rows"
+                   f" (longest write transaction {longest * 1000:.1f} ms).")
+
+EXPORT_FIELDS = ('id', 'patient_email', 'exercise', 'scheduled_at', 'completed', 'archived')
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+def export_history(conn, fmt, patient_id=None, header=True, page_size=EXPORT_PAGE_SIZE):
+    """Yield the full schedule history of a database, or of one patient, as CSV or NDJSON text.
+
+    Live and archived rows are read one keyset page at a time, each page a
+    statement of its own, so memory stays flat and no read snapshot is
+    held for the length of the export. Times are UTC ISO 8601.
+    """
+    emails = dict(conn.execute(EXPORT_PATIENTS_SQL).fetchall())
+    names = dict(conn.execute(EXPORT_EXERCISES_SQL).fetchall())
+    if fmt == 'csv' and header:
+        yield ','.join(EXPORT_FIELDS) + '\r\n'
+    key = (0,) if patient_id is None else (patient_id, -2 ** 62, 0)
+    while True:
+        if patient_id is None:
+            rows = conn.execute(EXPORT_CLINIC_SQL, key + (page_size,)).fetchall()
+        else:
+            rows = conn.execute(EXPORT_PATIENT_SQL, key + (page_size,)).fetchall()
+        if not rows:
+            return
+        out = io.StringIO()
+        writer = csv.writer(out) if fmt == 'csv' else None
+        for id_, patient, exercise, at, completed, archived in rows:
+            values = (id_, emails.get(patient), names.get(exercise),
+                      time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(at)), int(completed != 0), archived)
+            if writer:
+                writer.writerow(values)
+            else:
+                record = dict(zip(EXPORT_FIELDS, values))
+                record['completed'], record['archived'] = bool(record['completed']), bool(record['archived'])
+                out.write(json.dumps(record, separators=(',', ':')) + '\n')
+        yield out.getvalue()
+        last = rows[-1]
+        key = (last[0],) if patient_id is None else (patient_id, last[3], last[0])
+
+@click.command('export-history')
+@with_appcontext
+@click.argument('output', type=click.File('w', encoding='utf-8', lazy=True), default='-')
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_MIMETYPES)), default='csv', show_default=True)
+@click.option('--patient', 'email', help="Only this patient's history (by email).")
+def export_history_command(output, fmt, email):
+    """Write the whole schedule history, archive included, to OUTPUT (default stdout).
+
+    Sharded, every clinic is exported in turn unless --patient picks one patient.
+    """
+    databases = all_databases(current_app)
+    if email and current_app.config.get('SHARD_DIRECTORY'):
+        shard = get_shard_directory().shard_for_email(email)
+        databases = [(shard, get_shard_directory().database(shard))] if shard else []
+    header, exported = True, False
+    for _, database in databases:
+        conn = sqlite3.connect(database, timeout=DB_BUSY_TIMEOUT_MS / 1000.0)
+        try:
+            patient_id = None
+            if email:
+                row = conn.execute("SELECT id FROM users WHERE email = ? AND role = 'patient'", (email,)).fetchone()
+                if row is None:
+                    continue
+                patient_id = row[0]
+            for chunk in export_history(conn, fmt, patient_id, header=header):
+                output.write(chunk)
+            header, exported = False, True
+        finally:
+            conn.close()
+    if email and not exported:
+        raise click.ClickException(f"No patient with email {email}.")
+
+IMPORT_MAX_ERRORS = 20
+
+class PatientImport:
+    """CSV columns email, and optionally name, timezone, password and clinic; existing emails are skipped."""
+    columns = ('email',)
+    # Hashing a password costs a scrypt run, too much per row on a request thread
+    offline_columns = ('password',)
+
+    def __init__(self, conn, clinic, shard):
+        self.clinic = clinic
+        self.shard = shard
+
+    def convert(self, record):
+        email = (record['email'] or '').strip()
+        if '@' not in email:
+            raise ValueError(f"invalid email {email!r}")
+        clinic = (record.get('clinic') or '').strip() or self.clinic
+        if self.shard and clinic != self.clinic:
+            raise ValueError(f"clinic {clinic!r} is not the one shard {self.shard} holds")
+        timezone = (record.get('timezone') or '').strip() or 'UTC'
+        try:
+            zoneinfo.ZoneInfo(timezone)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"unknown timezone {timezone!r}")
+        password = record.get('password')
+        # Without a password the account cannot log in until one is set
+        password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD) if password else '!'
+        return (email, password_hash, (record.get('name') or '').strip() or None, timezone, clinic)
+
+    def write(self, conn, batch):
+        return conn.executemany(IMPORT_PATIENT_SQL, batch).rowcount
+
+class ExerciseImport:
+    """CSV column name; names that already exist are skipped."""
+    columns = ('name',)
+
+    def __init__(self, conn, clinic, shard):
+        self.names = {name for _, name in conn.execute(EXPORT_EXERCISES_SQL)}
+
+    def convert(self, record):
+        name = (record['name'] or '').strip()
+        if not name:
+            raise ValueError("empty exercise name")
+        if name in self.names:
+            raise ValueError(f"exercise {name!r} already exists")
+        self.names.add(name)
+        return (name,)
+
+    def write(self, conn, batch):
+        return conn.executemany(IMPORT_EXERCISE_SQL, batch).rowcount
+
+class ScheduleImport:
+    """CSV columns patient_email, exercise, scheduled_at and optionally completed, as export_history writes them.
+
+    Times without an offset are read in the patient's timezone. Added rows
+    already in the past stay out of the change log, so open dashboards are
+    not flooded with history; the patients' calendar feeds are bumped.
+    """
+    columns = ('patient_email', 'exercise', 'scheduled_at')
+
+    def __init__(self, conn, clinic, shard):
+        self.patients = {email: (patient_id, timezone) for patient_id, email, timezone in conn.execute(
+            "SELECT id, email, timezone FROM users WHERE role = 'patient'")}
+        # The lowest id wins when two exercises share a name
+        self.exercises = {name: exercise_id for exercise_id, name in conn.execute(
+            EXPORT_EXERCISES_SQL + " ORDER BY id DESC")}
+        self.zones = {}
+        self.now = int(time.time())
+
+    def convert(self, record):
+        email, exercise = (record['patient_email'] or '').strip(), (record['exercise'] or '').strip()
+        if email not in self.patients:
+            raise ValueError(f"unknown patient {email!r}")
+        if exercise not in self.exercises:
+            raise ValueError(f"unknown exercise {exercise!r}")
+        patient_id, timezone = self.patients[email]
+        try:
+            when = datetime.datetime.fromisoformat((record['scheduled_at'] or '').strip())
+        except ValueError:
+            raise ValueError(f"bad scheduled_at {record['scheduled_at']!r}")
+        if when.tzinfo is None:
+            if timezone not in self.zones:
+                self.zones[timezone] = get_zone(timezone)
+            at = to_epoch(when, self.zones[timezone])
+        else:
+            at = int(when.timestamp())
+        completed = (record.get('completed') or '').strip().lower() in ('1', 'true', 'yes')
+        return (patient_id, self.exercises[exercise], at, int(completed), self.now)
+
+    def write(self, conn, batch):
+        last_change = conn.execute(CHANGE_CURSOR_SQL).fetchone()[0] or 0
+        conn.executemany(IMPORT_SCHEDULE_SQL, batch)
+        conn.execute(IMPORT_QUIET_CHANGES_SQL, (last_change, self.now))
+        conn.executemany(FEED_BUMP_SQL, ((patient_id, self.now) for patient_id in {row[0] for row in batch}))
+        return len(batch)
+
+IMPORTERS = {'patients': PatientImport, 'exercises': ExerciseImport, 'schedule': ScheduleImport}
+
+def import_csv(conn, kind, lines, clinic=None, shard=None, batch_size=IMPORT_BATCH, offline=True):
+    """Bulk-load patients, exercises or schedule rows from CSV text `lines` (a file or request stream).
+
+    Rows are checked as they are read and written with executemany,
+    batch_size per BEGIN IMMEDIATE transaction, so memory stays flat and
+    app writes wait for one batch at most. Bad rows are skipped. Returns
+    {'imported': n, 'skipped': n, 'errors': [the first IMPORT_MAX_ERRORS reasons]}.
+    Raises ValueError if a required column is missing, or if an importer's
+    offline_columns appear when not `offline` (i.e. serving a request).
+
+    Patients without a clinic get `clinic`, by default the shard's own
+    (or 'main' unsharded). Into a shard, patients of another clinic, or
+    whose email the directory routes to another shard, are skipped.
+    """
+    if clinic is None:
+        clinic = shard_clinic(conn, shard) if shard else 'main'
+    importer = IMPORTERS[kind](conn, clinic, shard)
+    reader = csv.DictReader(lines)
+    missing = [column for column in importer.columns if column not in (reader.fieldnames or ())]
+    if missing:
+        raise ValueError(f"Missing CSV column(s): {', '.join(missing)}")
+    offline_only = [column for column in getattr(importer, 'offline_columns', ())
+                    if column in reader.fieldnames]
+    if offline_only and not offline:
+        raise ValueError(f"CSV column(s) {', '.join(offline_only)} can only be imported with"
+                         f" 'flask --app app import-csv'.")
+    result = {'imported': 0, 'skipped': 0, 'errors': []}
+
+    def skip(line, reason):
+        result['skipped'] += 1
+        if len(result['errors']) < IMPORT_MAX_ERRORS:
+            result['errors'].append(f"line {line}: {reason}")
+
+    def flush(batch, lines_read):
+        if shard and kind == 'patients':
+            # An email routed elsewhere must not also land here, where its logins would never arrive
+            owners = get_shard_directory().shards_for_emails(row[0] for row in batch)
+            for row, line in zip(batch, lines_read):
+                if owners.get(row[0], shard) != shard:
+                    skip(line, f"{row[0]} is already in shard {owners[row[0]]}")
+            batch = [row for row in batch if owners.get(row[0], shard) == shard]
+            if not batch:
+                return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            written = importer.write(conn, batch)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        if shard and kind == 'patients':
+            get_shard_directory().add_users([row[0] for row in batch], shard)
+        result['imported'] += written
+        result['skipped'] += len(batch) - written  # patients already there
+
+    batch, lines_read = [], []
+    for record in reader:
+        try:
+            batch.append(importer.convert(record))
+        except ValueError as e:
+            skip(reader.line_num, e)
+            continue
+        lines_read.append(reader.line_num)
+        if len(batch) >= batch_size:
+            flush(batch, lines_read)
+            batch, lines_read = [], []
+    if batch:
+        flush(batch, lines_read)
+    return result
+
+@click.command('import-csv')
+@with_appcontext
+@click.argument('kind', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--clinic', help="Clinic of patients the CSV gives none  [default: the shard's, or main]")
+@click.option('--shard', help="Shard to import into; required when sharded, except for exercises.")
+@click.option('--batch', default=IMPORT_BATCH, show_default=True, help="Rows written per transaction.")
+def import_csv_command(kind, path, clinic, shard, batch):
+    """Bulk-load patients, exercises or schedule rows from a CSV file ('-' for stdin).
+
+    Columns: patients email[,name,timezone,password,clinic]; exercises name;
+    schedule patient_email,exercise,scheduled_at[,completed], so an
+    export-history CSV imports as it is. Sharded, exercises go into
+    every shard, as split-shards copies them.
+    """
+    targets = [(None, current_app.config['DATABASE'])]
+    if current_app.config.get('SHARD_DIRECTORY'):
+        if kind == 'exercises':
+            if shard:
+                raise click.UsageError("Exercises are imported into every shard; drop --shard.")
+            targets = all_databases(current_app)
+        elif not shard:
+            raise click.UsageError("--shard is required when sharded.")
+        else:
+            try:
+                targets = [(shard, get_shard_directory().database(shard))]
+            except KeyError:
+                raise click.BadParameter(f"Unknown shard {shard!r}.", param_hint='--shard')
+    source = (io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='') if path == '-'
+              else open(path, encoding='utf-8-sig', newline=''))
+    try:
+        lines = source.readlines() if len(targets) > 1 else source  # read once, imported into each shard
+        for target, database in targets:
+            conn = sqlite3.connect(database, timeout=DB_BUSY_TIMEOUT_MS / 1000.0)
+            try:
+                result = import_csv(conn, kind, iter(lines), clinic, target, batch)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+            finally:
+                conn.close()
+            for error in result['errors']:
+                click.echo(error, err=True)
+            prefix = f"{target}: " if len(targets) > 1 else ""
+            click.echo(f"{prefix}{kind}: imported {result['imported']} rows, skipped {result['skipped']}.")
+    finally:
+        source.close()
 
 # --- Routes ---
-@app.route('/')
 def root():
     if session.get('uid'):
         return redirect(url_for('dashboard'))
     return redirect(url_for('login_route'))
 
-@app.route('/login', methods=['GET', 'POST'])
 def login_route():
     if request.method == 'POST':
         email = request.form['email']
         password = request.form['password']
-        app.logger.info(f"Login attempt for email: {email}")
-        db = get_db()
-        user = db.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+        current_app.logger.info("Login attempt for email: %s", email)
+        email_key = 'email:' + email.strip().lower()
+        ip_allowed = login_throttle.hit('ip:' + (request.remote_addr or ''), LOGIN_MAX_ATTEMPTS_PER_IP)
+        if not login_throttle.hit(email_key, LOGIN_MAX_ATTEMPTS_PER_EMAIL) or not ip_allowed:
+            current_app.logger.warning("Login throttled for %s from %s", email, request.remote_addr)
+            return render_custom_template('login', error="Too many login attempts. Please wait a few minutes."), 429
+        sharded = bool(current_app.config.get('SHARD_DIRECTORY'))
+        if sharded:
+            g.shard = get_shard_directory().shard_for_email(email)
+        user = None
+        if g.get('shard') or not sharded:
+            db = get_db()
+            user = db.execute(LOGIN_USER_SQL, (email,)).fetchone()
 
         if user:
-            app.logger.info(f"User found: {user['email']}, role: {user['role']}")
-            if check_password_hash(user['password_hash'], password):
+            current_app.logger.info("User found: %s, role: %s", user['email'], user['role'])
+            try:
+                password_ok = run_hashing(password_hashing.check_password, user['password_hash'], password)
+            except HashingBusy:
+                current_app.logger.warning("Login rejected: password hashing saturated.")
+                return (render_custom_template('login', error="The server is busy. Please try again in a moment."),
+                        503, {'Retry-After': '2'})
+            if password_ok and needs_rehash(user['password_hash']):
+                try:
+                    new_hash = run_hashing(password_hashing.hash_password, password, PASSWORD_HASH_METHOD)
+                except HashingBusy:  # the upgrade can wait for a later login
+                    current_app.logger.info("Skipped password hash upgrade for %s: hashing saturated.", email)
+                else:
+                    db.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, user['id']))
+                    db.commit()
+                    current_app.logger.info("Upgraded password hash parameters for %s.", email)
+            if password_ok:
+                login_throttle.reset(email_key)
                 session['uid'] = user['id']
                 session['role'] = user['role']
                 session['user_name'] = user['name']
-                app.logger.info(f"Login successful for {email}. Role: {user['role']}. Redirecting to dashboard.")
+                session['tz'] = user['timezone']
+                if sharded:
+                    session['shard'] = g.shard
+                current_app.logger.info("Login successful for %s. Role: %s. Redirecting to dashboard.", email, user['role'])
                 return redirect(url_for('dashboard'))
             else:
-                app.logger.warning(f"Password mismatch for user: {email}")
+                current_app.logger.warning("Password mismatch for user: %s", email)
                 return render_custom_template('login', error="Invalid email or password.")
         else:
-            app.logger.warning(f"No user found with email: {email}")
+            current_app.logger.warning("No user found with email: %s", email)
             return render_custom_template('login', error="Invalid email or password.")
     return render_custom_template('login')
 
-@app.route('/logout')
 def logout():
     user_name = session.get('user_name', 'User')
     session.clear()
-    app.logger.info(f"{user_name} logged out.")
+    current_app.logger.info("%s logged out.", user_name)
     return redirect(url_for('login_route'))
 
-@app.route('/dashboard')
 def dashboard():
     if not session.get('uid'):
-        app.logger.warning("Dashboard access attempt without UID in session. Redirecting to login.")
+        current_app.logger.warning("Dashboard access attempt without UID in session. Redirecting to login.")
         return redirect(url_for('login_route'))
     
     role = session.get('role')
-    app.logger.info(f"Accessing dashboard for UID {session.get('uid')}, Role: {role}")
+    current_app.logger.info("Accessing dashboard for UID %s, Role: %s", session.get('uid'), role)
     if role == 'physio':
         return redirect(url_for('physio_dashboard'))
     elif role == 'patient':
         return redirect(url_for('patient_dashboard'))
     else:
-        app.logger.error(f"Invalid or missing role ('{role}') for UID {session.get('uid')}. Clearing session and redirecting to login.")
+        current_app.logger.error("Invalid or missing role ('%s') for UID %s. Clearing session and redirecting to login.", role, session.get('uid'))
         session.clear()
         return redirect(url_for('login_route'))
 
 
-@app.route('/physio')
 def physio_dashboard():
     if not session.get('uid') or session.get('role') != 'physio':
-        app.logger.warning("Unauthorized access attempt to physio dashboard.")
+        current_app.logger.warning("Unauthorized access attempt to physio dashboard.")
         return redirect(url_for('login_route'))
     
-    app.logger.info(f"Physio dashboard accessed by UID {session.get('uid')}")
+    current_app.logger.info("Physio dashboard accessed by UID %s", session.get('uid'))
     db = get_db()
-    patients = db.execute("SELECT id, email, name FROM users WHERE role = 'patient'").fetchall()
-    exercises = db.execute("SELECT id, name FROM exercises").fetchall()
-    app.logger.info(f"Found {len(patients)} patients and {len(exercises)} exercises for physio dashboard.")
-    return render_custom_template('physio', patients=patients, exercises=exercises)
+    # The page only changes with the picker generations, so a revalidating browser gets a 304
+    etag, headers = page_validators(session['uid'], session.get('user_name'),
+                                    cache_generation(db, 'patients'), cache_generation(db, 'exercises'))
+    not_modified = page_not_modified(etag, headers)
+    if not_modified is not None:
+        return not_modified
+    # Only the first page is rendered; the pickers fetch further matches from physio_search
+    patients, _ = search_picker(db, 'patients', '', 0, PICKER_PAGE_SIZE)
+    exercises, _ = search_picker(db, 'exercises', '', 0, PICKER_PAGE_SIZE)
+    return render_custom_template('physio', patients=patients, exercises=exercises), headers
+
+def physio_search():
+    """Typeahead for the physio pickers: ?kind=patients|exercises&q=text&after=<id>&limit=n"""
+    if not session.get('uid') or session.get('role') != 'physio':
+        return jsonify(error="Physio login required."), 403
+    kind = request.args.get('kind', 'patients')
+    if kind not in ('patients', 'exercises'):
+        return jsonify(error="kind must be 'patients' or 'exercises'."), 400
+    after = request.args.get('after', 0, type=int)
+    limit = max(1, min(request.args.get('limit', PICKER_PAGE_SIZE, type=int), 100))
+    rows, next_after = search_picker(get_db(), kind, request.args.get('q', ''), after, limit)
+    return jsonify(results=[dict(row) for row in rows], next=next_after)
+
+def physio_adherence():
+    if not session.get('uid') or session.get('role') != 'physio':
+        current_app.logger.warning("Unauthorized access attempt to adherence report.")
+        return redirect(url_for('login_route'))
+    report = adherence_report(get_db(), request.args, int(time.time()))
+    if report is None:
+        return Response("Unknown patient.\n", status=404, mimetype='text/plain')
+    return render_custom_template('adherence', report=report)
+
+def physio_adherence_json():
+    """The adherence report as JSON: ?patient=<id> for one patient by exercise, else ?q=&after=&limit="""
+    if not session.get('uid') or session.get('role') != 'physio':
+        return jsonify(error="Physio login required."), 403
+    report = adherence_report(get_db(), request.args, int(time.time()))
+    if report is None:
+        return jsonify(error="Unknown patient."), 404
+    return jsonify(report)
+
+def physio_export(fmt):
+    """A clinic's full schedule history, archive included, or one patient's (?patient=<id>), as a streamed download."""
+    if not session.get('uid') or session.get('role') != 'physio':
+        return jsonify(error="Physio login required."), 403
+    patient_id = request.args.get('patient', type=int)
+    db = get_db()
+    if patient_id is not None and db.execute(PATIENT_BY_ID_SQL, (patient_id,)).fetchone() is None:
+        return Response("Unknown patient.\n", status=404, mimetype='text/plain')
+    current_app.logger.info("History export (%s, patient %s) for physio UID %s", fmt, patient_id, session['uid'])
+    filename = f"history-{patient_id}.{fmt}" if patient_id is not None else f"history.{fmt}"
+    return hand_over_connection(Response(export_history(db, fmt, patient_id), mimetype=EXPORT_MIMETYPES[fmt],
+                                         headers={'Content-Disposition': f'attachment; filename={filename}'}))
+
+def physio_import(kind):
+    """Bulk import from a CSV request body; see import_csv for the columns of each kind.
+
+    Patients come in without passwords (they cannot log in until one is set).
+    """
+    if not session.get('uid') or session.get('role') != 'physio':
+        return jsonify(error="Physio login required."), 403
+    if kind == 'exercises' and current_app.config.get('SHARD_DIRECTORY'):
+        return jsonify(error="Exercises are shared by every clinic; import them with"
+                             " 'flask --app app import-csv exercises'."), 400
+    db = get_db()
+    clinic = db.execute("SELECT clinic FROM users WHERE id = ?", (session['uid'],)).fetchone()[0]
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+    try:
+        result = import_csv(db, kind, lines, clinic, current_shard(), offline=False)
+    except (ValueError, csv.Error) as e:
+        return jsonify(error=str(e)), 400
+    except sqlite3.Error as e:
+        current_app.logger.error("Database error on %s import: %s", kind, e)
+        return jsonify(error="Could not save the import."), 500
+    current_app.logger.info("Imported %s %s rows (%s skipped) for physio UID %s.",
+                            result['imported'], kind, result['skipped'], session['uid'])
+    return jsonify(result)
 
-@app.route('/assign', methods=['POST'])
 def assign():
     if not session.get('uid') or session.get('role') != 'physio':
-        app.logger.warning("Unauthorized assignment attempt.")
+        current_app.logger.warning("Unauthorized assignment attempt.")
         return redirect(url_for('login_route'))
 
     patient_id = request.form['patient_id']
     exercise_id = request.form['exercise_id']
     date_str = request.form['date']
     time_str = request.form['time']
-    app.logger.info(f"Assigning exercise {exercise_id} to patient {patient_id} for {date_str} {time_str}")
+    current_app.logger.info("Assigning exercise %s to patient %s for %s %s", exercise_id, patient_id, date_str, time_str)
     
     try:
         scheduled_at_dt = datetime.datetime.strptime(f"{date_str} {time_str}", '%Y-%m-%d %H:%M')
     except ValueError:
-        app.logger.error(f"Invalid date/time format for assignment: {date_str} {time_str}")
+        current_app.logger.error("Invalid date/time format for assignment: %s %s", date_str, time_str)
         # Consider adding a flash message here for the user
         return redirect(url_for('physio_dashboard'))
 
     db = get_db()
     try:
-        db.execute("INSERT INTO schedule (patient_id, exercise_id, scheduled_at) VALUES (?, ?, ?)",
-                     (patient_id, exercise_id, scheduled_at_dt))
+        patient = db.execute("SELECT timezone FROM users WHERE id = ? AND role = 'patient'", (patient_id,)).fetchone()
+        if patient is None:
+            current_app.logger.error("Assignment to unknown patient %s", patient_id)
+            return redirect(url_for('physio_dashboard'))
+        scheduled_at = to_epoch(scheduled_at_dt, get_zone(patient['timezone']))
+        db.execute(ASSIGN_SQL, (patient_id, exercise_id, scheduled_at))
+        bump_calendar_version(db, patient_id)
         db.commit()
-        app.logger.info("Exercise assigned successfully.")
+        notify_schedule_change()
+        current_app.logger.info("Exercise assigned successfully.")
     except sqlite3.Error as e:
-        app.logger.error(f"Database error on assign: {e}")
+        current_app.logger.error("Database error on assign: %s", e)
     return redirect(url_for('physio_dashboard'))
 
-@app.route('/patient')
+def assign_bulk():
+    """Assign a recurring program, e.g.
+    {"patient_ids": [2], "exercise_ids": [1, 3], "days": ["MO", "WE", "FR"],
+     "times": ["08:00", "18:00"], "start_date": "2026-01-05", "end_date": "2026-03-29"}
+    """
+    if not session.get('uid') or session.get('role') != 'physio':
+        current_app.logger.warning("Unauthorized bulk assignment attempt.")
+        return jsonify(error="Physio login required."), 403
+
+    spec = request.get_json(silent=True) or {}
+    try:
+        patient_ids, exercise_ids, occurrences = parse_recurrence(spec, BULK_ASSIGN_MAX_ROWS)
+    except RecurrenceError as e:
+        return jsonify(error=str(e)), 400
+
+    db = get_db()
+    patient_zones = dict(db.execute(
+        "SELECT id, timezone FROM users WHERE role = 'patient' AND id IN (SELECT value FROM json_each(?))",
+        (json.dumps(patient_ids),)).fetchall())
+    unknown = [p for p in patient_ids if p not in patient_zones]
+    if unknown:
+        return jsonify(error=f"Unknown patient ids: {unknown}"), 400
+
+    try:
+        created, conflicts = bulk_assign(db, patient_zones, exercise_ids, occurrences,
+                                         skip_conflicts=spec.get('skip_conflicts', True))
+    except sqlite3.Error as e:
+        current_app.logger.error("Database error on bulk assign: %s", e)
+        return jsonify(error="Could not save assignments."), 400
+    notify_schedule_change()
+    current_app.logger.info("Bulk assigned %s schedule rows (%s conflicts skipped).", created, conflicts)
+    return jsonify(created=created, conflicts=conflicts, occurrences=len(occurrences))
+
 def patient_dashboard():
     if not session.get('uid') or session.get('role') != 'patient':
-        app.logger.warning("Unauthorized access attempt to patient dashboard.")
+        current_app.logger.warning("Unauthorized access attempt to patient dashboard.")
         return redirect(url_for('login_route'))
 
-    app.logger.info(f"Patient dashboard accessed by UID {session.get('uid')}")
+    current_app.logger.info("Patient dashboard accessed by UID %s", session.get('uid'))
     db = get_db()
-    today = datetime.date.today()
-    start_of_today = datetime.datetime.combine(today, datetime.time.min)
-    end_of_today = datetime.datetime.combine(today, datetime.time.max)
+    zone = get_zone(session.get('tz'))
+    start_of_today, end_of_today = day_window(datetime.datetime.now(zone).date(), zone)
 
-    items = db.execute("""
-        SELECT s.id, e.name, s.scheduled_at, s.completed 
-        FROM schedule s
-        JOIN exercises e ON e.id = s.exercise_id 
-        WHERE s.patient_id = ? AND s.scheduled_at BETWEEN ? AND ?
-        ORDER BY s.scheduled_at ASC
-    """, (session['uid'], start_of_today, end_of_today)).fetchall()
-    
-    processed_items = []
-    for item_row in items:
-        item_dict = dict(item_row) 
-        if isinstance(item_dict['scheduled_at'], str):
-            try:
-                item_dict['scheduled_at'] = datetime.datetime.fromisoformat(item_dict['scheduled_at'])
-            except ValueError:
-                app.logger.error(f"Could not parse scheduled_at string: {item_dict['scheduled_at']}")
-                pass 
-        processed_items.append(item_dict)
-    
-    app.logger.info(f"Found {len(processed_items)} items for patient UID {session.get('uid')} for today.")
-    return render_custom_template('patient', items=processed_items)
+    # The feed version is bumped by every /assign and /done for this patient, so it
+    # doubles as the generation of the cached day list
+    feed = get_calendar_feed(db, session['uid'])
+    feed_token = feed['token'] or get_feed_token(db, session['uid'])
+    # ...and of the page: a cached copy's older change cursor only makes its event stream replay more
+    etag, headers = page_validators(session['uid'], session.get('user_name'), session.get('tz'),
+                                    start_of_today, feed['version'], feed_token)
+    not_modified = page_not_modified(etag, headers)
+    if not_modified is not None:
+        return not_modified
+    # Read before the rows: the page's event stream replays anything newer, at worst twice
+    change_cursor = db.execute(CHANGE_CURSOR_SQL).fetchone()[0] or 0
+    items = today_cache.get_or_load(
+        (current_shard(), session['uid'], start_of_today), feed['version'],
+        lambda: db.execute(PATIENT_TODAY_SQL, (session['uid'], start_of_today, end_of_today)).fetchall())
+    response = stream_custom_template('patient', items=items, feed_token=feed_token, tz=zone,
+                                      change_cursor=change_cursor)
+    response.headers.update(headers)
+    return response
+
+def patient_events():
+    """Server-sent events with changes to today's schedule of the logged-in patient."""
+    if not session.get('uid') or session.get('role') != 'patient':
+        return Response("Patient login required.\n", status=403, mimetype='text/plain')
+
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', 0, type=int)
+    feed = get_change_feed()
+    stream, dispatched_upto = feed.subscribe(session['uid'], get_zone(session.get('tz')), after)
+    if stream is None:
+        current_app.logger.warning("Refused event stream: %s already open in this worker.", SSE_MAX_STREAMS)
+        return Response("Too many open streams.\n", status=503, mimetype='text/plain', headers={'Retry-After': '60'})
+    try:
+        backlog = []
+        if dispatched_upto > after:
+            backlog = get_db().execute(PATIENT_CHANGES_SQL, (session['uid'], after, dispatched_upto)).fetchall()
+    except sqlite3.Error:
+        feed.unsubscribe(stream)
+        raise
+    response = Response(stream.iter_events(backlog), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(functools.partial(feed.unsubscribe, stream))
+    return response
 
-@app.route('/done/<int:id>', methods=['POST'])
 def done(id):
     if not session.get('uid') or session.get('role') != 'patient':
-        app.logger.warning("Unauthorized 'done' action attempt.")
+        current_app.logger.warning("Unauthorized 'done' action attempt.")
         return redirect(url_for('login_route'))
 
-    app.logger.info(f"Marking schedule item {id} as done for UID {session.get('uid')}")
-    db = get_db()
+    current_app.logger.info("Marking schedule item %s as done for UID %s", id, session.get('uid'))
     try:
-        db.execute("UPDATE schedule SET completed = 1 WHERE id = ? AND patient_id = ?", (id, session['uid']))
-        db.commit()
-        app.logger.info(f"Schedule item {id} marked as done.")
+        get_writer().submit(set_completion, session['uid'], [id], True, timeout=GROUP_COMMIT_TIMEOUT)
+        notify_schedule_change()
+        current_app.logger.info("Schedule item %s marked as done.", id)
+    except FutureTimeoutError:
+        current_app.logger.error("Timed out waiting for group commit of item %s.", id)
+        return Response("Saving took too long; go back and try again.\n", status=503, mimetype='text/plain',
+                        headers={'Retry-After': '2'})
     except sqlite3.Error as e:
-        app.logger.error(f"Database error on done action: {e}")
+        current_app.logger.error("Database error on done action: %s", e)
     return redirect(url_for('patient_dashboard'))
 
-@app.route('/calendar.ics')
+def done_batch():
+    """Mark several schedule items done, or undo them: {"ids": [12, 13], "completed": true}"""
+    if not session.get('uid') or session.get('role') != 'patient':
+        return jsonify(error="Patient login required."), 403
+
+    spec = request.get_json(silent=True) or {}
+    completed = spec.get('completed', True)
+    try:
+        item_ids = sorted({int(i) for i in spec['ids']}) if isinstance(spec['ids'], list) else None
+    except KeyError:
+        return jsonify(error="Missing field: ids"), 400
+    except (TypeError, ValueError):
+        item_ids = None
+    if item_ids is None:
+        return jsonify(error="ids must be a list of schedule item ids."), 400
+    if not isinstance(completed, bool):
+        return jsonify(error="completed must be true or false."), 400
+    if not 0 < len(item_ids) <= DONE_BATCH_MAX_ITEMS:
+        return jsonify(error=f"Send between 1 and {DONE_BATCH_MAX_ITEMS} ids."), 400
+
+    try:
+        changed = get_writer().submit(set_completion, session['uid'], item_ids, completed,
+                                      timeout=GROUP_COMMIT_TIMEOUT)
+    except FutureTimeoutError:
+        current_app.logger.error("Timed out waiting for group commit of %s items.", len(item_ids))
+        return jsonify(error="Saving took too long; retry."), 503
+    except sqlite3.Error as e:
+        current_app.logger.error("Database error on batch done: %s", e)
+        return jsonify(error="Could not save completions."), 500
+    notify_schedule_change()
+    current_app.logger.info("Set completed=%s on %s of %s items for UID %s.",
+                            completed, len(changed), len(item_ids), session['uid'])
+    return jsonify(completed=completed, changed=changed)
+
 def ics():
     if not session.get('uid') or session.get('role') != 'patient':
-        app.logger.warning("Unauthorized ICS download attempt.")
+        current_app.logger.warning("Unauthorized ICS download attempt.")
         return redirect(url_for('login_route'))
 
-    app.logger.info(f"Generating ICS calendar for UID {session.get('uid')}")
-    cal = Calendar()
+    current_app.logger.info("Serving ICS calendar for UID %s", session.get('uid'))
     db = get_db()
-    cursor = db.execute("""
-        SELECT e.name, s.scheduled_at 
-        FROM schedule s
-        JOIN exercises e ON e.id = s.exercise_id
-        WHERE s.patient_id = ? AND s.completed = 0 
-    """, (session['uid'],))
+    return calendar_response(db, get_calendar_feed(db, session['uid']), as_attachment=True)
 
-    for row in cursor:
-        event_name = row['name']
-        begin_time_val = row['scheduled_at']
-        
-        if isinstance(begin_time_val, str):
-            try:
-                begin_time = datetime.datetime.fromisoformat(begin_time_val)
-            except ValueError:
-                app.logger.error(f"Could not parse scheduled_at string for ICS event: {begin_time_val}")
-                continue 
-        elif isinstance(begin_time_val, (datetime.datetime, datetime.date)):
-             begin_time = begin_time_val
-        else:
-            app.logger.error(f"Unexpected type for scheduled_at in ICS: {type(begin_time_val)}")
-            continue
+def calendar_feed(token):
+    sharded = bool(current_app.config.get('SHARD_DIRECTORY'))
+    if sharded:
+        g.shard = get_shard_directory().shard_for_token(token)
+    feed = None
+    if g.get('shard') or not sharded:
+        db = get_db()
+        feed = db.execute(FEED_BY_TOKEN_SQL, (token,)).fetchone()
+    if feed is None:
+        current_app.logger.warning("Calendar feed requested with unknown token.")
+        return Response("Unknown calendar.", status=404, mimetype='text/plain')
+    return calendar_response(db, feed, as_attachment=False)
 
-        ev = Event()
-        ev.name = event_name
-        ev.begin = begin_time
-        ev.duration = datetime.timedelta(minutes=30) 
-        cal.events.add(ev)
-    
-    app.logger.info(f"Generated ICS with {len(cal.events)} events.")
-    ics_data = io.BytesIO(str(cal).encode('utf-8'))
-    return send_file(
-        ics_data,
-        mimetype='text/calendar',
-        as_attachment=True,
-        download_name='exercises.ics'
-    )
+# --- Application Factory ---
+def create_app(test_config=None):
+    app = Flask(__name__)
+    # Set the secret key for session management, defaulting if not set in environment
+    app.secret_key = os.getenv("SECRET_KEY", "a_default_dev_secret_key_longer_and_more_random") # Made default key a bit better
+    app.config['DATABASE'] = DATABASE_FILE
+    app.config['SHARD_DIRECTORY'] = SHARD_DIRECTORY and os.path.join(BASE_DIR, SHARD_DIRECTORY)
+    if test_config:
+        app.config.update(test_config)
+
+    # Configure logging
+    # Gunicorn typically handles logging, but this ensures Flask's logger is also active.
+    if not app.debug: # Only configure this if not in debug mode (Gunicorn will set debug=False)
+        app.logger.setLevel(logging.INFO)
+    configure_logging(app)
+
+    # Register the templates once and compile them now, so workers forked from a
+    # preloading gunicorn master inherit them already compiled.
+    if TEMPLATE_CACHE_DIR:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+        app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)}
+    app.jinja_loader = DictLoader(TEMPLATES)
+    app.jinja_env.globals['asset_url'] = asset_url
+    for template_name in TEMPLATES:
+        app.jinja_env.get_template(template_name)
+
+    app.teardown_appcontext(close_db)
+    app.before_request(start_request_timer)
+    app.before_request(drop_unsharded_session)
+    app.after_request(record_request_metrics)
+    app.after_request(compress_response)  # runs first, so the metrics time the compression too
+    app.add_url_rule('/metrics', view_func=metrics_endpoint)
+    app.add_url_rule('/', view_func=root)
+    app.add_url_rule('/assets/<filename>', view_func=static_asset)
+    app.add_url_rule('/login', view_func=login_route, methods=['GET', 'POST'])
+    app.add_url_rule('/logout', view_func=logout)
+    app.add_url_rule('/dashboard', view_func=dashboard)
+    app.add_url_rule('/physio', view_func=physio_dashboard)
+    app.add_url_rule('/physio/search', view_func=physio_search)
+    app.add_url_rule('/physio/adherence', view_func=physio_adherence)
+    app.add_url_rule('/physio/adherence.json', view_func=physio_adherence_json)
+    app.add_url_rule('/physio/export.<any(csv, ndjson):fmt>', view_func=physio_export)
+    app.add_url_rule('/physio/import/<any(patients, exercises, schedule):kind>', view_func=physio_import,
+                     methods=['POST'])
+    app.add_url_rule('/assign', view_func=assign, methods=['POST'])
+    app.add_url_rule('/assign/bulk', view_func=assign_bulk, methods=['POST'])
+    app.add_url_rule('/patient', view_func=patient_dashboard)
+    app.add_url_rule('/patient/events', view_func=patient_events)
+    app.add_url_rule('/done/<int:id>', view_func=done, methods=['POST'])
+    app.add_url_rule('/done/batch', view_func=done_batch, methods=['POST'])
+    app.add_url_rule('/calendar.ics', view_func=ics)
+    app.add_url_rule('/calendar/<token>.ics', view_func=calendar_feed)
+
+    for command in (init_db_command, seed_command, migrate_command, check_query_plans_command, set_timezone_command,
+                    send_reminders_command, backfill_adherence_command, set_clinic_command, split_shards_command,
+                    shard_stats_command, shard_query_command, archive_history_command, export_history_command,
+                    import_csv_command):
+        app.cli.add_command(command)
+
+    warn_if_pending_migrations(app)
+    app.logger.info("Flask application initialized.")
+    return app
+
+# Module-level instance for `gunicorn app:app`; see gunicorn.conf.py for preloading
+app = create_app()
 
 # --- Main Execution ---
 if __name__ == '__main__':
     app.logger.info("Starting Flask app in development mode (direct execution).")
     if not os.path.exists(DATABASE_FILE):
         print(f"Development: Database file {DATABASE_FILE} not found. Initializing...")
+        conn = None
         try:
             conn = sqlite3.connect(DATABASE_FILE)
-            schema_path = os.path.join(BASE_DIR, 'schema.sql')
-            with open(schema_path, 'r') as f:
-                conn.executescript(f.read())
-            # Default Physio
-            conn.execute("INSERT INTO users (email, password_hash, role, name) VALUES (?, ?, ?, ?)",
-                         ("physio@example.com", generate_password_hash("secret"), "physio", "Dr. Physio"))
-            # Default Patient
-            conn.execute("INSERT INTO users (email, password_hash, role, name) VALUES (?, ?, ?, ?)",
-                         ("patient@example.com", generate_password_hash("secret"), "patient", "Pat Patient"))
-            # Default Exercise
-            conn.execute("INSERT INTO exercises (name) VALUES (?)", ("Cat-Camel",))
-            conn.commit()
+            with app.app_context():
+                run_migrations(conn)
+                seed_defaults(conn)
             print("Development: Database initialized with default physio, a test patient, and exercise.")
         except Exception as e:
             print(f"Development: Error initializing database locally: {e}")
@@ -479,4 +3493,3 @@ if __name__ == '__main__':
                 conn.close()
 
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5001)), debug=True)
-
@@ -0,0 +1,24 @@
+"""Synthetic-load benchmarks for the app.
+
+Run ``python -m bench --help`` from the project root. The suite seeds a
+temporary SQLite database, drives every route through the Flask test
+client and/or a locally spawned gunicorn, and prints a JSON report that
+``python -m bench compare`` can diff against an earlier run; e.g.
+``run --patients 50000 --scenarios physio,physio.search`` measures the
+physio pickers at clinic-group scale.
+``python -m bench pool`` serves /patient and /done from gunicorn with a
+new SQLite connection per request and then pooled, and reports both.
+``python -m bench templates`` times each page's template render compiled
+from source on every call and from Jinja's caches. ``python -m bench
+assign`` posts one recurring program of about 100k rows to /assign/bulk.
+``python -m bench startup`` times the app import and a fresh gunicorn's
+first response, with and without preloading. ``python -m bench logins``
+measures /patient latency alone and during a storm of logins.
+``python -m bench streams`` holds many live-update streams open instead
+and reports the memory and threads they cost. ``python -m bench shards``
+splits one seeded database into clinic shards and compares write
+throughput across shard counts. ``python -m bench pages`` loads the HTML
+pages through a throttled proxy and reports bytes on the wire and time
+to render with a cold and a warm browser cache. ``python -m bench bulk``
+archives old history, exports it all and imports part of it back.
+"""
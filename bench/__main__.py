@@ -0,0 +1,455 @@
+"""Command line entry point: ``python -m bench run|compare|pool|templates|assign|startup|logins|streams|reminders|shards|pages|bulk``."""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+from . import runner
+from .assign import assign_program
+from .bulk import bulk_history
+from .logins import login_storm
+from .pages import brotli, measure_pages
+from .reminders import replay_day
+from .renders import time_renders
+from .seed import BENCH_PASSWORD, open_items_by_patient, seed_database
+from .shards import compare_shard_counts
+from .startup import measure_startup
+from .streams import hold_streams
+
+# Benchmarks hammer /login from one IP; keep the throttle and the hashing
+# backpressure (which answers 503 by design) out of the latency numbers.
+BENCH_ENV = {
+    'LOGIN_MAX_ATTEMPTS_PER_EMAIL': '1000000000',
+    'LOGIN_MAX_ATTEMPTS_PER_IP': '1000000000',
+    'LOGIN_HASH_QUEUE_DEPTH': '1000',
+    # Seeded rows come due constantly; keep reminder writes out of route latency (see `reminders`)
+    'REMINDER_SENDER': 'off',
+}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=runner.PROJECT_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_users(db_path, args):
+    rnd = random.Random(args.seed)
+    patients = runner.make_users(db_path, 'patient', args.virtual_users, rnd)
+    open_items = open_items_by_patient(db_path, [vu.uid for vu in patients])
+    for vu in patients:
+        vu.open_items = open_items.get(vu.uid, [])
+    physios = runner.make_users(db_path, 'physio', args.virtual_users, rnd)
+    with sqlite3.connect(db_path) as conn:
+        ctx = {
+            'patient_ids': [r[0] for r in conn.execute("SELECT id FROM users WHERE role = 'patient'")],
+            'exercise_ids': [r[0] for r in conn.execute("SELECT id FROM exercises")],
+            'schedule_rows': conn.execute("SELECT MAX(id) FROM schedule").fetchone()[0] or 1,
+        }
+    return {'patient': patients, 'physio': physios}, ctx
+
+
+def cache_stats(before, after):
+    """Hit ratio per read cache from two {"cache|hit": n, "cache|miss": n} counter snapshots."""
+    stats = {}
+    for key in after:
+        name, result = key.split('|')
+        entry = stats.setdefault(name, {'hits': 0, 'misses': 0})
+        entry['hits' if result == 'hit' else 'misses'] = after[key] - before.get(key, 0)
+    for entry in stats.values():
+        lookups = entry['hits'] + entry['misses']
+        entry['hit_ratio'] = round(entry['hits'] / lookups, 4) if lookups else None
+    return {name: entry for name, entry in stats.items() if entry['hits'] + entry['misses']}
+
+
+def run_scenarios(label, send, users, ctx, scenarios, args, cache_counts):
+    results = {}
+    for scenario in scenarios:
+        print(f"{label}: {scenario}", file=sys.stderr)
+        before = cache_counts()
+        results[scenario] = runner.drive(send, users[runner.SCENARIOS[scenario][0]],
+                                         scenario, ctx, args.concurrency, args.duration)
+        results[scenario]['read_cache'] = cache_stats(before, cache_counts())
+    return results
+
+
+def prepare_app(args):
+    """Point the app at a fresh temporary database; return (app module, app, workdir, db path)."""
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+    workdir = tempfile.mkdtemp(prefix='my-scolio-bench-')
+    db_path = os.path.join(workdir, 'bench.db')
+    os.environ['DB'] = db_path
+    sys.path.insert(0, runner.PROJECT_ROOT)
+    import app as app_module  # after the environment is prepared
+
+    app = app_module.create_app({'DATABASE': db_path})
+    if not args.app_logs:
+        app.logger.setLevel(logging.WARNING)
+    return app_module, app, workdir, db_path
+
+
+def run_benchmark(args, seed, measure, **meta):
+    """Seed a fresh database, measure it, then print the JSON report (and write it to --output).
+
+    `seed` holds seed_database() volumes and `meta` the command's own
+    settings for the report. `measure(app_module, app, workdir, db_path)`
+    returns its results.
+    """
+    app_module, app, workdir, db_path = prepare_app(args)
+    print(f"Seeding {seed['schedule_rows']} schedule rows into {db_path} ...", file=sys.stderr)
+    try:
+        report = {
+            'meta': {
+                'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                **meta,
+                'dataset': seed_database(app, db_path, **seed),
+            },
+        }
+        report['results'] = measure(app_module, app, workdir, db_path)
+    finally:
+        if getattr(args, 'keep_db', False):
+            print(f"Database kept at {db_path}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+def run_command(args):
+    scenarios = args.scenarios.split(',') if args.scenarios else list(runner.SCENARIOS)
+    unknown = [s for s in scenarios if s not in runner.SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    def measure(app_module, app, workdir, db_path):
+        results = {}
+        if args.mode in ('test-client', 'both'):
+            users, ctx = build_users(db_path, args)
+            for group in users.values():
+                runner.attach_test_clients(app, group)
+            results['test_client'] = run_scenarios(
+                'test client', runner.test_client_send, users, ctx, scenarios, args,
+                lambda: app_module.metrics.snapshot()['cache'])
+        if args.mode in ('gunicorn', 'both'):
+            users, ctx = build_users(db_path, args)
+            port = runner.free_port()
+            with runner.gunicorn_server(db_path, args.workers, port, BENCH_ENV):
+                for group in users.values():
+                    runner.attach_http_clients(port, group)
+                results['gunicorn'] = run_scenarios(
+                    'gunicorn', runner.http_send, users, ctx, scenarios, args,
+                    lambda: runner.scrape_cache_counts(port))
+        return results
+
+    run_benchmark(
+        args, dict(patients=args.patients, physios=args.physios, exercises=args.exercises,
+                   schedule_rows=args.schedule_rows, completed_ratio=args.completed_ratio,
+                   days_back=args.days_back, seed=args.seed),
+        measure, duration_s=args.duration, concurrency=args.concurrency, virtual_users=args.virtual_users,
+        gunicorn_workers=args.workers)
+
+
+# Connection settings `pool` compares: a fresh connection and statement cache per request, then the defaults
+POOL_SETTINGS = {
+    'unpooled': {'DB_POOL_SIZE': '0', 'DB_STATEMENT_CACHE': '0'},
+    'pooled': {},
+}
+
+
+def pool_command(args):
+    scenarios = args.scenarios.split(',')
+    unknown = [s for s in scenarios if s not in runner.SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    def measure(app_module, app, workdir, db_path):
+        results = {}
+        for label, settings in POOL_SETTINGS.items():
+            source = os.path.join(workdir, f"{label}.db")  # /done writes; both start from the seeded rows
+            shutil.copyfile(db_path, source)
+            users, ctx = build_users(source, args)
+            port = runner.free_port()
+            with runner.gunicorn_server(source, args.workers, port, {**BENCH_ENV, **settings}):
+                for group in users.values():
+                    runner.attach_http_clients(port, group)
+                results[label] = run_scenarios(label, runner.http_send, users, ctx, scenarios, args,
+                                               lambda: runner.scrape_cache_counts(port))
+        for scenario, summary in results['pooled'].items():
+            before = results['unpooled'][scenario]['throughput_rps']
+            summary['rps_vs_unpooled'] = round(summary['throughput_rps'] / before, 2) if before else None
+        return results
+
+    run_benchmark(
+        args, dict(patients=args.patients, schedule_rows=args.schedule_rows, seed=args.seed),
+        measure, duration_s=args.duration, concurrency=args.concurrency, virtual_users=args.virtual_users,
+        gunicorn_workers=args.workers, settings=POOL_SETTINGS)
+
+
+def assign_command(args):
+    run_benchmark(args, dict(patients=args.patients, schedule_rows=args.schedule_rows),
+                  lambda _, app, workdir, db_path: assign_program(app, db_path, args.rows, args.weeks,
+                                                                  args.exercises),
+                  rows=args.rows)
+
+
+def startup_command(args):
+    run_benchmark(args, dict(patients=args.patients, schedule_rows=args.schedule_rows),
+                  lambda _, app, workdir, db_path: measure_startup(db_path, args.workers, args.repeats, BENCH_ENV),
+                  gunicorn_workers=args.workers, repeats=args.repeats)
+
+
+def logins_command(args):
+    # Keep the app's real hashing queue limit: turning logins away early is what keeps /patient flat
+    env = {**BENCH_ENV, 'LOGIN_HASH_QUEUE_DEPTH': str(args.queue_depth)}
+    run_benchmark(args, dict(patients=max(args.patients, args.probes + args.storm), schedule_rows=args.schedule_rows),
+                  lambda _, app, workdir, db_path: login_storm(db_path, args, env),
+                  duration_s=args.duration, probes=args.probes, storm=args.storm, gunicorn_workers=args.workers,
+                  hash_queue_depth=args.queue_depth)
+
+
+def streams_command(args):
+    run_benchmark(args, dict(patients=args.count, schedule_rows=args.schedule_rows),
+                  lambda _, app, workdir, db_path: hold_streams(app, db_path, args.count, args.workers,
+                                                                probes=args.probes))
+
+
+def reminders_command(args):
+    run_benchmark(args, dict(patients=args.patients, schedule_rows=0),
+                  lambda _, app, workdir, db_path: replay_day(app, db_path, args.rows, args.schedulers,
+                                                              tick=args.tick))
+
+
+def shards_command(args):
+    shard_counts = [int(n) for n in args.shards.split(',')]
+    scenarios = args.scenarios.split(',')
+    run_benchmark(
+        args, dict(patients=args.patients, physios=args.physios, schedule_rows=args.schedule_rows, seed=args.seed),
+        lambda _, app, workdir, db_path: compare_shard_counts(app, workdir, db_path, shard_counts, scenarios,
+                                                              args, BENCH_ENV),
+        duration_s=args.duration, concurrency=args.concurrency, gunicorn_workers=args.workers)
+
+
+# The HTML pages as (name, login email, password, path)
+PAGES = [
+    ('login', None, None, '/login'),
+    ('physio', 'physio0@bench.example', BENCH_PASSWORD, '/physio'),
+    ('physio.adherence', 'physio0@bench.example', BENCH_PASSWORD, '/physio/adherence'),
+    ('patient', 'patient0@bench.example', BENCH_PASSWORD, '/patient'),
+]
+
+
+def templates_command(args):
+    run_benchmark(args, dict(patients=args.patients, schedule_rows=args.schedule_rows),
+                  lambda app_module, app, workdir, db_path: time_renders(app_module, app, PAGES, args.repeats,
+                                                                         os.path.join(workdir, 'jinja')),
+                  repeats=args.repeats)
+
+
+def pages_command(args):
+    run_benchmark(
+        args, dict(patients=args.patients, schedule_rows=args.schedule_rows),
+        lambda _, app, workdir, db_path: measure_pages(db_path, PAGES, args.workers, args.bandwidth_kbps,
+                                                       args.rtt_ms, args.repeats, args.accept_encoding, BENCH_ENV),
+        bandwidth_kbps=args.bandwidth_kbps, rtt_ms=args.rtt_ms, accept_encoding=args.accept_encoding,
+        repeats=args.repeats)
+
+
+def bulk_command(args):
+    run_benchmark(args, dict(patients=args.patients, schedule_rows=args.schedule_rows, days_back=args.days_back),
+                  lambda _, app, workdir, db_path: bulk_history(app, db_path, workdir, args, BENCH_ENV))
+
+
+def compare_command(args):
+    """Print per-route deltas between two reports; exit 1 if p95 regressed past the threshold."""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    regressions = 0
+    print(f"{'mode/route':28} {'rps':>18} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18}")
+    for mode, routes in candidate['results'].items():
+        for route, new in routes.items():
+            old = baseline['results'].get(mode, {}).get(route)
+            if old is None:
+                continue
+            cells = []
+            for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+                before, after = old.get(key), new.get(key)
+                if not before or after is None:
+                    cells.append(f"{'n/a':>18}")
+                    continue
+                change = (after - before) / before
+                cells.append(f"{before:>7.1f}->{after:<7.1f}{change:+.0%}".rjust(18))
+            if old.get('p95_ms') and new.get('p95_ms') and new['p95_ms'] > old['p95_ms'] * (1 + args.threshold):
+                regressions += 1
+                cells.append('  REGRESSION')
+            print(f"{mode + '/' + route:28} " + ' '.join(cells))
+    if regressions:
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help="seed a temporary database and benchmark every route")
+    run.add_argument('--mode', choices=('test-client', 'gunicorn', 'both'), default='both')
+    run.add_argument('--scenarios', help="comma-separated subset of: " + ', '.join(runner.SCENARIOS))
+    run.add_argument('--patients', type=int, default=1000)
+    run.add_argument('--physios', type=int, default=10)
+    run.add_argument('--exercises', type=int, default=50)
+    run.add_argument('--schedule-rows', type=int, default=100_000)
+    run.add_argument('--completed-ratio', type=float, default=0.7)
+    run.add_argument('--days-back', type=int, default=60, help="days of history the schedule rows span")
+    run.add_argument('--seed', type=int, default=1)
+    run.add_argument('--duration', type=float, default=5.0, help="seconds per scenario")
+    run.add_argument('--concurrency', type=int, default=8, help="client threads per scenario")
+    run.add_argument('--virtual-users', type=int, default=50, help="logged-in users per role")
+    run.add_argument('--workers', type=int, default=4, help="gunicorn workers")
+    run.add_argument('--output', help="also write the JSON report to this file")
+    run.add_argument('--keep-db', action='store_true', help="keep the seeded database for inspection")
+    run.add_argument('--app-logs', action='store_true', help="keep INFO app logs in test-client mode")
+    run.set_defaults(func=run_command)
+
+    pool = sub.add_parser('pool', help="requests/sec on gunicorn with a connection per request, then pooled")
+    pool.add_argument('--scenarios', default='patient,done', help="scenarios to drive with each setting")
+    pool.add_argument('--patients', type=int, default=1000)
+    pool.add_argument('--schedule-rows', type=int, default=100_000)
+    pool.add_argument('--seed', type=int, default=1)
+    pool.add_argument('--duration', type=float, default=5.0, help="seconds per scenario")
+    pool.add_argument('--concurrency', type=int, default=16, help="client threads per scenario")
+    pool.add_argument('--virtual-users', type=int, default=50, help="logged-in users per role")
+    pool.add_argument('--workers', type=int, default=4, help="gunicorn workers")
+    pool.add_argument('--output', help="also write the JSON report to this file")
+    pool.add_argument('--app-logs', action='store_true', help=argparse.SUPPRESS)
+    pool.set_defaults(func=pool_command)
+
+    templates = sub.add_parser('templates', help="time each page's template render: compiled per call vs cached")
+    templates.add_argument('--repeats', type=int, default=200, help="renders per template and variant")
+    templates.add_argument('--patients', type=int, default=1000)
+    templates.add_argument('--schedule-rows', type=int, default=100_000)
+    templates.add_argument('--output', help="also write the JSON report to this file")
+    templates.add_argument('--app-logs', action='store_true', help=argparse.SUPPRESS)
+    templates.set_defaults(func=templates_command)
+
+    assign = sub.add_parser('assign', help="bulk-assign one large recurring program, then repeat it as conflicts")
+    assign.add_argument('--rows', type=int, default=100_000, help="schedule rows the program generates (about)")
+    assign.add_argument('--weeks', type=int, default=12, help="length of the twice-daily program")
+    assign.add_argument('--exercises', type=int, default=2, help="exercises in the program")
+    assign.add_argument('--patients', type=int, default=1000, help="seeded patients, at least the program needs")
+    assign.add_argument('--schedule-rows', type=int, default=100_000, help="existing rows the conflict check sees")
+    assign.add_argument('--output', help="also write the JSON report to this file")
+    assign.add_argument('--app-logs', action='store_true', help=argparse.SUPPRESS)
+    assign.set_defaults(func=assign_command)
+
+    startup = sub.add_parser('startup', help="time the app import and gunicorn until its first response")
+    startup.add_argument('--workers', type=int, default=1, help="gunicorn workers per start")
+    startup.add_argument('--repeats', type=int, default=5, help="starts per setting; medians are reported")
+    startup.add_argument('--patients', type=int, default=1000)
+    startup.add_argument('--schedule-rows', type=int, default=100_000)
+    startup.add_argument('--output', help="also write the JSON report to this file")
+    startup.add_argument('--app-logs', action='store_true', help=argparse.SUPPRESS)
+    startup.set_defaults(func=startup_command)
+
+    logins = sub.add_parser('logins', help="/patient latency on its own and during a login storm")
+    logins.add_argument('--storm', type=int, default=32, help="threads posting /login during the storm")
+    logins.add_argument('--probes', type=int, default=2, help="threads loading /patient in both phases")
+    logins.add_argument('--queue-depth', type=int, default=2, help="LOGIN_HASH_QUEUE_DEPTH for the server")
+    logins.add_argument('--duration', type=float, default=10.0, help="seconds per phase")
+    logins.add_argument('--patients', type=int, default=1000)
+    logins.add_argument('--schedule-rows', type=int, default=100_000)
+    logins.add_argument('--seed', type=int, default=1)
+    logins.add_argument('--workers', type=int, default=4, help="gunicorn workers")
+    logins.add_argument('--output', help="also write the JSON report to this file")
+    logins.add_argument('--app-logs', action='store_true', help=argparse.SUPPRESS)
+    logins.set_defaults(func=logins_command)
+
+    streams = sub.add_parser('streams', help="hold many /patient/events streams open and measure memory")
+    streams.add_argument('--count', type=int, default=1000, help="concurrent streams (one patient each)")
+    streams.add_argument('--workers', type=int, default=4, help="gunicorn workers")
+    streams.add_argument('--schedule-rows', type=int, default=10_000)
+    streams.add_argument('--probes', type=int, default=20, help="streams checked for push latency")
+    streams.add_argument('--output', help="also write the JSON report to this file")
+    streams.add_argument('--app-logs', action='store_true', help=argparse.SUPPRESS)
+    streams.set_defaults(func=streams_command)
+
+    reminders = sub.add_parser('reminders', help="replay a day of due reminders through competing schedulers")
+    reminders.add_argument('--rows', type=int, default=1_000_000, help="schedule rows coming due in the day")
+    reminders.add_argument('--schedulers', type=int, default=4, help="concurrent schedulers, like gunicorn workers")
+    reminders.add_argument('--tick', type=int, default=60, help="simulated seconds between passes")
+    reminders.add_argument('--patients', type=int, default=1000)
+    reminders.add_argument('--output', help="also write the JSON report to this file")
+    reminders.add_argument('--app-logs', action='store_true', help=argparse.SUPPRESS)
+    reminders.set_defaults(func=reminders_command)
+
+    shards = sub.add_parser('shards', help="compare write throughput unsharded and split into clinic shards")
+    shards.add_argument('--shards', default='1,4,16', help="comma-separated shard counts to try")
+    shards.add_argument('--scenarios', default='assign,done.batch', help="scenarios to drive on each layout")
+    shards.add_argument('--patients', type=int, default=1000)
+    shards.add_argument('--physios', type=int, default=16, help="at least the largest shard count")
+    shards.add_argument('--schedule-rows', type=int, default=100_000)
+    shards.add_argument('--seed', type=int, default=1)
+    shards.add_argument('--duration', type=float, default=5.0, help="seconds per scenario")
+    shards.add_argument('--concurrency', type=int, default=16, help="client threads per scenario")
+    shards.add_argument('--virtual-users', type=int, default=64, help="logged-in users per role")
+    shards.add_argument('--workers', type=int, default=4, help="gunicorn workers")
+    shards.add_argument('--output', help="also write the JSON report to this file")
+    shards.add_argument('--app-logs', action='store_true', help=argparse.SUPPRESS)
+    shards.set_defaults(func=shards_command)
+
+    pages = sub.add_parser('pages', help="load the HTML pages through a throttled link, cold and warm cache")
+    pages.add_argument('--bandwidth-kbps', type=float, default=1600, help="downstream bandwidth of the link")
+    pages.add_argument('--rtt-ms', type=float, default=150, help="round-trip time added to every request")
+    pages.add_argument('--accept-encoding', default='br, gzip' if brotli else 'gzip',
+                       help="what the simulated browser accepts ('identity' for none)")
+    pages.add_argument('--repeats', type=int, default=5, help="loads per page; medians are reported")
+    pages.add_argument('--patients', type=int, default=1000)
+    pages.add_argument('--schedule-rows', type=int, default=100_000)
+    pages.add_argument('--workers', type=int, default=2, help="gunicorn workers")
+    pages.add_argument('--output', help="also write the JSON report to this file")
+    pages.add_argument('--app-logs', action='store_true', help=argparse.SUPPRESS)
+    pages.set_defaults(func=pages_command)
+
+    bulk = sub.add_parser('bulk', help="archive old history, then export it all and import part of it back")
+    bulk.add_argument('--schedule-rows', type=int, default=5_000_000)
+    bulk.add_argument('--days-back', type=int, default=730, help="days of history the schedule rows span")
+    bulk.add_argument('--archive-after-days', type=int, default=365)
+    bulk.add_argument('--import-rows', type=int, default=1_000_000, help="exported schedule rows imported back")
+    bulk.add_argument('--patients', type=int, default=1000)
+    bulk.add_argument('--workers', type=int, default=2, help="gunicorn workers for the HTTP export")
+    bulk.add_argument('--output', help="also write the JSON report to this file")
+    bulk.add_argument('--app-logs', action='store_true', help=argparse.SUPPRESS)
+    bulk.set_defaults(func=bulk_command)
+
+    compare = sub.add_parser('compare', help="diff two JSON reports")
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--threshold', type=float, default=0.10, help="allowed p95 growth before failing")
+    compare.set_defaults(func=compare_command)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
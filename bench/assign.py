@@ -0,0 +1,41 @@
+"""One large recurring program through /assign/bulk: fresh rows, then the same program again as all conflicts."""
+import datetime
+import math
+import sqlite3
+import time
+
+from .seed import BENCH_PASSWORD
+
+PROGRAM_DAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+PROGRAM_TIMES = ['08:00', '18:00']
+
+
+def assign_program(app, db_path, rows, weeks, exercises):
+    """POST a twice-daily program of `weeks` for enough patients to generate about `rows` rows.
+
+    The second POST repeats the spec, so every row is found by the
+    conflict query and skipped; it times the check on its own.
+    """
+    per_patient = weeks * 7 * len(PROGRAM_TIMES) * exercises
+    with sqlite3.connect(db_path) as conn:
+        patient_ids = [r[0] for r in conn.execute("SELECT id FROM users WHERE role = 'patient' ORDER BY id LIMIT ?",
+                                                  (math.ceil(rows / per_patient),))]
+        exercise_ids = [r[0] for r in conn.execute("SELECT id FROM exercises ORDER BY id LIMIT ?", (exercises,))]
+    start = datetime.date.today() + datetime.timedelta(days=1)
+    spec = {'patient_ids': patient_ids, 'exercise_ids': exercise_ids, 'days': PROGRAM_DAYS, 'times': PROGRAM_TIMES,
+            'start_date': start.isoformat(),
+            'end_date': (start + datetime.timedelta(weeks=weeks, days=-1)).isoformat()}
+
+    client = app.test_client()
+    client.post('/login', data={'email': 'physio0@bench.example', 'password': BENCH_PASSWORD})
+    results = {'patients': len(patient_ids), 'exercises': len(exercise_ids), 'weeks': weeks}
+    for label in ('insert', 'all_conflicts'):
+        started = time.perf_counter()
+        response = client.post('/assign/bulk', json=spec)
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError(f"/assign/bulk answered {response.status_code}: {response.get_data(as_text=True)}")
+        body = response.get_json()
+        results[label] = {'seconds': round(elapsed, 3), 'created': body['created'], 'conflicts': body['conflicts'],
+                          'rows_per_second': round(body['occurrences'] * len(patient_ids) * len(exercise_ids) / elapsed)}
+    return results
@@ -0,0 +1,191 @@
+"""Archive, export and import at volume: write-lock hold times, throughput and memory."""
+import csv
+import http.client
+import itertools
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from . import runner
+from .pages import login
+from .seed import BENCH_PASSWORD
+from .streams import proc_status, worker_pids
+
+
+class RssSampler:
+    """Samples this process's resident memory on a thread; `growth_kib` is the peak above the start."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.start = self.peak = proc_status(os.getpid(), 'VmRSS')
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, proc_status(os.getpid(), 'VmRSS'))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, proc_status(os.getpid(), 'VmRSS'))
+
+    @property
+    def growth_kib(self):
+        return self.peak - self.start
+
+
+def probe_writes(db_path, stop, interval=0.01):
+    """Take the write lock every `interval` seconds until `stop` is set; return the waits in seconds."""
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    waits = []
+    try:
+        while not stop.is_set():
+            started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            waits.append(time.perf_counter() - started)
+            conn.execute("COMMIT")
+            time.sleep(interval)
+    finally:
+        conn.close()
+    return waits
+
+
+def run_archive(db_path, older_than_days):
+    """Archive everything older than `older_than_days` while a probe measures how long writers wait."""
+    from app import archive_history  # imported late so callers can set env first
+
+    stop, waits = threading.Event(), []
+    probe = threading.Thread(target=lambda: waits.extend(probe_writes(db_path, stop)))
+    probe.start()
+    conn = sqlite3.connect(db_path, timeout=60)
+    try:
+        started = time.perf_counter()
+        moved, longest = archive_history(conn, int(time.time()) - older_than_days * 86400)
+        elapsed = time.perf_counter() - started
+    finally:
+        conn.close()
+        stop.set()
+        probe.join()
+    waits.sort()
+    return {
+        'older_than_days': older_than_days,
+        'rows_archived': moved,
+        'seconds': round(elapsed, 2),
+        'rows_per_s': round(moved / elapsed) if elapsed else None,
+        'longest_write_transaction_ms': round(longest * 1000, 1),
+        'writer_wait_p50_ms': round(runner.percentile(waits, 50) * 1000, 2) if waits else None,
+        'writer_wait_max_ms': round(waits[-1] * 1000, 2) if waits else None,
+    }
+
+
+def run_export(db_path, fmt, path):
+    """Export the whole database in-process to `path`, sampling memory as it goes."""
+    from app import export_history
+
+    conn = sqlite3.connect(db_path)
+    rows = size = 0
+    try:
+        with RssSampler() as rss, open(path, 'w', encoding='utf-8', newline='') as out:
+            started = time.perf_counter()
+            for chunk in export_history(conn, fmt):
+                out.write(chunk)
+                size += len(chunk)
+                rows += chunk.count('\n')
+            elapsed = time.perf_counter() - started
+    finally:
+        conn.close()
+    rows -= fmt == 'csv'  # header line
+    return {'format': fmt, 'rows': rows, 'mib': round(size / 2 ** 20, 1), 'seconds': round(elapsed, 2),
+            'rows_per_s': round(rows / elapsed), 'rss_growth_kib': rss.growth_kib}
+
+
+def run_http_export(db_path, workers, env):
+    """Download the clinic CSV export from gunicorn, sampling worker memory while it streams."""
+    port = runner.free_port()
+    with runner.gunicorn_server(db_path, workers, port, env) as proc:
+        cookie = login(port, 'physio0@bench.example', BENCH_PASSWORD)
+        rss_before = sum(proc_status(p, 'VmRSS') for p in worker_pids(proc.pid))
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+        started = time.perf_counter()
+        conn.request('GET', '/physio/export.csv', headers={'Cookie': cookie})
+        response = conn.getresponse()
+        size, rss_peak, next_sample = 0, rss_before, 0
+        while True:
+            chunk = response.read(1 << 16)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size >= next_sample:
+                rss_peak = max(rss_peak, sum(proc_status(p, 'VmRSS') for p in worker_pids(proc.pid)))
+                next_sample = size + (8 << 20)
+        elapsed = time.perf_counter() - started
+        conn.close()
+    return {
+        'status': response.status,
+        'transfer_encoding': response.getheader('Transfer-Encoding'),
+        'mib': round(size / 2 ** 20, 1),
+        'seconds': round(elapsed, 2),
+        'mib_per_s': round(size / 2 ** 20 / elapsed, 1),
+        'worker_rss_kib_before': rss_before,
+        'worker_rss_kib_peak': rss_peak,
+    }
+
+
+def run_import(app, source_db, export_path, rows, workdir):
+    """Import patients, exercises and the first `rows` exported schedule rows into a fresh database."""
+    from app import import_csv, run_migrations
+
+    target = os.path.join(workdir, 'import.db')
+    patients_csv = os.path.join(workdir, 'patients.csv')
+    exercises_csv = os.path.join(workdir, 'exercises.csv')
+    schedule_csv = os.path.join(workdir, 'schedule.csv')
+    with sqlite3.connect(source_db) as conn, open(patients_csv, 'w', newline='') as p, \
+            open(exercises_csv, 'w', newline='') as e:
+        csv.writer(p).writerows([('email', 'name', 'timezone')] + conn.execute(
+            "SELECT email, name, timezone FROM users WHERE role = 'patient'").fetchall())
+        csv.writer(e).writerows([('name',)] + conn.execute("SELECT name FROM exercises").fetchall())
+    with open(export_path, encoding='utf-8', newline='') as src, open(schedule_csv, 'w', newline='') as dst:
+        dst.writelines(itertools.islice(src, rows + 1))
+
+    conn = sqlite3.connect(target, timeout=60)
+    results = {}
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        with app.app_context():
+            run_migrations(conn)
+            for kind, path in (('patients', patients_csv), ('exercises', exercises_csv), ('schedule', schedule_csv)):
+                print(f"Importing {kind} ...", file=sys.stderr)
+                with RssSampler() as rss, open(path, encoding='utf-8', newline='') as lines:
+                    started = time.perf_counter()
+                    result = import_csv(conn, kind, lines)
+                    elapsed = time.perf_counter() - started
+                results[kind] = {'imported': result['imported'], 'skipped': result['skipped'],
+                                 'seconds': round(elapsed, 2),
+                                 'rows_per_s': round(result['imported'] / elapsed) if elapsed else None,
+                                 'rss_growth_kib': rss.growth_kib}
+    finally:
+        conn.close()
+    return results
+
+
+def bulk_history(app, db_path, workdir, args, env):
+    export_path = os.path.join(workdir, 'history.csv')
+    results = {}
+    print("Archiving ...", file=sys.stderr)
+    results['archive'] = run_archive(db_path, args.archive_after_days)
+    print("Exporting CSV ...", file=sys.stderr)
+    results['export_csv'] = run_export(db_path, 'csv', export_path)
+    print("Exporting NDJSON ...", file=sys.stderr)
+    results['export_ndjson'] = run_export(db_path, 'ndjson', os.path.join(workdir, 'history.ndjson'))
+    os.remove(os.path.join(workdir, 'history.ndjson'))
+    print("Exporting CSV over HTTP ...", file=sys.stderr)
+    results['export_http_csv'] = run_http_export(db_path, args.workers, env)
+    results['import'] = run_import(app, db_path, export_path, args.import_rows, workdir)
+    return results
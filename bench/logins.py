@@ -0,0 +1,43 @@
+"""/patient latency on gunicorn alone and while a storm of logins keeps the password hashing saturated."""
+import collections
+import random
+import sys
+import threading
+
+from . import runner
+
+
+def login_storm(db_path, args, env):
+    """Probe /patient for `args.duration` seconds, then again with `args.storm` threads posting /login.
+
+    Returns the probe summaries for both phases and the storm's own
+    summary with a count per status; 503s are logins turned away because
+    the hashing queue was full.
+    """
+    rnd = random.Random(args.seed)
+    users = runner.make_users(db_path, 'patient', args.probes + args.storm, rnd)
+    probes, stormers = users[:args.probes], users[args.probes:]
+    statuses, lock = collections.Counter(), threading.Lock()
+
+    def counting_send(vu, method, path, data):
+        status = runner.http_send(vu, method, path, data)
+        with lock:
+            statuses[status] += 1
+        return status
+
+    port = runner.free_port()
+    with runner.gunicorn_server(db_path, args.workers, port, env):
+        runner.attach_http_clients(port, users)
+        print("probe: patient", file=sys.stderr)
+        results = {'baseline': {'patient': runner.drive(runner.http_send, probes, 'patient', {},
+                                                        args.probes, args.duration)}}
+        print("storm: login + probe: patient", file=sys.stderr)
+        storm = {}
+        thread = threading.Thread(target=lambda: storm.update(login=runner.drive(
+            counting_send, stormers, 'login', {}, args.storm, args.duration)))
+        thread.start()
+        results['storm'] = {'patient': runner.drive(runner.http_send, probes, 'patient', {},
+                                                    args.probes, args.duration)}
+        thread.join()
+    results['storm']['login'] = dict(storm['login'], statuses={str(k): v for k, v in sorted(statuses.items())})
+    return results
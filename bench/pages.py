@@ -0,0 +1,159 @@
+"""Page loads through a bandwidth- and latency-throttled proxy: bytes on the wire and time to render."""
+import gzip
+import http.client
+import re
+import socket
+import statistics
+import threading
+import time
+import urllib.parse
+
+from . import runner
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STYLESHEET_LINK = re.compile(rb'<link rel="stylesheet" href="([^"]+)"')
+
+
+class ThrottledProxy:
+    """TCP proxy in front of the app that behaves like a slow mobile link.
+
+    Each request is held for one round trip before it is forwarded, and
+    response bytes are released no faster than `bandwidth_kbps`. Counts
+    every response byte (headers included) that goes back to the client.
+    """
+
+    def __init__(self, upstream_port, bandwidth_kbps, rtt_ms):
+        self.upstream_port = upstream_port
+        self.bytes_per_second = bandwidth_kbps * 1000 / 8
+        self.rtt = rtt_ms / 1000
+        self.bytes_down = 0
+        self._lock = threading.Lock()
+        self._listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(('127.0.0.1', self.upstream_port))
+            threading.Thread(target=self._pump, args=(client, upstream, False), daemon=True).start()
+            threading.Thread(target=self._pump, args=(upstream, client, True), daemon=True).start()
+
+    def _pump(self, source, dest, downstream):
+        try:
+            while True:
+                data = source.recv(16384)
+                if not data:
+                    break
+                if downstream:
+                    time.sleep(len(data) / self.bytes_per_second)
+                    with self._lock:
+                        self.bytes_down += len(data)
+                else:
+                    time.sleep(self.rtt)
+                dest.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (source, dest):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def close(self):
+        self._listener.close()
+
+
+class Browser:
+    """Just enough of a browser: one keep-alive connection, a session cookie, an HTTP cache.
+
+    Pages are revalidated with If-None-Match when an ETag was seen;
+    responses marked immutable are reused without asking. A page counts
+    as rendered once its HTML and its stylesheets have fully arrived.
+    """
+
+    def __init__(self, port, cookie, accept_encoding):
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookie = cookie
+        self.accept_encoding = accept_encoding
+        self.cache = {}  # path -> (etag or None, immutable, decoded body)
+
+    def get(self, path):
+        etag, immutable, body = self.cache.get(path, (None, False, None))
+        if immutable:
+            return body
+        headers = {'Cookie': self.cookie, 'Accept-Encoding': self.accept_encoding}
+        if etag:
+            headers['If-None-Match'] = etag
+        self.conn.request('GET', path, headers=headers)
+        response = self.conn.getresponse()
+        data = response.read()
+        if response.status == 304:
+            return body
+        if response.status != 200:
+            raise RuntimeError(f"GET {path} answered {response.status}")
+        encoding = response.getheader('Content-Encoding')
+        if encoding == 'gzip':
+            data = gzip.decompress(data)
+        elif encoding == 'br':
+            data = brotli.decompress(data)
+        self.cache[path] = (response.getheader('ETag'), 'immutable' in (response.getheader('Cache-Control') or ''),
+                            data)
+        return data
+
+    def render(self, path):
+        html = self.get(path)
+        for href in STYLESHEET_LINK.findall(html):
+            self.get(href.decode())
+
+
+def login(port, email, password):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request('POST', '/login', urllib.parse.urlencode({'email': email, 'password': password}),
+                     {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        response.read()
+        return re.search(r'session=[^;]*', response.getheader('Set-Cookie')).group(0)
+    finally:
+        conn.close()
+
+
+def measure_pages(db_path, pages, workers, bandwidth_kbps, rtt_ms, repeats, accept_encoding, env):
+    """Load each (label, email, password, path) page `repeats` times cold and warm.
+
+    Cold loads start from an empty browser cache; warm loads repeat the
+    visit with the cache the cold load left behind. Returns median bytes
+    down and milliseconds to render per page and visit.
+    """
+    port = runner.free_port()
+    results = {}
+    with runner.gunicorn_server(db_path, workers, port, env):
+        proxy = ThrottledProxy(port, bandwidth_kbps, rtt_ms)
+        try:
+            for label, email, password, path in pages:
+                cookie = login(port, email, password) if email else ''
+                samples = {'cold': ([], []), 'warm': ([], [])}
+                for _ in range(repeats):
+                    browser = Browser(proxy.port, cookie, accept_encoding)
+                    for visit in ('cold', 'warm'):
+                        before = proxy.bytes_down
+                        started = time.perf_counter()
+                        browser.render(path)
+                        samples[visit][0].append(proxy.bytes_down - before)
+                        samples[visit][1].append((time.perf_counter() - started) * 1000)
+                    browser.conn.close()
+                results[label] = {
+                    visit: {'bytes': int(statistics.median(sizes)), 'render_ms': round(statistics.median(times), 1)}
+                    for visit, (sizes, times) in samples.items()}
+        finally:
+            proxy.close()
+    return results
@@ -0,0 +1,119 @@
+"""Replay a day of due reminders through competing schedulers on a simulated clock."""
+import datetime
+import random
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+
+from . import runner
+
+
+class CountingSender:
+    """Sender that records how often each schedule id was delivered, to catch doubles."""
+
+    def __init__(self, size):
+        self.counts = bytearray(size + 1)
+        self._lock = threading.Lock()
+
+    def send(self, reminders):
+        ids = [r['id'] for r in reminders]
+        with self._lock:
+            for i in ids:
+                self.counts[i] = min(self.counts[i] + 1, 255)
+        return ids
+
+
+def seed_due_rows(db_path, rows, day_start, seed=1, batch_size=50_000):
+    """Spread `rows` open schedule rows uniformly over the day starting at `day_start`, to the minute."""
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    try:
+        patient_ids = [r[0] for r in conn.execute("SELECT id FROM users WHERE role = 'patient'")]
+        exercise_ids = [r[0] for r in conn.execute("SELECT id FROM exercises")]
+        remaining = rows
+        while remaining > 0:
+            chunk = min(batch_size, remaining)
+            conn.executemany("INSERT INTO schedule (patient_id, exercise_id, scheduled_at) VALUES (?, ?, ?)",
+                             ((rnd.choice(patient_ids), rnd.choice(exercise_ids), day_start + rnd.randrange(0, 86400, 60))
+                              for _ in range(chunk)))
+            conn.commit()
+            remaining -= chunk
+        conn.execute("DELETE FROM schedule_changes")
+        conn.execute("ANALYZE")
+        conn.commit()
+        return conn.execute("SELECT MAX(id) FROM schedule").fetchone()[0] or 0
+    finally:
+        conn.close()
+
+
+def replay_day(app, db_path, rows, schedulers, tick=60, seed=1):
+    """Run `schedulers` ReminderSchedulers (one thread and connection each) through a simulated day.
+
+    Every `tick` simulated seconds all schedulers make a pass at the same
+    instant, so they compete for the same due rows the way gunicorn workers
+    do. Reports wall time per pass, deliveries per id and peak Python heap.
+    """
+    from app import ReminderScheduler  # imported late so callers can set env first
+
+    day_start = int(datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1), datetime.time.min,
+                                              datetime.timezone.utc).timestamp())
+    print(f"Seeding {rows} rows due over one day ...", file=sys.stderr)
+    max_id = seed_due_rows(db_path, rows, day_start, seed)
+
+    sender = CountingSender(max_id)
+    instances = [ReminderScheduler(db_path, sender, app.logger) for _ in range(schedulers)]
+    ticks = list(range(day_start - instances[0].lead, day_start + 86400 + tick, tick))
+    barrier = threading.Barrier(schedulers)
+    pass_seconds, sent_per_scheduler, errors = [], [0] * schedulers, []
+
+    def work(index):
+        scheduler = instances[index]
+        try:
+            for now in ticks:
+                barrier.wait()
+                started = time.perf_counter()
+                sent_per_scheduler[index] += scheduler.run_once(now)
+                if index == 0:
+                    pass_seconds.append(time.perf_counter() - started)
+        except Exception as e:  # reported, not raised, so the other threads aren't left at the barrier
+            errors.append(repr(e))
+            barrier.abort()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(schedulers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    with sqlite3.connect(db_path) as conn:
+        unsent = conn.execute("SELECT COUNT(*) FROM schedule WHERE reminded_at IS NULL AND completed = 0"
+                              " AND scheduled_at >= ?", (day_start,)).fetchone()[0]
+    delivered = sum(1 for c in sender.counts if c)
+    pass_seconds.sort()
+    ms = lambda value: None if value is None else round(value * 1000, 2)
+    return {
+        'rows_due': rows,
+        'schedulers': schedulers,
+        'tick_s': tick,
+        'passes': len(ticks),
+        'batch_size': instances[0].batch_size,
+        'wall_seconds': round(elapsed, 2),
+        'reminders_per_s': round(delivered / elapsed, 1) if elapsed else None,
+        'simulated_day_speedup': round(86400 / elapsed, 1) if elapsed else None,
+        'pass_p50_ms': ms(runner.percentile(pass_seconds, 50)),
+        'pass_p99_ms': ms(runner.percentile(pass_seconds, 99)),
+        'pass_max_ms': ms(pass_seconds[-1] if pass_seconds else None),
+        'delivered': delivered,
+        'delivered_twice': sum(1 for c in sender.counts if c > 1),
+        'never_sent': unsent,
+        'sent_per_scheduler': sent_per_scheduler,
+        'python_heap_peak_kib': peak // 1024,
+        'errors': errors,
+    }
@@ -0,0 +1,65 @@
+"""Per-render template latency: compiled on every call, from a bytecode cache, and from Jinja's template cache."""
+import os
+import statistics
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+from . import runner
+
+
+def capture_contexts(app_module, app, pages):
+    """Load each page once through the test client and keep the context its template got."""
+    contexts = {}
+    originals = app_module.render_custom_template, app_module.stream_custom_template
+
+    def recording(original):
+        def render(template_name, **context):
+            contexts.setdefault(template_name, dict(context, session=dict(app_module.session)))
+            return original(template_name, **context)
+        return render
+
+    app_module.render_custom_template, app_module.stream_custom_template = map(recording, originals)
+    try:
+        for _, email, password, path in pages:
+            client = app.test_client()
+            if email:
+                client.post('/login', data={'email': email, 'password': password})
+            client.get(path).close()
+    finally:
+        app_module.render_custom_template, app_module.stream_custom_template = originals
+    return contexts
+
+
+def time_renders(app_module, app, pages, repeats, cache_dir):
+    """Median and p95 render time of each page's template in three ways.
+
+    'compile' lexes, parses and compiles the source on every render, as
+    render_template_string did. 'bytecode_cache' loads the compiled
+    template from TEMPLATE_CACHE_DIR on every render, which is what a
+    fresh worker pays once. 'cached' is the steady state: Jinja's
+    in-memory template cache.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    variants = {
+        'compile': app.jinja_env.overlay(cache_size=0),
+        'bytecode_cache': app.jinja_env.overlay(cache_size=0, bytecode_cache=FileSystemBytecodeCache(cache_dir)),
+        'cached': app.jinja_env,
+    }
+    results = {}
+    for name, context in capture_contexts(app_module, app, pages).items():
+        with app.test_request_context():
+            context = dict(context)
+            app.update_template_context(context)
+            results[name] = {'bytes': len(app.jinja_env.get_template(name).render(context))}
+            for label, env in variants.items():
+                env.get_template(name).render(context)  # fills the bytecode cache
+                samples = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    env.get_template(name).render(context)
+                    samples.append(time.perf_counter() - start)
+                samples.sort()
+                results[name][f'{label}_p50_ms'] = round(statistics.median(samples) * 1000, 3)
+                results[name][f'{label}_p95_ms'] = round(runner.percentile(samples, 95) * 1000, 3)
+    return results
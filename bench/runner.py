@@ -0,0 +1,273 @@
+"""Scenario definitions and the two drivers (Flask test client, spawned gunicorn)."""
+import contextlib
+import datetime
+import http.client
+import json
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+from .seed import BENCH_PASSWORD, FIRST_NAMES
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class VirtualUser:
+    def __init__(self, uid, email, role, rnd, open_items=()):
+        self.uid = uid
+        self.email = email
+        self.role = role
+        self.rnd = rnd
+        self.open_items = list(open_items)
+        self.patient_ids = None  # patients a physio assigns to; ctx['patient_ids'] when None
+        self.transport = None  # FlaskClient, or (HTTPConnection, cookie) for gunicorn
+
+
+class JSONBody:
+    """Marks scenario data to be sent as a JSON request body instead of a form."""
+
+    def __init__(self, value):
+        self.value = value
+
+
+# Each scenario maps a virtual user to (method, path, form data, JSONBody or None).
+def _login(vu, ctx):
+    return 'POST', '/login', {'email': vu.email, 'password': BENCH_PASSWORD}
+
+def _physio(vu, ctx):
+    return 'GET', '/physio', None
+
+def _assign(vu, ctx):
+    day = datetime.date.today() + datetime.timedelta(days=vu.rnd.randrange(1, 30))
+    return 'POST', '/assign', {
+        'patient_id': vu.rnd.choice(vu.patient_ids or ctx['patient_ids']), 'exercise_id': vu.rnd.choice(ctx['exercise_ids']),
+        'date': day.isoformat(), 'time': f"{vu.rnd.randrange(7, 21):02d}:{vu.rnd.choice((0, 15, 30, 45)):02d}"}
+
+def _patient(vu, ctx):
+    return 'GET', '/patient', None
+
+def _done(vu, ctx):
+    item = vu.open_items.pop() if vu.open_items else vu.rnd.randrange(1, ctx['schedule_rows'] + 1)
+    return 'POST', f'/done/{item}', None
+
+def _done_batch(vu, ctx):
+    items = [vu.open_items.pop() if vu.open_items else vu.rnd.randrange(1, ctx['schedule_rows'] + 1)
+             for _ in range(DONE_BATCH_ITEMS)]
+    return 'POST', '/done/batch', JSONBody({'ids': items, 'completed': True})
+
+def _search(vu, ctx):
+    # A physio typing the first letters of a patient's name into the picker
+    prefix = vu.rnd.choice(FIRST_NAMES)[:vu.rnd.randrange(2, 5)]
+    return 'GET', f"/physio/search?kind=patients&q={prefix}", None
+
+def _adherence(vu, ctx):
+    return 'GET', f"/physio/adherence.json?after={vu.rnd.choice(ctx['patient_ids']) - 1}", None
+
+def _ics(vu, ctx):
+    return 'GET', '/calendar.ics', None
+
+DONE_BATCH_ITEMS = 6  # a patient ticking off a typical day's exercises in one call
+
+SCENARIOS = {
+    'login': ('patient', _login),
+    'physio': ('physio', _physio),
+    'physio.search': ('physio', _search),
+    'physio.adherence': ('physio', _adherence),
+    'assign': ('physio', _assign),
+    'patient': ('patient', _patient),
+    'done': ('patient', _done),
+    'done.batch': ('patient', _done_batch),
+    'calendar.ics': ('patient', _ics),
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+    ms = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+    }
+
+
+def drive(send, users, scenario, ctx, concurrency, duration):
+    """Run one scenario from `concurrency` threads for `duration` seconds."""
+    _, make_request = SCENARIOS[scenario]
+    buckets = [users[i::concurrency] for i in range(concurrency)]
+    results = []
+    deadline = time.perf_counter() + duration
+
+    def worker(own_users):
+        latencies, errors, n = [], 0, 0
+        while time.perf_counter() < deadline:
+            vu = own_users[n % len(own_users)]
+            n += 1
+            method, path, data = make_request(vu, ctx)
+            start = time.perf_counter()
+            try:
+                status = send(vu, method, path, data)
+            except (OSError, http.client.HTTPException):
+                status = None
+            latencies.append(time.perf_counter() - start)
+            if status is None or status >= 400:
+                errors += 1
+        results.append((latencies, errors))
+
+    threads = [threading.Thread(target=worker, args=(bucket,)) for bucket in buckets if bucket]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return summarize([l for lat, _ in results for l in lat], sum(e for _, e in results), elapsed)
+
+
+# --- Flask test client driver ---
+def test_client_send(vu, method, path, data):
+    if isinstance(data, JSONBody):
+        response = vu.transport.open(path, method=method, json=data.value)
+    else:
+        response = vu.transport.open(path, method=method, data=data)
+    response.get_data()  # drain streamed bodies so the full render is timed
+    response.close()
+    return response.status_code
+
+
+def attach_test_clients(app, users):
+    for vu in users:
+        vu.transport = app.test_client()
+        test_client_send(vu, *_login(vu, None))
+
+
+# --- gunicorn driver ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn_gunicorn(db_path, workers, port, extra_env=None):
+    env = {**os.environ, 'DB': os.path.abspath(db_path), **(extra_env or {})}
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}', 'app:app'],
+        cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def stop_gunicorn(proc):
+    proc.send_signal(signal.SIGINT)  # quick shutdown; SIGTERM waits out keep-alive clients
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+@contextlib.contextmanager
+def gunicorn_server(db_path, workers, port, extra_env=None, startup_timeout=30):
+    proc = spawn_gunicorn(db_path, workers, port, extra_env)
+    try:
+        deadline = time.time() + startup_timeout
+        while True:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+                conn.request('GET', '/login')
+                ready = conn.getresponse().status == 200
+                conn.close()
+                if ready:
+                    break
+            except OSError:
+                pass
+            if proc.poll() is not None or time.time() > deadline:
+                raise RuntimeError("gunicorn did not start; run it by hand to see the error")
+            time.sleep(0.05)
+        yield proc
+    finally:
+        stop_gunicorn(proc)
+
+
+def http_send(vu, method, path, data):
+    conn, cookie = vu.transport
+    headers = {'Cookie': cookie} if cookie else {}
+    body = None
+    if isinstance(data, JSONBody):
+        body = json.dumps(data.value)
+        headers['Content-Type'] = 'application/json'
+    elif data is not None:
+        body = urllib.parse.urlencode(data)
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    for attempt in (1, 2):
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            break
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # gunicorn drops idle keep-alive sockets; retry once on a fresh one like a browser would
+            conn.close()
+            if attempt == 2:
+                raise
+        except (OSError, http.client.HTTPException):
+            conn.close()  # reconnect on the next request
+            raise
+    response.read()
+    set_cookie = response.getheader('Set-Cookie')
+    if set_cookie:
+        match = re.search(r'session=[^;]*', set_cookie)
+        if match:
+            vu.transport = (conn, match.group(0))
+    return response.status
+
+
+def attach_http_clients(port, users):
+    for vu in users:
+        vu.transport = (http.client.HTTPConnection('127.0.0.1', port, timeout=30), None)
+        http_send(vu, *_login(vu, None))
+
+
+def scrape_cache_counts(port):
+    """Read cache counters summed over all workers from /metrics.
+
+    Workers flush their counters at most once per METRICS_FLUSH_INTERVAL,
+    so per-scenario figures can lag by about a second of traffic.
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request('GET', '/metrics')
+        text = conn.getresponse().read().decode()
+    finally:
+        conn.close()
+    return {f"{name}|{result}": int(value) for name, result, value in
+            re.findall(r'read_cache_lookups_total\{cache="([^"]+)",result="([^"]+)"\} (\d+)', text)}
+
+
+def make_users(path, role, count, rnd, open_items=None):
+    """Pick `count` seeded users of `role` as virtual users."""
+    import sqlite3
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT id, email FROM users WHERE role = ? AND email LIKE '%@bench.example' "
+                            "ORDER BY id LIMIT ?", (role, count)).fetchall()
+    finally:
+        conn.close()
+    return [VirtualUser(uid, email, role, random.Random(rnd.random()), (open_items or {}).get(uid, ()))
+            for uid, email in rows]
@@ -0,0 +1,85 @@
+"""Seed a throwaway database with realistic volumes."""
+import datetime
+import random
+import sqlite3
+import time
+
+from werkzeug.security import generate_password_hash
+
+BENCH_PASSWORD = "secret"
+EXERCISE_NAMES = ["Cat-Camel", "Bird Dog", "Side Plank", "Schroth Breathing", "Wall Angel",
+                  "Pelvic Tilt", "Dead Bug", "Thoracic Rotation", "Child's Pose", "Glute Bridge"]
+FIRST_NAMES = ["Anna", "Ben", "Chloe", "David", "Elena", "Felix", "Greta", "Hugo", "Ines", "Jonas"]
+
+
+def seed_database(app, path, patients=1000, physios=10, exercises=50, schedule_rows=100_000,
+                  completed_ratio=0.7, days_back=60, days_ahead=30, seed=1, batch_size=50_000):
+    """Create a migrated database at `path` and fill it; returns a summary dict.
+
+    All users share one password hash (hashing is not what is being
+    measured). Schedule times are spread uniformly over the window around
+    today, and rows in the past are completed with `completed_ratio`.
+    """
+    from app import run_migrations  # imported late so callers can set env first
+
+    started = time.perf_counter()
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    with app.app_context():
+        run_migrations(conn)
+
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    conn.executemany(
+        "INSERT INTO users (email, password_hash, role, name) VALUES (?, ?, 'physio', ?)",
+        ((f"physio{i}@bench.example", password_hash, f"Dr. {rnd.choice(FIRST_NAMES)} {i}") for i in range(physios)))
+    conn.executemany(
+        "INSERT INTO users (email, password_hash, role, name) VALUES (?, ?, 'patient', ?)",
+        ((f"patient{i}@bench.example", password_hash, f"{rnd.choice(FIRST_NAMES)} Patient{i}") for i in range(patients)))
+    conn.executemany("INSERT INTO exercises (name) VALUES (?)",
+                     ((f"{EXERCISE_NAMES[i % len(EXERCISE_NAMES)]} {i // len(EXERCISE_NAMES) + 1}",) for i in range(exercises)))
+    conn.commit()
+
+    patient_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE role = 'patient' ORDER BY id")]
+    exercise_ids = [row[0] for row in conn.execute("SELECT id FROM exercises ORDER BY id")]
+    now = int(time.time())
+    midnight = int(datetime.datetime.combine(datetime.date.today(), datetime.time.min,
+                                             datetime.timezone.utc).timestamp())
+    start, end = midnight - days_back * 86400, midnight + (days_ahead + 1) * 86400
+
+    def rows(count):
+        for _ in range(count):
+            at = rnd.randrange(start, end, 300)
+            yield (rnd.choice(patient_ids), rnd.choice(exercise_ids), at,
+                   int(at < now and rnd.random() < completed_ratio))
+
+    remaining = schedule_rows
+    while remaining > 0:
+        chunk = min(batch_size, remaining)
+        conn.executemany("INSERT INTO schedule (patient_id, exercise_id, scheduled_at, completed) VALUES (?, ?, ?, ?)",
+                         rows(chunk))
+        conn.commit()
+        remaining -= chunk
+    # Seeded history isn't news to any dashboard; start the change log empty
+    conn.execute("DELETE FROM schedule_changes")
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    return {
+        'patients': patients, 'physios': physios, 'exercises': exercises,
+        'schedule_rows': schedule_rows, 'completed_ratio': completed_ratio,
+        'days_back': days_back, 'days_ahead': days_ahead, 'seed': seed,
+        'seed_seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+def open_items_by_patient(path, patient_ids, per_patient=200):
+    """Map each patient id to some of their open schedule ids, for /done."""
+    conn = sqlite3.connect(path)
+    try:
+        return {pid: [row[0] for row in conn.execute(
+                    "SELECT id FROM schedule WHERE patient_id = ? AND completed = 0 LIMIT ?", (pid, per_patient))]
+                for pid in patient_ids}
+    finally:
+        conn.close()
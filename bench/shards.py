@@ -0,0 +1,71 @@
+"""Write throughput of one seeded dataset served whole and split into 1, 4, 16 ... clinic shards."""
+import os
+import random
+import shutil
+import sqlite3
+import sys
+
+from . import runner
+from .seed import open_items_by_patient
+
+
+def assign_clinics(db_path, shards):
+    """Spread users over `shards` clinics round-robin by id; returns {clinic: [patient ids]}."""
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE users SET clinic = 'clinic' || (id % ?)", (shards,))
+        clinics = {}
+        for uid, clinic in conn.execute("SELECT id, clinic FROM users WHERE role = 'patient' ORDER BY id"):
+            clinics.setdefault(clinic, []).append(uid)
+    return clinics
+
+
+def clinic_users(db_path, args, clinics):
+    """Virtual users whose physios only assign to patients of their own clinic, as they would when sharded."""
+    rnd = random.Random(args.seed)
+    patients = runner.make_users(db_path, 'patient', args.virtual_users, rnd)
+    open_items = open_items_by_patient(db_path, [vu.uid for vu in patients])
+    for vu in patients:
+        vu.open_items = open_items.get(vu.uid, [])
+    physios = runner.make_users(db_path, 'physio', args.virtual_users, rnd)
+    with sqlite3.connect(db_path) as conn:
+        clinic_of = dict(conn.execute("SELECT id, clinic FROM users WHERE role = 'physio'"))
+        ctx = {
+            'patient_ids': [r[0] for r in conn.execute("SELECT id FROM users WHERE role = 'patient'")],
+            'exercise_ids': [r[0] for r in conn.execute("SELECT id FROM exercises")],
+            'schedule_rows': conn.execute("SELECT MAX(id) FROM schedule").fetchone()[0] or 1,
+        }
+    for vu in physios:
+        vu.patient_ids = clinics.get(clinic_of[vu.uid])
+    return {'patient': patients, 'physio': physios}, ctx
+
+
+def compare_shard_counts(app, workdir, db_path, shard_counts, scenarios, args, env):
+    """Run the write scenarios on gunicorn against the unsharded database and each shard count.
+
+    Every layout starts from a copy of the same seeded database. Returns
+    {layout: {scenario: summary}}; layout 'unsharded' serves DATABASE directly.
+    """
+    from app import split_into_shards  # imported late so callers can set env first
+
+    results = {}
+    for count in [0] + shard_counts:
+        label = f"{count}_shards" if count else 'unsharded'
+        source = os.path.join(workdir, f"{label}.db")
+        shutil.copyfile(db_path, source)
+        clinics = assign_clinics(source, count or 1)
+        server_env = dict(env)
+        if count:
+            with app.app_context():
+                split_into_shards(source, os.path.join(workdir, label))
+            server_env['SHARD_DIRECTORY'] = os.path.join(workdir, label, 'directory.db')
+        users, ctx = clinic_users(source, args, clinics)
+        port = runner.free_port()
+        with runner.gunicorn_server(source, args.workers, port, server_env):
+            for group in users.values():
+                runner.attach_http_clients(port, group)
+            results[label] = {}
+            for scenario in scenarios:
+                print(f"{label}: {scenario}", file=sys.stderr)
+                results[label][scenario] = runner.drive(runner.http_send, users[runner.SCENARIOS[scenario][0]],
+                                                        scenario, ctx, args.concurrency, args.duration)
+    return results
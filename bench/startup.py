@@ -0,0 +1,67 @@
+"""Worker startup: app import time and time to first response from a freshly spawned gunicorn."""
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from . import runner
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)"
+
+
+def import_ms(db_path, repeats):
+    """Median milliseconds for `import app` in a fresh interpreter, which builds the module-level app."""
+    env = {**os.environ, 'DB': os.path.abspath(db_path)}
+    samples = [float(subprocess.check_output([sys.executable, '-c', IMPORT_SNIPPET], cwd=runner.PROJECT_ROOT,
+                                             env=env, stderr=subprocess.DEVNULL))
+               for _ in range(repeats)]
+    return round(statistics.median(samples) * 1000, 1)
+
+
+def time_first_response(db_path, workers, env, timeout=30, warm_requests=20):
+    """Spawn gunicorn and time it until it listens, until its first 200 and that first request itself.
+
+    The first request lands on a worker that has served nothing yet, so
+    comparing it with the warm requests after it shows what the first
+    visitor of a fresh worker pays.
+    """
+    port = runner.free_port()
+    started = time.perf_counter()
+    proc = runner.spawn_gunicorn(db_path, workers, port, env)
+    try:
+        while True:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+                conn.connect()
+                break
+            except OSError:
+                if proc.poll() is not None or time.perf_counter() - started > timeout:
+                    raise RuntimeError("gunicorn did not start; run it by hand to see the error")
+                time.sleep(0.005)
+        listening = time.perf_counter() - started
+        latencies = []
+        for _ in range(1 + warm_requests):
+            sent = time.perf_counter()
+            conn.request('GET', '/login')
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                raise RuntimeError(f"/login answered {response.status}")
+            latencies.append(time.perf_counter() - sent)
+        conn.close()
+    finally:
+        runner.stop_gunicorn(proc)
+    return {'listening_ms': listening * 1000, 'first_response_ms': (listening + latencies[0]) * 1000,
+            'first_request_ms': latencies[0] * 1000, 'warm_request_ms': statistics.median(latencies[1:]) * 1000}
+
+
+def measure_startup(db_path, workers, repeats, env):
+    """Import time, then gunicorn startup with and without preloading the app in the master (medians)."""
+    results = {'import_ms': import_ms(db_path, repeats)}
+    for label, preload in (('preload', '1'), ('no_preload', '0')):
+        print(f"gunicorn: {label}", file=sys.stderr)
+        runs = [time_first_response(db_path, workers, {**env, 'GUNICORN_PRELOAD': preload}) for _ in range(repeats)]
+        results[label] = {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+    return results
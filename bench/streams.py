@@ -0,0 +1,171 @@
+"""Hold many /patient/events streams open against gunicorn and measure what they cost."""
+import datetime
+import os
+import random
+import select
+import socket
+import sqlite3
+import sys
+import time
+
+from . import runner
+
+
+def session_cookie(app, uid):
+    """Mint the signed session cookie /login would set, without paying for a password hash each."""
+    serializer = app.session_interface.get_signing_serializer(app)
+    value = serializer.dumps({'uid': uid, 'role': 'patient', 'user_name': None, 'tz': 'UTC'})
+    return f"{app.config['SESSION_COOKIE_NAME']}={value}"
+
+
+def worker_pids(master_pid):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == master_pid:
+            pids.append(int(entry))
+    return pids
+
+
+def proc_status(pid, field):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def worker_usage(master_pid):
+    """Total resident memory (KiB) and thread count over all gunicorn workers."""
+    pids = worker_pids(master_pid)
+    return sum(proc_status(p, 'VmRSS') for p in pids), sum(proc_status(p, 'Threads') for p in pids)
+
+
+def open_stream(port, cookie, timeout=30):
+    sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+    sock.sendall(f"GET /patient/events HTTP/1.1\r\nHost: bench\r\nCookie: {cookie}\r\n"
+                 "Accept: text/event-stream\r\n\r\n".encode())
+    received = b''
+    while b'retry:' not in received:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        received += chunk
+    if not received.startswith(b'HTTP/1.1 200'):
+        sock.close()
+        return None
+    sock.setblocking(False)
+    return sock
+
+
+def push_latency(db_path, streams, exercise_id, probes, rnd, timeout=10):
+    """Insert a row due today for a few streamed patients and time until each stream delivers it."""
+    latencies, missed = [], 0
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        for uid, sock in rnd.sample(streams, min(probes, len(streams))):
+            drain(sock)
+            at = int(time.time()) + 60
+            if datetime.datetime.fromtimestamp(at, datetime.timezone.utc).date() != datetime.date.today():
+                at = int(time.time())  # just before UTC midnight: keep the row on today's dashboard
+            start = time.perf_counter()
+            conn.execute("INSERT INTO schedule (patient_id, exercise_id, scheduled_at) VALUES (?, ?, ?)",
+                         (uid, exercise_id, at))
+            conn.commit()
+            if wait_for(sock, b'event: schedule', start + timeout):
+                latencies.append(time.perf_counter() - start)
+            else:
+                missed += 1
+    finally:
+        conn.close()
+    latencies.sort()
+    ms = lambda value: None if value is None else round(value * 1000, 1)
+    return {'probes': len(latencies) + missed, 'missed': missed,
+            'p50_ms': ms(runner.percentile(latencies, 50)), 'max_ms': ms(latencies[-1] if latencies else None)}
+
+
+def drain(sock):
+    try:
+        while sock.recv(65536):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def wait_for(sock, marker, deadline):
+    received = b''
+    while time.perf_counter() < deadline:
+        ready, _, _ = select.select([sock], [], [], max(0.0, deadline - time.perf_counter()))
+        if ready:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return False
+            received += chunk
+            if marker in received:
+                return True
+    return False
+
+
+def hold_streams(app, db_path, count, workers, probes=20, seed=1):
+    with sqlite3.connect(db_path) as conn:
+        patient_ids = [r[0] for r in conn.execute(
+            "SELECT id FROM users WHERE role = 'patient' ORDER BY id LIMIT ?", (count,))]
+        exercise_id = conn.execute("SELECT MIN(id) FROM exercises").fetchone()[0]
+    if len(patient_ids) < count:
+        raise SystemExit(f"Need at least {count} seeded patients, have {len(patient_ids)}.")
+
+    port = runner.free_port()
+    # Connections land on workers unevenly, so let any worker hold every stream
+    env = {'SSE_MAX_STREAMS': str(count), 'SECRET_KEY': app.secret_key}
+    with runner.gunicorn_server(db_path, workers, port, env) as proc:
+        for _ in range(workers * 4):  # let every worker serve a request before the baseline
+            _warm(port)
+        rss_before, threads_before = worker_usage(proc.pid)
+
+        started = time.perf_counter()
+        streams, failures = [], 0
+        for uid in patient_ids:
+            sock = open_stream(port, session_cookie(app, uid))
+            if sock is None:
+                failures += 1
+            else:
+                streams.append((uid, sock))
+        open_seconds = time.perf_counter() - started
+        print(f"Opened {len(streams)} streams in {open_seconds:.1f}s", file=sys.stderr)
+        time.sleep(1)
+        rss_after, threads_after = worker_usage(proc.pid)
+
+        latency = push_latency(db_path, streams, exercise_id, probes, random.Random(seed))
+        for _, sock in streams:
+            sock.close()
+
+    held = len(streams)
+    return {
+        'streams_requested': count,
+        'streams_open': held,
+        'open_failures': failures,
+        'open_seconds': round(open_seconds, 2),
+        'gunicorn_workers': workers,
+        'worker_rss_kib_before': rss_before,
+        'worker_rss_kib_after': rss_after,
+        'rss_kib_per_stream': round((rss_after - rss_before) / held, 1) if held else None,
+        'worker_threads_before': threads_before,
+        'worker_threads_after': threads_after,
+        'push_latency': latency,
+    }
+
+
+def _warm(port):
+    sock = socket.create_connection(('127.0.0.1', port), timeout=30)
+    try:
+        sock.sendall(b"GET /login HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n")
+        while sock.recv(65536):
+            pass
+    finally:
+        sock.close()
@@ -0,0 +1,41 @@
+# Gunicorn picks this file up automatically when started from the project root.
+import os
+import shutil
+import tempfile
+
+# Import app.py once in the master so every worker forks with the app, its
+# config and its compiled templates already in memory. Each worker still opens
+# its own SQLite connections (the pool is keyed by PID).
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Threaded workers: a login waiting on the password-hashing process pool holds
+# one thread, not the whole worker, so other routes keep being served.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+# Each open /patient/events stream parks a thread on its queue. The app caps
+# streams at SSE_MAX_STREAMS per worker (same default as app.py), so those
+# threads come on top of GUNICORN_THREADS, which stay free for page requests.
+threads = int(os.getenv("GUNICORN_THREADS", "4")) + int(os.getenv("SSE_MAX_STREAMS", "64"))
+
+# Workers write metrics snapshots here so /metrics can report for the whole
+# server; a fresh directory per start keeps counters from earlier runs out.
+_metrics_dir = os.environ.get("METRICS_DIR")
+_owns_metrics_dir = not _metrics_dir
+if _metrics_dir:
+    os.makedirs(_metrics_dir, exist_ok=True)
+    for _name in os.listdir(_metrics_dir):
+        if _name.startswith("worker-"):
+            os.remove(os.path.join(_metrics_dir, _name))
+else:
+    _metrics_dir = os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="my-scolio-metrics-")
+
+
+def on_exit(server):
+    if _owns_metrics_dir:
+        shutil.rmtree(_metrics_dir, ignore_errors=True)
+
+
+def post_worker_init(worker):
+    # Every worker runs a reminder scheduler; claims are exclusive, so more
+    # workers only add headroom, never duplicate reminders.
+    from app import start_reminder_scheduler
+    start_reminder_scheduler(worker.wsgi)
@@ -0,0 +1,18 @@
+-- Rebuild schedule with foreign keys (SQLite cannot add them in place)
+CREATE TABLE schedule_new(id INTEGER PRIMARY KEY AUTOINCREMENT,
+ patient_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+ exercise_id INTEGER REFERENCES exercises(id) ON DELETE CASCADE,
+ scheduled_at DATETIME,
+ completed INTEGER NOT NULL DEFAULT 0);
+INSERT INTO schedule_new (id, patient_id, exercise_id, scheduled_at, completed)
+ SELECT id, patient_id, exercise_id, scheduled_at, COALESCE(completed, 0) FROM schedule;
+DROP TABLE schedule;
+ALTER TABLE schedule_new RENAME TO schedule;
+
+-- Patient dashboard: today's window for one patient
+CREATE INDEX idx_schedule_patient_time ON schedule(patient_id, scheduled_at);
+-- Calendar feed: a patient's open items only
+CREATE INDEX idx_schedule_patient_open ON schedule(patient_id, scheduled_at) WHERE completed = 0;
+CREATE INDEX idx_schedule_exercise ON schedule(exercise_id);
+-- Physio dashboard: patient picker
+CREATE INDEX idx_users_role ON users(role, email, name);
@@ -0,0 +1,7 @@
+-- One row per patient calendar: version bumps invalidate cached ICS bodies,
+-- token authenticates subscription URLs polled by calendar apps.
+CREATE TABLE calendar_feeds(
+ patient_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+ version INTEGER NOT NULL DEFAULT 1,
+ updated_at INTEGER NOT NULL,
+ token TEXT UNIQUE);
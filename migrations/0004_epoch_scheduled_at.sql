@@ -0,0 +1,25 @@
+-- Patients see their schedule in their own timezone
+ALTER TABLE users ADD COLUMN timezone TEXT NOT NULL DEFAULT 'UTC';
+
+-- scheduled_at becomes integer UTC epoch seconds. The EPOCH declared type
+-- selects the sqlite3 converter; the INTEGER in it keeps integer affinity.
+-- Existing naive values were written in the (then only) UTC interpretation.
+CREATE TABLE schedule_new(id INTEGER PRIMARY KEY AUTOINCREMENT,
+ patient_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+ exercise_id INTEGER REFERENCES exercises(id) ON DELETE CASCADE,
+ scheduled_at EPOCH INTEGER NOT NULL,
+ completed INTEGER NOT NULL DEFAULT 0);
+-- Legacy rows with a NULL or unreadable scheduled_at cannot be converted;
+-- they are set aside in schedule_unreadable (migrate logs how many) rather
+-- than failing the upgrade.
+CREATE TABLE schedule_unreadable AS
+ SELECT * FROM schedule WHERE strftime('%s', scheduled_at) IS NULL;
+INSERT INTO schedule_new (id, patient_id, exercise_id, scheduled_at, completed)
+ SELECT id, patient_id, exercise_id, CAST(strftime('%s', scheduled_at) AS INTEGER), completed FROM schedule
+ WHERE strftime('%s', scheduled_at) IS NOT NULL;
+DROP TABLE schedule;
+ALTER TABLE schedule_new RENAME TO schedule;
+
+CREATE INDEX idx_schedule_patient_time ON schedule(patient_id, scheduled_at);
+CREATE INDEX idx_schedule_patient_open ON schedule(patient_id, scheduled_at) WHERE completed = 0;
+CREATE INDEX idx_schedule_exercise ON schedule(exercise_id);
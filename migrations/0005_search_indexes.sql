@@ -0,0 +1,32 @@
+-- Typeahead search for the physio dashboard pickers.
+-- Patients: standalone FTS table (only role = 'patient' rows), rowid = users.id.
+CREATE VIRTUAL TABLE patient_search USING fts5(email, name, prefix = '2 3');
+INSERT INTO patient_search (rowid, email, name)
+ SELECT id, email, COALESCE(name, '') FROM users WHERE role = 'patient';
+
+CREATE TRIGGER users_search_ai AFTER INSERT ON users WHEN NEW.role = 'patient' BEGIN
+ INSERT INTO patient_search (rowid, email, name) VALUES (NEW.id, NEW.email, COALESCE(NEW.name, ''));
+END;
+CREATE TRIGGER users_search_ad AFTER DELETE ON users BEGIN
+ DELETE FROM patient_search WHERE rowid = OLD.id;
+END;
+CREATE TRIGGER users_search_au AFTER UPDATE OF email, name, role ON users BEGIN
+ DELETE FROM patient_search WHERE rowid = OLD.id;
+ INSERT INTO patient_search (rowid, email, name)
+  SELECT NEW.id, NEW.email, COALESCE(NEW.name, '') WHERE NEW.role = 'patient';
+END;
+
+-- Exercises: external-content FTS over exercises.name.
+CREATE VIRTUAL TABLE exercise_search USING fts5(name, content = 'exercises', content_rowid = 'id', prefix = '2 3');
+INSERT INTO exercise_search (exercise_search) VALUES ('rebuild');
+
+CREATE TRIGGER exercises_search_ai AFTER INSERT ON exercises BEGIN
+ INSERT INTO exercise_search (rowid, name) VALUES (NEW.id, NEW.name);
+END;
+CREATE TRIGGER exercises_search_ad AFTER DELETE ON exercises BEGIN
+ INSERT INTO exercise_search (exercise_search, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+END;
+CREATE TRIGGER exercises_search_au AFTER UPDATE OF name ON exercises BEGIN
+ INSERT INTO exercise_search (exercise_search, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+ INSERT INTO exercise_search (rowid, name) VALUES (NEW.id, NEW.name);
+END;
@@ -0,0 +1,28 @@
+-- Generation counters for the per-worker read caches: a cached page of
+-- patients or exercises is reused only while its generation is unchanged.
+-- Triggers bump them, so a write from any worker or CLI command invalidates
+-- every worker's copy. (Per-patient lists use calendar_feeds.version.)
+CREATE TABLE cache_generations(
+ name TEXT PRIMARY KEY,
+ generation INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID;
+INSERT INTO cache_generations (name) VALUES ('patients'), ('exercises');
+
+CREATE TRIGGER users_cache_ai AFTER INSERT ON users WHEN NEW.role = 'patient' BEGIN
+ UPDATE cache_generations SET generation = generation + 1 WHERE name = 'patients';
+END;
+CREATE TRIGGER users_cache_ad AFTER DELETE ON users WHEN OLD.role = 'patient' BEGIN
+ UPDATE cache_generations SET generation = generation + 1 WHERE name = 'patients';
+END;
+CREATE TRIGGER users_cache_au AFTER UPDATE OF email, name, role ON users BEGIN
+ UPDATE cache_generations SET generation = generation + 1 WHERE name = 'patients';
+END;
+
+CREATE TRIGGER exercises_cache_ai AFTER INSERT ON exercises BEGIN
+ UPDATE cache_generations SET generation = generation + 1 WHERE name = 'exercises';
+END;
+CREATE TRIGGER exercises_cache_ad AFTER DELETE ON exercises BEGIN
+ UPDATE cache_generations SET generation = generation + 1 WHERE name = 'exercises';
+END;
+CREATE TRIGGER exercises_cache_au AFTER UPDATE OF name ON exercises BEGIN
+ UPDATE cache_generations SET generation = generation + 1 WHERE name = 'exercises';
+END;
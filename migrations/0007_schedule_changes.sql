@@ -0,0 +1,23 @@
+-- Append-only log of schedule changes, tailed by each worker's change feed to
+-- push deltas to open patient dashboards. Triggers fill it, so writes from any
+-- worker, bulk assignment or CLI command are seen by every worker.
+-- AUTOINCREMENT: ids must never be reused after pruning, streams resume by id.
+CREATE TABLE schedule_changes(
+ id INTEGER PRIMARY KEY AUTOINCREMENT,
+ patient_id INTEGER NOT NULL,
+ schedule_id INTEGER NOT NULL,
+ kind TEXT NOT NULL CHECK (kind IN ('added', 'completed', 'reopened')),
+ scheduled_at INTEGER NOT NULL,
+ changed_at INTEGER NOT NULL);
+-- Replays the changes a reconnecting stream missed
+CREATE INDEX idx_schedule_changes_patient ON schedule_changes(patient_id, id);
+
+CREATE TRIGGER schedule_changes_ai AFTER INSERT ON schedule BEGIN
+ INSERT INTO schedule_changes (patient_id, schedule_id, kind, scheduled_at, changed_at)
+ VALUES (NEW.patient_id, NEW.id, 'added', NEW.scheduled_at, CAST(strftime('%s', 'now') AS INTEGER));
+END;
+CREATE TRIGGER schedule_changes_au AFTER UPDATE OF completed ON schedule WHEN NEW.completed != OLD.completed BEGIN
+ INSERT INTO schedule_changes (patient_id, schedule_id, kind, scheduled_at, changed_at)
+ VALUES (NEW.patient_id, NEW.id, CASE WHEN NEW.completed THEN 'completed' ELSE 'reopened' END,
+         NEW.scheduled_at, CAST(strftime('%s', 'now') AS INTEGER));
+END;
@@ -0,0 +1,10 @@
+-- Due reminders. The partial index holds only open rows no reminder was sent
+-- for, ordered by time, so the scheduler finds what comes due next with one
+-- range scan instead of scanning schedule. reminded_at marks a row sent (or
+-- skipped, 0); reminder_lease is when a claim by a crashed sender lapses.
+ALTER TABLE schedule ADD COLUMN reminded_at INTEGER;
+ALTER TABLE schedule ADD COLUMN reminder_lease INTEGER;
+-- Items already in the past are history, not reminders to send now
+UPDATE schedule SET reminded_at = 0
+ WHERE completed = 0 AND scheduled_at < CAST(strftime('%s', 'now') AS INTEGER);
+CREATE INDEX idx_schedule_reminder_due ON schedule(scheduled_at) WHERE reminded_at IS NULL AND completed = 0;
@@ -0,0 +1,50 @@
+-- Assigned and completed counts per patient, UTC week (Monday 00:00, epoch
+-- seconds) and exercise, so the physio adherence report reads a few rows per
+-- patient however long the history. Existing rows are counted here and the
+-- triggers on schedule keep it current; `flask --app app backfill-adherence`
+-- rebuilds it should it ever drift.
+CREATE TABLE adherence_weekly(
+ patient_id INTEGER NOT NULL,
+ week_start INTEGER NOT NULL,
+ exercise_id INTEGER NOT NULL,
+ assigned INTEGER NOT NULL DEFAULT 0,
+ completed INTEGER NOT NULL DEFAULT 0,
+ PRIMARY KEY (patient_id, week_start, exercise_id)) WITHOUT ROWID;
+
+INSERT INTO adherence_weekly (patient_id, week_start, exercise_id, assigned, completed)
+SELECT patient_id, (scheduled_at / 86400 - (scheduled_at / 86400 + 3) % 7) * 86400 AS week,
+       exercise_id, COUNT(*), SUM(completed != 0)
+FROM schedule WHERE patient_id IS NOT NULL AND exercise_id IS NOT NULL
+GROUP BY patient_id, week, exercise_id;
+
+CREATE TRIGGER adherence_ai AFTER INSERT ON schedule BEGIN
+ INSERT INTO adherence_weekly (patient_id, week_start, exercise_id, assigned, completed)
+ VALUES (NEW.patient_id, (NEW.scheduled_at / 86400 - (NEW.scheduled_at / 86400 + 3) % 7) * 86400,
+         NEW.exercise_id, 1, NEW.completed != 0)
+ ON CONFLICT DO UPDATE SET assigned = assigned + 1, completed = completed + excluded.completed;
+END;
+CREATE TRIGGER adherence_ad AFTER DELETE ON schedule BEGIN
+ UPDATE adherence_weekly SET assigned = assigned - 1, completed = completed - (OLD.completed != 0)
+ WHERE patient_id = OLD.patient_id AND exercise_id = OLD.exercise_id
+   AND week_start = (OLD.scheduled_at / 86400 - (OLD.scheduled_at / 86400 + 3) % 7) * 86400;
+END;
+-- The common case, /done and its undo: the row stays in its week
+CREATE TRIGGER adherence_au_completed AFTER UPDATE OF completed ON schedule
+ WHEN (NEW.completed != 0) != (OLD.completed != 0) AND NEW.scheduled_at = OLD.scheduled_at
+  AND NEW.patient_id IS OLD.patient_id AND NEW.exercise_id IS OLD.exercise_id BEGIN
+ UPDATE adherence_weekly SET completed = completed + CASE WHEN NEW.completed != 0 THEN 1 ELSE -1 END
+ WHERE patient_id = NEW.patient_id AND exercise_id = NEW.exercise_id
+   AND week_start = (NEW.scheduled_at / 86400 - (NEW.scheduled_at / 86400 + 3) % 7) * 86400;
+END;
+-- A row moved to another patient, exercise or week: take it out of the old counts, add it to the new
+CREATE TRIGGER adherence_au_moved AFTER UPDATE OF patient_id, exercise_id, scheduled_at ON schedule
+ WHEN NEW.scheduled_at != OLD.scheduled_at OR NEW.patient_id IS NOT OLD.patient_id
+  OR NEW.exercise_id IS NOT OLD.exercise_id BEGIN
+ UPDATE adherence_weekly SET assigned = assigned - 1, completed = completed - (OLD.completed != 0)
+ WHERE patient_id = OLD.patient_id AND exercise_id = OLD.exercise_id
+   AND week_start = (OLD.scheduled_at / 86400 - (OLD.scheduled_at / 86400 + 3) % 7) * 86400;
+ INSERT INTO adherence_weekly (patient_id, week_start, exercise_id, assigned, completed)
+ VALUES (NEW.patient_id, (NEW.scheduled_at / 86400 - (NEW.scheduled_at / 86400 + 3) % 7) * 86400,
+         NEW.exercise_id, 1, NEW.completed != 0)
+ ON CONFLICT DO UPDATE SET assigned = assigned + 1, completed = completed + excluded.completed;
+END;
@@ -0,0 +1,3 @@
+-- The clinic (physio group) a user belongs to. `flask --app app split-shards`
+-- gives each clinic its own database; until then everyone shares this one.
+ALTER TABLE users ADD COLUMN clinic TEXT NOT NULL DEFAULT 'main';
@@ -0,0 +1,24 @@
+-- Schedule rows older than ARCHIVE_AFTER_DAYS, moved here by
+-- `flask --app app archive-history` so the hot schedule indexes only hold
+-- recent and upcoming rows. Rows keep their schedule id; exports read both
+-- tables. archived_at is when the row was moved (epoch seconds).
+CREATE TABLE schedule_archive(
+ id INTEGER PRIMARY KEY,
+ patient_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+ exercise_id INTEGER REFERENCES exercises(id) ON DELETE CASCADE,
+ scheduled_at EPOCH INTEGER NOT NULL,
+ completed INTEGER NOT NULL,
+ reminded_at INTEGER,
+ archived_at INTEGER NOT NULL);
+CREATE INDEX idx_schedule_archive_patient_time ON schedule_archive(patient_id, scheduled_at);
+CREATE INDEX idx_schedule_archive_exercise ON schedule_archive(exercise_id);
+
+-- An archived row still counts towards adherence: only deletes of rows that
+-- were not copied to the archive first take it out of the weekly counts
+DROP TRIGGER adherence_ad;
+CREATE TRIGGER adherence_ad AFTER DELETE ON schedule
+ WHEN NOT EXISTS (SELECT 1 FROM schedule_archive WHERE id = OLD.id) BEGIN
+ UPDATE adherence_weekly SET assigned = assigned - 1, completed = completed - (OLD.completed != 0)
+ WHERE patient_id = OLD.patient_id AND exercise_id = OLD.exercise_id
+   AND week_start = (OLD.scheduled_at / 86400 - (OLD.scheduled_at / 86400 + 3) % 7) * 86400;
+END;
@@ -0,0 +1,40 @@
+"""Password hashing for the login hash pool's worker processes.
+
+The pool spawns its workers, and a spawned worker imports the module of
+every function it is handed. Keeping these here, with no import from app,
+means a worker loads werkzeug alone rather than building the whole app
+(database check, log listener, templates) on start.
+"""
+import os
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+def init_worker(niceness):
+    if niceness:
+        os.nice(niceness)
+
+
+def hash_password(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def check_password(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+
+def full_method(method):
+    """The method string werkzeug stores in front of a hash made with `method`.
+
+    Shorthands are expanded with werkzeug's defaults, e.g. 'pbkdf2' to
+    'pbkdf2:sha256:1000000' and 'scrypt' to 'scrypt:32768:8:1'.
+    """
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    if name == 'pbkdf2':
+        digest = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{digest}:{iterations}"
+    return method
@@ -0,0 +1,81 @@
+"""Shared fixtures: a migrated, seeded database per test, served through the app factory."""
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+# The module-level app is built at import; point it at a throwaway path rather than app.db
+os.environ['DB'] = os.path.join(tempfile.mkdtemp(prefix='my-scolio-test-'), 'unused.db')
+os.environ.setdefault('LOG_FORMAT', 'text')
+
+import app as app_module  # noqa: E402  (after the environment is prepared)
+
+PASSWORD = 'secret'
+
+
+@pytest.fixture(autouse=True)
+def isolated_globals(monkeypatch):
+    """Fresh per-process caches and throttles, and hashing inline, for every test."""
+    monkeypatch.setattr(app_module, 'LOGIN_HASH_PROCESSES', 0)
+    monkeypatch.setattr(app_module, 'login_throttle', app_module.AttemptThrottle(app_module.LOGIN_THROTTLE_WINDOW))
+    for name in ('picker_cache', 'today_cache', 'ics_cache'):
+        cache = getattr(app_module, name)
+        monkeypatch.setattr(app_module, name, app_module.ReadCache(cache.name, cache.maxsize, cache.ttl))
+
+
+def make_app(database, **config):
+    return app_module.create_app({'DATABASE': database, 'SHARD_DIRECTORY': None, 'TESTING': True, **config})
+
+
+@pytest.fixture
+def database(tmp_path):
+    return str(tmp_path / 'app.db')
+
+
+@pytest.fixture
+def app(database):
+    flask_app = make_app(database)
+    result = flask_app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def db(database):
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    yield conn
+    conn.close()
+
+
+def login(client, email, password=PASSWORD):
+    response = client.post('/login', data={'email': email, 'password': password})
+    assert response.status_code == 302, response.get_data(as_text=True)
+    return response
+
+
+def user_id(conn, email):
+    return conn.execute("SELECT id FROM users WHERE email = ?", (email,)).fetchone()[0]
+
+
+def schedule_today(conn, patient_email, exercise='Cat-Camel', count=1, completed=0):
+    """Schedule `count` items for the patient later today (UTC); return their ids."""
+    patient_id = user_id(conn, patient_email)
+    exercise_id = conn.execute("SELECT id FROM exercises WHERE name = ?", (exercise,)).fetchone()[0]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    midnight = datetime.datetime.combine(now.date(), datetime.time.min, datetime.timezone.utc)
+    ids = [conn.execute("INSERT INTO schedule (patient_id, exercise_id, scheduled_at, completed) VALUES (?, ?, ?, ?)",
+                        (patient_id, exercise_id, int(midnight.timestamp()) + 60 * (i + 1), completed)).lastrowid
+           for i in range(count)]
+    conn.commit()
+    return ids
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+import app as app_module
+from conftest import login, user_id
+
+
+@pytest.fixture
+def history(db):
+    """Twelve weeks of one patient: a missed week, a completed week, and this week one overdue, one ahead."""
+    this_week = app_module.week_start(int(time.time()))
+    patient_id = user_id(db, 'patient@example.com')
+    bird_dog = db.execute("INSERT INTO exercises (name) VALUES ('Bird Dog')").lastrowid
+    cat_camel = db.execute("SELECT id FROM exercises WHERE name = 'Cat-Camel'").fetchone()[0]
+    rows = [
+        (bird_dog, this_week - 2 * app_module.WEEK + 3600, 0),
+        (cat_camel, this_week - app_module.WEEK + 3600, 1),
+        (cat_camel, this_week - app_module.WEEK + 7200, 1),
+        (cat_camel, this_week, 0),                           # overdue
+        (cat_camel, this_week + app_module.WEEK - 1, 0),     # still ahead
+    ]
+    ids = [db.execute("INSERT INTO schedule (patient_id, exercise_id, scheduled_at, completed) VALUES (?, ?, ?, ?)",
+                      (patient_id, *row)).lastrowid for row in rows]
+    db.commit()
+    return patient_id, ids
+
+
+def test_adherence_json_lists_patients_with_their_figures(client, history):
+    patient_id, _ = history
+    login(client, 'physio@example.com')
+    report = client.get('/physio/adherence.json').get_json()
+
+    assert len(report['weeks']) == app_module.ADHERENCE_REPORT_WEEKS
+    assert report['next'] is None
+    patient, = report['patients']
+    assert patient['id'] == patient_id
+    assert {key: patient[key] for key in ('assigned', 'completed', 'due', 'rate', 'overdue', 'streak_weeks')} == \
+        {'assigned': 5, 'completed': 2, 'due': 4, 'rate': 0.5, 'overdue': 2, 'streak_weeks': 1}
+    assert [(w['assigned'], w['completed']) for w in patient['weeks'][-3:]] == [(1, 0), (2, 2), (2, 0)]
+    assert patient['weeks'][-1]['week_start'] == report['weeks'][-1]
+
+
+def test_adherence_json_for_one_patient_splits_by_exercise(client, history):
+    patient_id, _ = history
+    login(client, 'physio@example.com')
+    patient = client.get(f'/physio/adherence.json?patient={patient_id}').get_json()['patient']
+
+    assert patient['email'] == 'patient@example.com'
+    assert [(e['name'], e['assigned'], e['completed'], e['rate'], e['overdue'], e['streak_weeks'])
+            for e in patient['exercises']] == [('Bird Dog', 1, 0, 0.0, 1, 0), ('Cat-Camel', 4, 2, 0.667, 1, 1)]
+    assert client.get('/physio/adherence.json?patient=999').status_code == 404
+
+
+def test_adherence_follows_completions(client, history):
+    patient_id, ids = history
+    login(client, 'patient@example.com')
+    client.post('/done/batch', json={'ids': [ids[3]], 'completed': True})
+    client.get('/logout')
+    login(client, 'physio@example.com')
+    patient, = client.get('/physio/adherence.json').get_json()['patients']
+    assert (patient['completed'], patient['rate'], patient['overdue']) == (3, 0.75, 1)
+
+
+def test_adherence_page_renders_the_report(client, history):
+    patient_id, _ = history
+    login(client, 'physio@example.com')
+    page = client.get('/physio/adherence').get_data(as_text=True)
+    assert f'href="/physio/adherence?patient={patient_id}">Pat Patient</a>' in page
+    assert '<td>2/4</td>' in page and '<td>50%</td>' in page
+
+    detail = client.get(f'/physio/adherence?patient={patient_id}').get_data(as_text=True)
+    assert '<h2>Adherence: Pat Patient</h2>' in detail
+    assert '<td>Bird Dog</td>' in detail and '<td>Cat-Camel</td>' in detail
+    assert client.get('/physio/adherence?patient=999').status_code == 404
+
+
+def test_adherence_requires_a_physio(client):
+    assert client.get('/physio/adherence.json').status_code == 403
+    assert client.get('/physio/adherence').status_code == 302
+    login(client, 'patient@example.com')
+    assert client.get('/physio/adherence.json').status_code == 403
@@ -0,0 +1,66 @@
+import datetime
+import time
+
+import app as app_module
+from conftest import login, user_id
+
+
+def recurrence(db, **overrides):
+    spec = {'patient_ids': [user_id(db, 'patient@example.com')], 'exercise_ids': [1],
+            'days': ['MO', 'WE', 'FR'], 'times': ['08:00', '18:00'],
+            'start_date': '2030-01-07', 'end_date': '2030-01-13'}
+    spec.update(overrides)
+    return spec
+
+
+def test_bulk_assign_creates_rows_and_skips_conflicts(client, db):
+    login(client, 'physio@example.com')
+    first = client.post('/assign/bulk', json=recurrence(db))
+    assert first.status_code == 200
+    assert first.get_json() == {'created': 6, 'conflicts': 0, 'occurrences': 6}
+
+    again = client.post('/assign/bulk', json=recurrence(db, end_date='2030-01-14'))
+    assert again.get_json() == {'created': 2, 'conflicts': 6, 'occurrences': 8}
+    assert db.execute("SELECT COUNT(*) FROM schedule").fetchone()[0] == 8
+
+
+def test_bulk_assign_rejects_more_rows_than_the_cap(client, db, monkeypatch):
+    monkeypatch.setattr(app_module, 'BULK_ASSIGN_MAX_ROWS', 5)
+    login(client, 'physio@example.com')
+    response = client.post('/assign/bulk', json=recurrence(db))
+    assert response.status_code == 400
+    assert 'limit is 5' in response.get_json()['error']
+    assert db.execute("SELECT COUNT(*) FROM schedule").fetchone()[0] == 0
+
+
+def test_huge_recurrence_is_rejected_before_it_is_expanded(client, db, monkeypatch):
+    monkeypatch.setattr(app_module, 'expand_recurrence', None)  # must not be reached
+    login(client, 'physio@example.com')
+    started = time.perf_counter()
+    response = client.post('/assign/bulk', json=recurrence(
+        db, start_date='0001-01-01', end_date='9999-12-31', days=[], times=['06:00', '12:00', '18:00']))
+    assert time.perf_counter() - started < 1
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Recurrence expands to 10956177 rows; limit is 200000.'
+
+
+def test_count_recurrence_matches_expansion():
+    start = datetime.date(2030, 1, 1)
+    for days in range(0, 30):
+        for weekdays in ({0}, {1, 3, 5}, set(range(7))):
+            end = start + datetime.timedelta(days=days)
+            times = [datetime.time(8), datetime.time(18), datetime.time(8)]
+            assert app_module.count_recurrence(start, end, weekdays, times) == len(
+                app_module.expand_recurrence(start, end, weekdays, times))
+
+
+def test_bulk_assign_validates_the_spec(client, db):
+    login(client, 'physio@example.com')
+    assert client.post('/assign/bulk', json=recurrence(db, end_date='2030-01-01')).status_code == 400
+    assert client.post('/assign/bulk', json=recurrence(db, times=[])).status_code == 400
+    assert client.post('/assign/bulk', json=recurrence(db, patient_ids=[999])).status_code == 400
+
+
+def test_bulk_assign_requires_a_physio(client, db):
+    login(client, 'patient@example.com')
+    assert client.post('/assign/bulk', json=recurrence(db)).status_code == 403
@@ -0,0 +1,126 @@
+import app as app_module
+from conftest import login, schedule_today
+
+
+def cache_counts(name):
+    counts = app_module.metrics.snapshot()['cache']
+    return counts.get(f'{name}|hit', 0), counts.get(f'{name}|miss', 0)
+
+
+def lookups_since(name, before):
+    hits, misses = cache_counts(name)
+    return hits - before[0], misses - before[1]
+
+
+def generations(db):
+    return dict(db.execute("SELECT name, generation FROM cache_generations").fetchall())
+
+
+def test_read_cache_reloads_on_a_new_generation_expiry_and_eviction():
+    loads = []
+
+    def loader(value):
+        return lambda: loads.append(value) or value
+
+    cache = app_module.ReadCache('test', maxsize=2, ttl=60)
+    assert cache.get_or_load('a', 1, loader('a1')) == 'a1'
+    assert cache.get_or_load('a', 1, loader('unused')) == 'a1'
+    assert cache.get_or_load('a', 2, loader('a2')) == 'a2'
+    cache.get_or_load('b', 1, loader('b1'))
+    cache.get_or_load('c', 1, loader('c1'))  # evicts 'a', the least recently used
+    assert cache.get_or_load('a', 2, loader('a2 again')) == 'a2 again'
+    assert loads == ['a1', 'a2', 'b1', 'c1', 'a2 again']
+
+    expired = app_module.ReadCache('test', maxsize=2, ttl=0)
+    expired.get_or_load('a', 1, loader('x'))
+    assert expired.get_or_load('a', 1, loader('y')) == 'y'
+    disabled = app_module.ReadCache('test', maxsize=0, ttl=60)
+    disabled.get_or_load('a', 1, loader('z'))
+    assert disabled.get_or_load('a', 1, loader('z again')) == 'z again'
+
+
+def test_triggers_bump_only_the_affected_generation(app, db):
+    start = generations(db)
+    db.execute("INSERT INTO users (email, password_hash, role) VALUES ('p2@example.com', '!', 'patient')")
+    db.commit()
+    assert generations(db) == {'patients': start['patients'] + 1, 'exercises': start['exercises']}
+    db.execute("INSERT INTO users (email, password_hash, role) VALUES ('dr2@example.com', '!', 'physio')")
+    db.execute("UPDATE users SET timezone = 'Europe/Zurich' WHERE email = 'p2@example.com'")
+    db.commit()
+    assert generations(db)['patients'] == start['patients'] + 1
+    db.execute("UPDATE users SET name = 'Pia' WHERE email = 'p2@example.com'")
+    db.execute("DELETE FROM users WHERE email = 'p2@example.com'")
+    db.execute("INSERT INTO exercises (name) VALUES ('Bird Dog')")
+    db.execute("UPDATE exercises SET name = 'Bird-Dog' WHERE name = 'Bird Dog'")
+    db.execute("DELETE FROM exercises WHERE name = 'Bird-Dog'")
+    db.commit()
+    assert generations(db) == {'patients': start['patients'] + 3, 'exercises': start['exercises'] + 3}
+
+
+def test_picker_cache_is_reused_until_another_connection_writes(client, db):
+    login(client, 'physio@example.com')
+    before = cache_counts('picker')
+    first = client.get('/physio/search?q=pat').get_json()
+    assert client.get('/physio/search?q=pat').get_json() == first
+    assert lookups_since('picker', before) == (1, 1)
+
+    # Written outside the app, as another worker or a CLI import would
+    db.execute("INSERT INTO users (email, password_hash, role, name) VALUES ('pat2@example.com', '!', 'patient', 'Pat Two')")
+    db.commit()
+    before = cache_counts('picker')
+    emails = [p['email'] for p in client.get('/physio/search?q=pat').get_json()['results']]
+    assert emails == ['patient@example.com', 'pat2@example.com']
+    assert lookups_since('picker', before) == (0, 1)
+
+    db.execute("INSERT INTO users (email, password_hash, role) VALUES ('dr2@example.com', '!', 'physio')")
+    db.commit()
+    before = cache_counts('picker')
+    client.get('/physio/search?q=pat')
+    assert lookups_since('picker', before) == (1, 0)
+
+
+def test_todays_list_is_reloaded_when_the_feed_version_moves(app, client, db):
+    item, other = schedule_today(db, 'patient@example.com', count=2)
+    login(client, 'patient@example.com')
+    before = cache_counts('patient_today')
+    client.get('/patient').close()
+    client.get('/patient').close()
+    assert lookups_since('patient_today', before) == (1, 1)
+
+    second_tab = app.test_client()
+    login(second_tab, 'patient@example.com')
+    second_tab.post('/done/batch', json={'ids': [item], 'completed': True})
+    before = cache_counts('patient_today')
+    page = client.get('/patient').get_data(as_text=True)
+    assert lookups_since('patient_today', before) == (0, 1)
+    assert f'<tr data-item="{item}"' in page and f'action="/done/{item}"' not in page
+    assert f'action="/done/{other}"' in page
+
+
+def test_calendar_body_is_cached_per_feed_version(client, db):
+    item, = schedule_today(db, 'patient@example.com')
+    login(client, 'patient@example.com')
+    before = cache_counts('ics')
+    first = client.get('/calendar.ics').get_data()
+    assert client.get('/calendar.ics').get_data() == first
+    assert lookups_since('ics', before) == (1, 1)
+
+    client.post(f'/done/{item}')
+    before = cache_counts('ics')
+    assert client.get('/calendar.ics').get_data() != first
+    assert lookups_since('ics', before) == (0, 1)
+
+
+def test_physio_etag_moves_with_a_patient_rename_only(client, db):
+    login(client, 'physio@example.com')
+    etag = client.get('/physio').headers['ETag']
+    db.execute("INSERT INTO schedule (patient_id, exercise_id, scheduled_at) SELECT id, 1, 0 FROM users WHERE role = 'patient'")
+    db.commit()
+    assert client.get('/physio', headers={'If-None-Match': etag}).status_code == 304
+
+    db.execute("UPDATE users SET name = 'Patricia Patient' WHERE email = 'patient@example.com'")
+    db.commit()
+    renamed = client.get('/physio', headers={'If-None-Match': etag})
+    assert renamed.status_code == 200
+    assert renamed.headers['ETag'] != etag
+    assert 'Patricia Patient' in renamed.get_data(as_text=True)
@@ -0,0 +1,64 @@
+import re
+
+from conftest import login, schedule_today, user_id
+
+
+def feed_url(client):
+    page = client.get('/patient').get_data(as_text=True)
+    return re.search(r'<code>http://localhost(/calendar/[^<]+\.ics)</code>', page).group(1)
+
+
+def test_ics_download_lists_the_open_items(client, db):
+    done, still_open = schedule_today(db, 'patient@example.com', count=2)
+    db.execute("UPDATE schedule SET completed = 1 WHERE id = ?", (done,))
+    db.commit()
+    login(client, 'patient@example.com')
+
+    response = client.get('/calendar.ics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/calendar'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=exercises.ics'
+    body = response.get_data(as_text=True)
+    assert body.startswith('BEGIN:VCALENDAR\r\n') and body.endswith('END:VCALENDAR\r\n')
+    assert re.findall(r'UID:schedule-(\d+)@my-scolio', body) == [str(still_open)]
+    assert 'SUMMARY:Cat-Camel\r\n' in body
+
+
+def test_ics_download_requires_a_patient(client):
+    assert client.get('/calendar.ics').status_code == 302
+    login(client, 'physio@example.com')
+    assert client.get('/calendar.ics').status_code == 302
+
+
+def test_calendar_token_url_serves_the_feed_without_a_session(app, client, db):
+    item, = schedule_today(db, 'patient@example.com')
+    login(client, 'patient@example.com')
+    url = feed_url(client)
+    assert db.execute("SELECT token FROM calendar_feeds WHERE patient_id = ?",
+                      (user_id(db, 'patient@example.com'),)).fetchone()[0] in url
+
+    response = app.test_client().get(url)
+    assert response.status_code == 200
+    assert 'Content-Disposition' not in response.headers
+    assert f'UID:schedule-{item}@my-scolio' in response.get_data(as_text=True)
+    assert app.test_client().get('/calendar/not-a-token.ics').status_code == 404
+
+
+def test_calendar_answers_304_until_the_schedule_changes(app, client, db):
+    item, other = schedule_today(db, 'patient@example.com', count=2)
+    login(client, 'patient@example.com')
+    url = feed_url(client)
+    subscriber = app.test_client()
+
+    first = subscriber.get(url)
+    etag = first.headers['ETag']
+    assert subscriber.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/calendar.ics', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post(f'/done/{item}')
+    changed = subscriber.get(url, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    body = changed.get_data(as_text=True)
+    assert f'UID:schedule-{item}@' not in body and f'UID:schedule-{other}@' in body
+    assert subscriber.get(url, headers={'If-None-Match': changed.headers['ETag']}).status_code == 304
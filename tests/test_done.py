@@ -0,0 +1,111 @@
+import logging
+import sqlite3
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import pytest
+
+import app as app_module
+from conftest import login, schedule_today
+
+
+def completed(db, ids):
+    marks = ','.join('?' * len(ids))
+    return [row[0] for row in db.execute(f"SELECT completed FROM schedule WHERE id IN ({marks}) ORDER BY id", ids)]
+
+
+def test_done_marks_an_item_complete(client, db):
+    item, = schedule_today(db, 'patient@example.com')
+    login(client, 'patient@example.com')
+    response = client.post(f'/done/{item}')
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/patient'
+    assert completed(db, [item]) == [1]
+
+
+def test_done_batch_and_undo(client, db):
+    items = schedule_today(db, 'patient@example.com', count=3)
+    login(client, 'patient@example.com')
+
+    response = client.post('/done/batch', json={'ids': items[:2], 'completed': True})
+    assert response.get_json() == {'completed': True, 'changed': items[:2]}
+    assert completed(db, items) == [1, 1, 0]
+
+    # Already done: nothing changes, so nothing is reported
+    assert client.post('/done/batch', json={'ids': items[:2]}).get_json()['changed'] == []
+
+    undo = client.post('/done/batch', json={'ids': [items[0]], 'completed': False})
+    assert undo.get_json() == {'completed': False, 'changed': [items[0]]}
+    assert completed(db, items) == [0, 1, 0]
+    assert db.execute("SELECT SUM(completed) FROM adherence_weekly").fetchone()[0] == 1
+
+
+def test_done_batch_only_touches_the_patients_own_items(client, db):
+    db.execute("INSERT INTO users (email, password_hash, role) VALUES ('other@example.com', '!', 'patient')")
+    db.commit()
+    theirs = schedule_today(db, 'other@example.com')
+    login(client, 'patient@example.com')
+    assert client.post('/done/batch', json={'ids': theirs}).get_json()['changed'] == []
+    assert completed(db, theirs) == [0]
+
+
+def test_done_batch_validates_ids(client):
+    login(client, 'patient@example.com')
+    assert client.post('/done/batch', json={}).status_code == 400
+    assert client.post('/done/batch', json={'ids': 'x'}).status_code == 400
+    assert client.post('/done/batch', json={'ids': []}).status_code == 400
+    assert client.post('/done/batch', json={'ids': [1], 'completed': 'yes'}).status_code == 400
+
+
+def test_done_answers_503_when_the_commit_times_out(client, db, monkeypatch):
+    item, = schedule_today(db, 'patient@example.com')
+    login(client, 'patient@example.com')
+
+    def timeout(self, func, *args, timeout=None):
+        raise FutureTimeoutError()
+
+    monkeypatch.setattr(app_module.GroupCommitWriter, 'submit', timeout)
+    response = client.post(f'/done/{item}')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '2'
+
+
+def writer(database, **overrides):
+    writer = app_module.GroupCommitWriter(str(database), 0, 1, logging.getLogger('test.group_commit'))
+    for name, value in overrides.items():
+        setattr(writer, name, value)
+    return writer
+
+
+def test_writer_skips_jobs_whose_caller_gave_up(app, db):
+    started, release, ran = threading.Event(), threading.Event(), []
+    group = writer(app.config['DATABASE'])
+    blocker = threading.Thread(target=group.submit, args=(lambda conn: started.set() or release.wait(),))
+    blocker.start()
+    started.wait()
+    try:
+        with pytest.raises(FutureTimeoutError):
+            group.submit(lambda conn: ran.append(True), timeout=0.05)
+    finally:
+        release.set()
+        blocker.join()
+    assert group.submit(lambda conn: 'later') == 'later'
+    assert ran == []
+
+
+def test_writer_survives_a_failed_connect(app):
+    attempts = []
+    group = writer(app.config['DATABASE'])
+    connect = group._connect
+
+    def flaky_connect():
+        attempts.append(True)
+        if len(attempts) == 1:
+            raise sqlite3.OperationalError('unable to open database file')
+        return connect()
+
+    group._connect = flaky_connect
+    with pytest.raises(sqlite3.OperationalError):
+        group.submit(lambda conn: 1, timeout=5)
+    assert group.submit(lambda conn: conn.execute("SELECT 2").fetchone()[0], timeout=5) == 2
+    assert len(attempts) == 2
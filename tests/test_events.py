@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+
+import app as app_module
+from conftest import login, schedule_today
+
+
+def open_stream(client, **headers):
+    response = client.get('/patient/events', headers=headers, buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    return response, iter(response.response)
+
+
+def read_events(chunks, count, timeout=5):
+    """Parse `count` events off a stream, skipping the retry line and heartbeats."""
+    events, deadline = [], time.monotonic() + timeout
+    while len(events) < count and time.monotonic() < deadline:
+        chunk = next(chunks)
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if chunk.startswith('id: '):
+            lines = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+            events.append((int(lines['id']), lines['event'], json.loads(lines['data'])))
+    assert len(events) == count, events
+    return events
+
+
+def test_stream_pushes_changes_to_todays_items(app, client, db, monkeypatch):
+    monkeypatch.setattr(app_module, 'SSE_HEARTBEAT', 0.05)
+    first, second = schedule_today(db, 'patient@example.com', count=2)
+    tomorrow = db.execute("INSERT INTO schedule (patient_id, exercise_id, scheduled_at) "
+                          "SELECT patient_id, exercise_id, scheduled_at + 86400 FROM schedule WHERE id = ?",
+                          (first,)).lastrowid
+    db.commit()
+    login(client, 'patient@example.com')
+    response, chunks = open_stream(client)
+    assert next(chunks) in (b'retry: 5000\n\n', 'retry: 5000\n\n')
+
+    added = read_events(chunks, 2)
+    assert [(data['change'], data['id'], data['name']) for _, _, data in added] == \
+        [('added', first, 'Cat-Camel'), ('added', second, 'Cat-Camel')]
+
+    other = app.test_client()
+    login(other, 'patient@example.com')
+    other.post(f'/done/{tomorrow}')  # not on today's dashboard: no event
+    other.post(f'/done/{second}')
+    (event_id, kind, data), = read_events(chunks, 1)
+    assert kind == 'schedule' and data['change'] == 'completed' and data['id'] == second
+    assert event_id > added[-1][0]
+    response.close()
+
+
+def test_stream_resumes_after_last_event_id(client, db, monkeypatch):
+    monkeypatch.setattr(app_module, 'SSE_HEARTBEAT', 0.05)
+    items = schedule_today(db, 'patient@example.com', count=3)
+    login(client, 'patient@example.com')
+    response, chunks = open_stream(client)
+    events = read_events(chunks, 3)
+    response.close()
+
+    response, chunks = open_stream(client, **{'Last-Event-ID': str(events[0][0])})
+    assert [data['id'] for _, _, data in read_events(chunks, 2)] == items[1:]
+    response.close()
+
+
+def test_stream_only_carries_the_patients_own_changes(app, client, db, monkeypatch):
+    monkeypatch.setattr(app_module, 'SSE_HEARTBEAT', 0.05)
+    monkeypatch.setattr(app_module, 'SSE_POLL_INTERVAL', 0.05)  # the writes below come from another connection
+    db.execute("INSERT INTO users (email, password_hash, role) VALUES ('other@example.com', '!', 'patient')")
+    db.commit()
+    schedule_today(db, 'other@example.com')
+    mine, = schedule_today(db, 'patient@example.com')
+    login(client, 'patient@example.com')
+    response, chunks = open_stream(client)
+    assert [data['id'] for _, _, data in read_events(chunks, 1)] == [mine]
+    schedule_today(db, 'other@example.com')
+    item, = schedule_today(db, 'patient@example.com')
+    assert [data['id'] for _, _, data in read_events(chunks, 1)] == [item]
+    response.close()
+
+
+def test_stream_slots_are_capped_and_given_back_on_close(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'stream_slots', threading.BoundedSemaphore(1))
+    login(client, 'patient@example.com')
+    response, _ = open_stream(client)
+    refused = client.get('/patient/events')
+    assert refused.status_code == 503
+    assert refused.headers['Retry-After'] == '60'
+    response.close()
+    response, _ = open_stream(client)
+    response.close()
+
+
+def test_stream_requires_a_patient(client):
+    assert client.get('/patient/events').status_code == 403
+    login(client, 'physio@example.com')
+    assert client.get('/patient/events').status_code == 403
@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+import time
+
+import app as app_module
+from conftest import login, make_app, user_id
+
+PATIENTS_CSV = "email,name,timezone\r\nana@example.com,Ana,Europe/Zurich\r\nben@example.com,,\r\nnot-an-email,X,\r\n"
+SCHEDULE_CSV = ("patient_email,exercise,scheduled_at,completed\r\n"
+                "ana@example.com,Cat-Camel,2020-03-02T08:00:00,1\r\n"       # local time in Zurich
+                "ben@example.com,Cat-Camel,2020-03-02T08:00:00Z,0\r\n"
+                "ben@example.com,Side Plank,2030-03-02T08:00:00Z,0\r\n"
+                "nobody@example.com,Cat-Camel,2020-03-02T08:00:00Z,0\r\n")
+
+
+def rows_without_ids(text):
+    return sorted(tuple(row[field] for field in ('patient_email', 'exercise', 'scheduled_at', 'completed'))
+                  for row in csv.DictReader(io.StringIO(text)))
+
+
+def test_csv_import_skips_bad_rows(client, db):
+    login(client, 'physio@example.com')
+    response = client.post('/physio/import/patients', data=PATIENTS_CSV)
+    assert response.status_code == 200
+    result = response.get_json()
+    assert (result['imported'], result['skipped']) == (2, 1)
+    assert result['errors'] == ["line 4: invalid email 'not-an-email'"]
+    ana = db.execute("SELECT password_hash, timezone FROM users WHERE email = 'ana@example.com'").fetchone()
+    assert tuple(ana) == ('!', 'Europe/Zurich')
+
+    client.post('/physio/import/exercises', data="name\r\nSide Plank\r\nCat-Camel\r\n")
+    result = client.post('/physio/import/schedule', data=SCHEDULE_CSV).get_json()
+    assert (result['imported'], result['skipped']) == (3, 1)
+    ana = db.execute("SELECT CAST(scheduled_at AS INTEGER), completed FROM schedule WHERE patient_id = ?",
+                     (user_id(db, 'ana@example.com'),)).fetchone()
+    assert tuple(ana) == (1583132400, 1)  # 07:00 UTC
+
+    assert client.post('/physio/import/schedule', data="email\r\nx@example.com\r\n").status_code == 400
+
+
+def test_export_and_import_round_trip(client, db, tmp_path):
+    login(client, 'physio@example.com')
+    client.post('/physio/import/patients', data=PATIENTS_CSV)
+    client.post('/physio/import/exercises', data="name\r\nSide Plank\r\n")
+    client.post('/physio/import/schedule', data=SCHEDULE_CSV)
+    archived, _ = app_module.archive_history(db, int(time.time()) - 86400, pause=0)
+    assert archived == 2
+
+    export = client.get('/physio/export.csv')
+    assert export.status_code == 200
+    assert export.headers['Content-Disposition'] == 'attachment; filename=history.csv'
+    exported = export.get_data(as_text=True)
+    assert exported.count('\r\n') == 4
+    ndjson = [json.loads(line) for line in client.get('/physio/export.ndjson').get_data(as_text=True).splitlines()]
+    assert sorted(record['archived'] for record in ndjson) == [False, True, True]
+
+    target = make_app(str(tmp_path / 'copy.db'))
+    runner = target.test_cli_runner()
+    assert runner.invoke(args=['init-db', '--no-seed']).exit_code == 0
+    (tmp_path / 'patients.csv').write_text("email\nana@example.com\nben@example.com\n")
+    (tmp_path / 'exercises.csv').write_text("name\nCat-Camel\nSide Plank\n")
+    (tmp_path / 'history.csv').write_text(exported, newline='')
+    for kind in ('patients', 'exercises', 'history'):
+        result = runner.invoke(args=['import-csv', 'schedule' if kind == 'history' else kind,
+                                     str(tmp_path / f'{kind}.csv')])
+        assert result.exit_code == 0, result.output
+    assert 'schedule: imported 3 rows, skipped 0.' in result.output
+
+    copy = runner.invoke(args=['export-history'])
+    assert copy.exit_code == 0, copy.output
+    assert rows_without_ids(copy.output) == rows_without_ids(exported)
+
+
+def test_patient_export_is_limited_to_the_patient(client, db):
+    login(client, 'physio@example.com')
+    client.post('/physio/import/patients', data=PATIENTS_CSV)
+    client.post('/physio/import/exercises', data="name\r\nSide Plank\r\n")
+    client.post('/physio/import/schedule', data=SCHEDULE_CSV)
+    ben = user_id(db, 'ben@example.com')
+    rows = list(csv.DictReader(io.StringIO(client.get(f'/physio/export.csv?patient={ben}').get_data(as_text=True))))
+    assert [(row['patient_email'], row['exercise']) for row in rows] == [
+        ('ben@example.com', 'Cat-Camel'), ('ben@example.com', 'Side Plank')]
+    assert client.get('/physio/export.csv?patient=999').status_code == 404
+
+
+def test_passwords_are_only_imported_from_the_command_line(app, client, db, tmp_path):
+    csv_text = "email,password\r\ncat@example.com,hunter22\r\n"
+    login(client, 'physio@example.com')
+    response = client.post('/physio/import/patients', data=csv_text)
+    assert response.status_code == 400
+    assert 'password' in response.get_json()['error']
+    assert db.execute("SELECT COUNT(*) FROM users WHERE email = 'cat@example.com'").fetchone()[0] == 0
+
+    path = tmp_path / 'patients.csv'
+    path.write_text(csv_text)
+    result = app.test_cli_runner().invoke(args=['import-csv', 'patients', str(path)])
+    assert result.exit_code == 0, result.output
+    login(app.test_client(), 'cat@example.com', 'hunter22')
+
+
+def add_history(db, ages_in_days, completed=0):
+    patient_id = user_id(db, 'patient@example.com')
+    now = int(time.time())
+    ids = [db.execute("INSERT INTO schedule (patient_id, exercise_id, scheduled_at, completed) VALUES (?, 1, ?, ?)",
+                      (patient_id, now - days * 86400, completed)).lastrowid for days in ages_in_days]
+    db.commit()
+    return ids
+
+
+def adherence_totals(db):
+    return tuple(db.execute("SELECT SUM(assigned), SUM(completed) FROM adherence_weekly").fetchone())
+
+
+def test_archive_moves_old_rows_in_batches_and_keeps_them_whole(app, db):
+    old = add_history(db, [400, 399, 398], completed=1) + add_history(db, [500, 450])
+    recent = add_history(db, [10, -1])
+    db.execute("UPDATE schedule SET reminded_at = 123 WHERE id = ?", (old[0],))
+    db.commit()
+    before = [tuple(row) for row in db.execute(
+        "SELECT id, patient_id, exercise_id, CAST(scheduled_at AS INTEGER), completed, reminded_at FROM schedule"
+        " WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id", (json.dumps(old),))]
+    feed_version = lambda: db.execute("SELECT MAX(version) FROM calendar_feeds").fetchone()[0] or 0
+    version = feed_version()
+
+    moved, longest = app_module.archive_history(db, int(time.time()) - 365 * 86400, batch_size=2, pause=0)
+    assert moved == 5 and longest > 0
+    assert [row[0] for row in db.execute("SELECT id FROM schedule ORDER BY id")] == recent
+    assert [tuple(row) for row in db.execute(
+        "SELECT id, patient_id, exercise_id, CAST(scheduled_at AS INTEGER), completed, reminded_at"
+        " FROM schedule_archive ORDER BY id")] == before
+    assert db.execute("SELECT COUNT(*) FROM schedule_archive WHERE archived_at IS NULL").fetchone()[0] == 0
+    assert feed_version() > version  # open rows left the calendar feed
+
+    assert app_module.archive_history(db, int(time.time()) - 365 * 86400, pause=0)[0] == 0
+
+
+def test_archived_rows_still_count_towards_adherence(app, db):
+    add_history(db, [400, 401], completed=1)
+    live, = add_history(db, [3])
+    totals = adherence_totals(db)
+    assert app_module.archive_history(db, int(time.time()) - 365 * 86400, pause=0)[0] == 2
+    assert adherence_totals(db) == totals
+
+    db.execute("DELETE FROM schedule WHERE id = ?", (live,))  # a real delete still takes the row out
+    db.commit()
+    assert adherence_totals(db) == (totals[0] - 1, totals[1])
+
+
+def test_archive_history_command(app, db):
+    add_history(db, [40, 20, 5])
+    result = app.test_cli_runner().invoke(args=['archive-history', '--older-than-days', '30', '--batch', '1'])
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith("Archived 1 rows")
+    assert db.execute("SELECT COUNT(*) FROM schedule").fetchone()[0] == 2
@@ -0,0 +1,95 @@
+import ast
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import app as app_module
+from conftest import PASSWORD, login
+
+
+def test_login_and_logout(client):
+    response = login(client, 'patient@example.com')
+    assert response.headers['Location'] == '/dashboard'
+    assert client.get('/dashboard').headers['Location'] == '/patient'
+    client.get('/logout')
+    assert client.get('/patient').headers['Location'] == '/login'
+
+
+def test_wrong_password_is_rejected(client):
+    response = client.post('/login', data={'email': 'patient@example.com', 'password': 'nope'})
+    assert response.status_code == 200
+    assert 'Invalid email or password.' in response.get_data(as_text=True)
+
+
+def test_login_answers_503_while_hashing_is_saturated(client, monkeypatch):
+    monkeypatch.setattr(app_module, '_hash_slots', threading.BoundedSemaphore(1))
+    app_module._hash_slots.acquire()
+    response = client.post('/login', data={'email': 'patient@example.com', 'password': PASSWORD})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '2'
+
+
+def test_timed_out_hash_keeps_its_slot_until_it_finishes(monkeypatch):
+    pool, release = ThreadPoolExecutor(max_workers=1), threading.Event()
+    monkeypatch.setattr(app_module, 'LOGIN_HASH_PROCESSES', 1)
+    monkeypatch.setattr(app_module, 'LOGIN_HASH_TIMEOUT', 0.05)
+    monkeypatch.setattr(app_module, 'get_hash_pool', lambda: pool)
+    monkeypatch.setattr(app_module, '_hash_slots', threading.BoundedSemaphore(1))
+    try:
+        with pytest.raises(app_module.HashingBusy):
+            app_module.run_hashing(release.wait)
+        # The timed-out hash still runs in the pool; no second one may queue behind it
+        with pytest.raises(app_module.HashingBusy):
+            app_module.run_hashing(lambda: True)
+        release.set()
+        pool.submit(lambda: None).result()
+        assert app_module.run_hashing(lambda: 42) == 42
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_busy_hash_upgrade_does_not_block_login(client, db, monkeypatch):
+    old_hash = generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+    db.execute("UPDATE users SET password_hash = ? WHERE email = 'patient@example.com'", (old_hash,))
+    db.commit()
+    run_hashing = app_module.run_hashing
+
+    def busy_for_new_hashes(func, *args):
+        if func is app_module.password_hashing.hash_password:
+            raise app_module.HashingBusy()
+        return run_hashing(func, *args)
+
+    monkeypatch.setattr(app_module, 'run_hashing', busy_for_new_hashes)
+    login(client, 'patient@example.com')
+    assert db.execute("SELECT password_hash FROM users WHERE email = 'patient@example.com'").fetchone()[0] == old_hash
+
+    monkeypatch.setattr(app_module, 'run_hashing', run_hashing)
+    login(client.application.test_client(), 'patient@example.com')
+    upgraded = db.execute("SELECT password_hash FROM users WHERE email = 'patient@example.com'").fetchone()[0]
+    assert upgraded.startswith(app_module.PASSWORD_HASH_METHOD + '$')
+    assert check_password_hash(upgraded, PASSWORD)
+
+
+def test_shorthand_hash_method_does_not_rehash_every_login(monkeypatch):
+    monkeypatch.setattr(app_module, 'PASSWORD_HASH_METHOD', 'pbkdf2')
+    current = generate_password_hash(PASSWORD, method='pbkdf2')
+    assert not app_module.needs_rehash(current)
+    assert app_module.needs_rehash(generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000'))
+    monkeypatch.setattr(app_module, 'PASSWORD_HASH_METHOD', 'scrypt')
+    assert not app_module.needs_rehash(generate_password_hash(PASSWORD, method='scrypt:32768:8:1'))
+    assert app_module.needs_rehash(current)
+
+
+def test_hash_workers_do_not_import_the_app():
+    """A spawned worker imports the module of everything it is handed; that must not be app."""
+    hashing = app_module.password_hashing
+    for func in (hashing.init_worker, hashing.check_password, hashing.hash_password):
+        assert pickle.dumps(func, protocol=0).startswith(b'cpassword_hashing\n')
+    tree = ast.parse(open(hashing.__file__).read())
+    imported = {alias.name for node in ast.walk(tree) if isinstance(node, (ast.Import, ast.ImportFrom))
+                for alias in node.names} | {node.module for node in ast.walk(tree) if isinstance(node, ast.ImportFrom)}
+    assert 'app' not in imported
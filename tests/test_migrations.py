@@ -0,0 +1,66 @@
+import sqlite3
+
+import app as app_module
+from conftest import make_app
+
+# schema.sql as shipped before numbered migrations; deployments from then upgrade with `migrate`
+BASELINE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users(
+ id INTEGER PRIMARY KEY AUTOINCREMENT,
+ email TEXT UNIQUE NOT NULL,
+ password_hash TEXT NOT NULL,
+ role TEXT CHECK(role IN ('physio','patient')) NOT NULL,
+ name TEXT
+);
+CREATE TABLE IF NOT EXISTS exercises(id INTEGER PRIMARY KEY AUTOINCREMENT,name TEXT);
+CREATE TABLE IF NOT EXISTS schedule(id INTEGER PRIMARY KEY AUTOINCREMENT,
+ patient_id INTEGER,exercise_id INTEGER,scheduled_at DATETIME,completed INTEGER DEFAULT 0);
+"""
+
+
+def baseline_database(path, schedule):
+    """A database in the baseline schema with one physio, one patient, one exercise and `schedule` rows."""
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO users (email, password_hash, role, name) VALUES ('doc@example.com', 'x', 'physio', 'Doc')")
+    conn.execute("INSERT INTO users (email, password_hash, role, name) VALUES ('pat@example.com', 'x', 'patient', 'Pat')")
+    conn.execute("INSERT INTO exercises (name) VALUES ('Cat-Camel')")
+    conn.executemany("INSERT INTO schedule (patient_id, exercise_id, scheduled_at, completed) VALUES (2, 1, ?, ?)",
+                     schedule)
+    conn.commit()
+    conn.close()
+
+
+def test_migrate_upgrades_baseline_database(database):
+    baseline_database(database, [('2024-01-08 09:30:00', 1), ('2024-01-09 18:00:00', None)])
+    result = make_app(database).test_cli_runner().invoke(args=['migrate'])
+    assert result.exit_code == 0, result.output
+
+    conn = sqlite3.connect(database)
+    latest = app_module.list_migrations()[-1][0]
+    assert conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()[0] == latest
+    assert conn.execute("SELECT id, CAST(scheduled_at AS INTEGER), completed FROM schedule ORDER BY id").fetchall() == [
+        (1, 1704706200, 1), (2, 1704823200, 0)]
+    assert conn.execute("SELECT week_start, assigned, completed FROM adherence_weekly").fetchall() == [
+        (1704672000, 2, 1)]
+    assert conn.execute("SELECT timezone, clinic FROM users WHERE id = 2").fetchone() == ('UTC', 'main')
+    assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+
+
+def test_migrate_sets_aside_unreadable_schedule_rows(database, caplog):
+    baseline_database(database, [('2024-01-08 09:30:00', 0), (None, 0), ('next tuesday', 1)])
+    result = make_app(database).test_cli_runner().invoke(args=['migrate'])
+    assert result.exit_code == 0, result.output
+
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT id FROM schedule").fetchall() == [(1,)]
+    assert conn.execute("SELECT id, scheduled_at FROM schedule_unreadable ORDER BY id").fetchall() == [
+        (2, None), (3, 'next tuesday')]
+    assert "2 schedule row(s) had no readable scheduled_at" in caplog.text
+
+
+def test_init_db_is_idempotent(app):
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    assert 'Applied' not in result.output
+    assert 'Created' not in result.output
@@ -0,0 +1,27 @@
+import app as app_module
+from conftest import make_app
+
+
+def background_handlers(app):
+    return [h for h in app.logger.handlers if isinstance(h, app_module.BackgroundLogHandler)]
+
+
+def test_each_app_factory_call_replaces_the_log_handler(database):
+    make_app(database)
+    app = make_app(database)
+    assert len(background_handlers(app)) == 1
+
+
+def test_metrics_are_loopback_only_without_a_token(client):
+    assert client.get('/metrics').status_code == 200
+    remote = client.get('/metrics', environ_base={'REMOTE_ADDR': '10.0.0.5'})
+    assert remote.status_code == 403
+
+
+def test_metrics_token_is_required_when_set(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'METRICS_TOKEN', 's3cret')
+    assert client.get('/metrics').status_code == 403
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'},
+                          environ_base={'REMOTE_ADDR': '10.0.0.5'})
+    assert response.status_code == 200
+    assert 'http_requests_total' in response.get_data(as_text=True)
@@ -0,0 +1,140 @@
+import gzip
+import re
+import sqlite3
+import threading
+
+import pytest
+
+import app as app_module
+from conftest import login, schedule_today, user_id
+
+
+def test_physio_dashboard_revalidates_with_304(client, db):
+    login(client, 'physio@example.com')
+    first = client.get('/physio')
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    etag = first.headers['ETag']
+    assert etag.startswith('W/"')
+
+    assert client.get('/physio', headers={'If-None-Match': etag}).status_code == 304
+
+    db.execute("INSERT INTO exercises (name) VALUES ('Bird Dog')")
+    db.commit()
+    changed = client.get('/physio', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert 'Bird Dog' in changed.get_data(as_text=True)
+
+
+def test_patient_dashboard_etag_follows_the_schedule(client, db):
+    login(client, 'patient@example.com')
+    etag = client.get('/patient').headers['ETag']
+    assert client.get('/patient', headers={'If-None-Match': etag}).status_code == 304
+
+    schedule_today(db, 'patient@example.com')
+    app_module.bump_calendar_version(db, user_id(db, 'patient@example.com'))  # as /assign does
+    db.commit()
+    assert client.get('/patient', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_pages_are_gzipped_when_accepted(client):
+    login(client, 'physio@example.com')
+    plain = client.get('/physio')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    encoded = client.get('/physio', headers={'Accept-Encoding': 'gzip'})
+    assert encoded.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(encoded.data) == plain.data
+    assert encoded.headers['ETag'].startswith('W/"')
+
+
+def test_streamed_patient_page_is_gzipped(client, db):
+    schedule_today(db, 'patient@example.com', count=3)
+    login(client, 'patient@example.com')
+    response = client.get('/patient', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data).decode('utf-8').count('<tr data-item=') == 3
+
+
+def test_stylesheet_is_fingerprinted_and_immutable(client):
+    page = client.get('/login').get_data(as_text=True)
+    href = re.search(r'<link rel="stylesheet" href="([^"]+)"', page).group(1)
+    assert href == f"/assets/{app_module.STATIC_ASSETS['app.css'].filename}"
+
+    response = client.get(href, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    assert gzip.decompress(response.data) == app_module.STYLESHEET.encode('utf-8')
+    assert client.get(href, headers={'Accept-Encoding': 'gzip',
+                                     'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/assets/app.0000.css').status_code == 404
+
+
+def test_streamed_patient_page_holds_its_connection_until_closed(app, db, monkeypatch):
+    """The app context is torn down before a streamed body is sent; the response must keep the connection."""
+    checked_out, reused = set(), []
+    acquire, release = app_module.ConnectionPool.acquire, app_module.ConnectionPool.release
+
+    def tracking_acquire(pool):
+        conn = acquire(pool)
+        if conn in checked_out:
+            reused.append(conn)
+        checked_out.add(conn)
+        return conn
+
+    def tracking_release(pool, conn):
+        checked_out.discard(conn)
+        release(pool, conn)
+
+    def load_page(client):
+        response = client.get('/patient')
+        pages.append(response.get_data(as_text=True))
+        response.close()
+
+    monkeypatch.setattr(app_module.ConnectionPool, 'acquire', tracking_acquire)
+    monkeypatch.setattr(app_module.ConnectionPool, 'release', tracking_release)
+    monkeypatch.setattr(app_module, 'TEMPLATE_STREAM_BUFFER', 2)
+    schedule_today(db, 'patient@example.com', count=20)
+    clients = [app.test_client() for _ in range(4)]
+    for client in clients:
+        login(client, 'patient@example.com')
+
+    streamed = clients[0].get('/patient', buffered=False)
+    held = set(checked_out)
+    assert len(held) == 1  # the view has returned, the body is not sent yet
+    pages = []
+    threads = [threading.Thread(target=load_page, args=(client,)) for client in clients[1:] for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert checked_out == held
+    body = streamed.get_data(as_text=True)
+    streamed.close()
+
+    assert reused == []
+    assert checked_out == set()
+    assert body.count('<tr data-item=') == 20
+    assert [page.count('<tr data-item=') for page in pages] == [20] * 9
+
+
+def test_client_leaving_a_streamed_page_early_is_not_an_error(client, db, monkeypatch, caplog):
+    monkeypatch.setattr(app_module, 'TEMPLATE_STREAM_BUFFER', 2)
+    schedule_today(db, 'patient@example.com', count=20)
+    login(client, 'patient@example.com')
+    for encoding in ('identity', 'gzip'):
+        response = client.get('/patient', headers={'Accept-Encoding': encoding}, buffered=False)
+        next(iter(response.response))
+        response.close()
+    assert 'Teardown appcontext error' not in caplog.text
+
+
+def test_pool_size_zero_opens_a_connection_per_request(app):
+    with app.app_context():
+        pool = app_module.ConnectionPool(app.config['DATABASE'], 0)
+        conn = pool.acquire()
+        pool.release(conn)
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+        assert pool.acquire() is not conn
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+import app as app_module
+from conftest import user_id
+
+NOW = int(time.time())
+
+
+class RecordingSender:
+    """Collects what it is asked to send; delivers everything unless told to fail or drop some."""
+
+    def __init__(self, fail=False, deliver=None):
+        self.fail = fail
+        self.deliver = deliver
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, reminders):
+        if self.fail:
+            raise OSError("mail server down")
+        ids = [r['id'] for r in reminders][:self.deliver]
+        with self._lock:
+            self.sent += ids
+        return ids
+
+
+def add_items(db, times, completed=0):
+    patient_id = user_id(db, 'patient@example.com')
+    ids = [db.execute("INSERT INTO schedule (patient_id, exercise_id, scheduled_at, completed) VALUES (?, 1, ?, ?)",
+                      (patient_id, at, completed)).lastrowid for at in times]
+    db.commit()
+    return ids
+
+
+@pytest.fixture
+def scheduler_for(app):
+    """Build ReminderSchedulers on the test database; their connections are closed afterwards."""
+    schedulers = []
+
+    def build(sender, **options):
+        scheduler = app_module.ReminderScheduler(app.config['DATABASE'], sender, app.logger, **options)
+        schedulers.append(scheduler)
+        return scheduler
+
+    with app.app_context():
+        yield build
+    for scheduler in schedulers:
+        scheduler.conn.close()
+
+
+def test_reminders_go_out_once_within_the_lead_time(scheduler_for, db):
+    soon, later = add_items(db, [NOW + 600, NOW + 7200])
+    add_items(db, [NOW + 300], completed=1)
+    sender = RecordingSender()
+    scheduler = scheduler_for(sender, lead=900)
+
+    assert scheduler.run_once(NOW) == 1
+    assert scheduler.run_once(NOW) == 0
+    assert sender.sent == [soon]
+    row = db.execute("SELECT reminded_at, reminder_lease FROM schedule WHERE id = ?", (soon,)).fetchone()
+    assert tuple(row) == (NOW, None)
+    assert scheduler.seconds_until_due(NOW) == min(app_module.REMINDER_POLL_INTERVAL, 7200 - 900)
+
+    assert scheduler.run_once(NOW + 7200 - 900) == 1
+    assert sender.sent == [soon, later]
+
+
+def test_items_too_late_to_remind_are_skipped(scheduler_for, db):
+    missed, = add_items(db, [NOW - 7200])
+    sender = RecordingSender()
+    assert scheduler_for(sender, max_late=3600).run_once(NOW) == 0
+    assert sender.sent == []
+    assert db.execute("SELECT reminded_at FROM schedule WHERE id = ?", (missed,)).fetchone()[0] == 0
+
+
+def test_a_failed_send_is_retried_once_the_lease_lapses(scheduler_for, db):
+    items = add_items(db, [NOW + 60, NOW + 120])
+    failing = scheduler_for(RecordingSender(fail=True), lease=300)
+    assert failing.run_once(NOW) == 0
+
+    sender = RecordingSender()
+    other = scheduler_for(sender, lease=300)
+    assert other.run_once(NOW + 10) == 0  # still claimed by the failed pass
+    assert other.run_once(NOW + 301) == 2
+    assert sender.sent == items
+
+
+def test_undelivered_reminders_in_a_batch_are_retried(scheduler_for, db):
+    first, second = add_items(db, [NOW + 60, NOW + 120])
+    partial = RecordingSender(deliver=1)
+    scheduler = scheduler_for(partial, lease=300)
+    assert scheduler.run_once(NOW) == 1
+    assert partial.sent == [first]
+    partial.deliver = None
+    assert scheduler.run_once(NOW + 301) == 1
+    assert partial.sent == [first, second]
+
+
+def test_competing_schedulers_never_send_a_reminder_twice(scheduler_for, db):
+    items = add_items(db, [NOW + i for i in range(300)])
+    sender = RecordingSender()
+    schedulers = [scheduler_for(sender, lead=900, batch_size=7) for _ in range(4)]
+    threads = [threading.Thread(target=scheduler.run_once, args=(NOW,)) for scheduler in schedulers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(sender.sent) == items
+    assert db.execute("SELECT COUNT(*) FROM schedule WHERE reminded_at IS NULL AND completed = 0").fetchone()[0] == 0
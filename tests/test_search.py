@@ -0,0 +1,70 @@
+import app as app_module
+from conftest import login
+
+
+def add_patients(db, names):
+    ids = [db.execute("INSERT INTO users (email, password_hash, role, name) VALUES (?, '!', 'patient', ?)",
+                      (f"user{i}@example.com", name)).lastrowid
+           for i, name in enumerate(names)]
+    db.commit()
+    return ids
+
+
+def search(client, **params):
+    response = client.get('/physio/search', query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_search_matches_every_word_as_a_prefix(client, db):
+    rosa, rosalind, _ = add_patients(db, ['Rosa Meyer', 'Rosalind Franklin', 'Rolf Meyer'])
+    login(client, 'physio@example.com')
+
+    assert [p['id'] for p in search(client, q='ros')['results']] == [rosa, rosalind]
+    assert [p['id'] for p in search(client, q='ros mey')['results']] == [rosa]
+    assert [p['id'] for p in search(client, q='user1@exam')['results']] == [rosalind]  # emails too
+    assert search(client, q='physio')['results'] == []  # only patients are indexed
+    assert [e['name'] for e in search(client, kind='exercises', q='cat')['results']] == ['Cat-Camel']
+
+
+def test_search_pages_by_keyset(client, db):
+    ids = add_patients(db, [f'Page Tester {i}' for i in range(5)])
+    login(client, 'physio@example.com')
+
+    seen, after = [], 0
+    while after is not None:
+        page = search(client, q='page tester', limit=2, after=after)
+        assert len(page['results']) <= 2
+        seen += [p['id'] for p in page['results']]
+        after = page['next']
+    assert seen == ids
+
+
+def test_search_index_follows_renames_and_new_exercises(client, db):
+    patient, = add_patients(db, ['Oskar Old'])
+    login(client, 'physio@example.com')
+    assert [p['id'] for p in search(client, q='oskar')['results']] == [patient]
+
+    db.execute("UPDATE users SET name = 'Nina New' WHERE id = ?", (patient,))
+    db.execute("INSERT INTO exercises (name) VALUES ('Side Plank')")
+    db.commit()
+    assert search(client, q='oskar')['results'] == []
+    assert [p['id'] for p in search(client, q='nina')['results']] == [patient]
+    assert [e['name'] for e in search(client, kind='exercises', q='sid pla')['results']] == ['Side Plank']
+
+
+def test_physio_page_renders_only_the_first_page_of_options(client, db, monkeypatch):
+    monkeypatch.setattr(app_module, 'PICKER_PAGE_SIZE', 2)
+    add_patients(db, [f'Many Patients {i}' for i in range(5)])
+    login(client, 'physio@example.com')
+    page = client.get('/physio').get_data(as_text=True)
+    assert page.count('@example.com (') == 2
+
+
+def test_search_requires_a_physio_and_a_known_kind(client):
+    assert client.get('/physio/search?q=pat').status_code == 403
+    login(client, 'patient@example.com')
+    assert client.get('/physio/search?q=pat').status_code == 403
+    client.get('/logout')
+    login(client, 'physio@example.com')
+    assert client.get('/physio/search?kind=users').status_code == 400
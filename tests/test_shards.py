@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+import app as app_module
+from conftest import login, make_app, schedule_today, user_id
+
+
+@pytest.fixture
+def sharded(app, db, tmp_path):
+    """The seeded database split into clinics 'north' (the demo users) and 'south' (a second patient)."""
+    db.execute("UPDATE users SET clinic = 'north'")
+    db.execute("INSERT INTO users (email, password_hash, role, name, clinic) SELECT 'south@example.com',"
+               " password_hash, 'patient', 'Sam South', 'south' FROM users WHERE email = 'patient@example.com'")
+    db.commit()
+    schedule_today(db, 'patient@example.com', count=2)
+    schedule_today(db, 'south@example.com', count=1)
+    dest = tmp_path / 'shards'
+    result = app.test_cli_runner().invoke(args=['split-shards', str(dest)])
+    assert result.exit_code == 0, result.output
+    return make_app(app.config['DATABASE'], SHARD_DIRECTORY=str(dest / 'directory.db')), dest
+
+
+def test_split_writes_one_database_per_clinic(sharded):
+    _, dest = sharded
+    assert sorted(name for name in os.listdir(dest) if name.endswith('.db')) == ['directory.db', 'north.db', 'south.db']
+    south = sqlite3.connect(dest / 'south.db')
+    assert south.execute("SELECT email FROM users").fetchall() == [('south@example.com',)]
+    assert south.execute("SELECT COUNT(*) FROM schedule").fetchone()[0] == 1
+    assert south.execute("SELECT SUM(assigned) FROM adherence_weekly").fetchone()[0] == 1
+
+
+def test_split_copies_the_archive_and_counts_it(app, db, tmp_path):
+    old = schedule_today(db, 'patient@example.com', count=2)
+    db.execute("UPDATE schedule SET scheduled_at = scheduled_at - 30 * 86400, completed = 1 WHERE id = ?", (old[1],))
+    db.commit()
+    assert app_module.archive_history(db, int(time.time()) - 86400, pause=0)[0] == 1
+    result = app.test_cli_runner().invoke(args=['split-shards', str(tmp_path / 'shards')])
+    assert result.exit_code == 0, result.output
+    assert 'main: 2 users, 2 schedule rows' in result.output
+
+    main = sqlite3.connect(tmp_path / 'shards' / 'main.db')
+    assert main.execute("SELECT id FROM schedule_archive").fetchall() == [(old[1],)]
+    assert main.execute("SELECT SUM(assigned), SUM(completed) FROM adherence_weekly").fetchone() == (2, 1)
+    # The archived id is the highest; a new row must not reuse it
+    new = main.execute("INSERT INTO schedule (patient_id, exercise_id, scheduled_at) VALUES (?, 1, 0)",
+                       (user_id(db, 'patient@example.com'),)).lastrowid
+    assert new > old[1]
+
+
+def test_login_routes_each_user_to_their_shard(sharded):
+    app, _ = sharded
+    north, south = app.test_client(), app.test_client()
+    login(north, 'patient@example.com')
+    login(south, 'south@example.com')
+    with north.session_transaction() as session:
+        assert session['shard'] == 'north'
+    with south.session_transaction() as session:
+        assert session['shard'] == 'south'
+    assert north.get('/patient').get_data(as_text=True).count('<tr data-item=') == 2
+    assert south.get('/patient').get_data(as_text=True).count('<tr data-item=') == 1
+
+
+def test_unknown_email_is_rejected_without_a_shard(sharded):
+    app, _ = sharded
+    response = app.test_client().post('/login', data={'email': 'nobody@example.com', 'password': 'secret'})
+    assert response.status_code == 200
+    assert 'Invalid email or password.' in response.get_data(as_text=True)
+
+
+def test_unsharded_session_must_log_in_again(app, sharded):
+    client = app.test_client()
+    login(client, 'patient@example.com')
+    sharded_app, _ = sharded
+    with sharded_app.test_client() as later:
+        with client.session_transaction() as old, later.session_transaction() as session:
+            session.update(old)
+        assert later.get('/patient').status_code == 302
+
+
+def test_set_clinic_moves_a_user_and_their_history_between_shards(sharded):
+    app, dest = sharded
+    south = sqlite3.connect(dest / 'south.db')
+    south.execute("INSERT INTO schedule (patient_id, exercise_id, scheduled_at, completed)"
+                  " SELECT id, 1, ?, 1 FROM users WHERE email = 'south@example.com'", (int(time.time()) - 10 * 86400,))
+    south.execute("INSERT INTO calendar_feeds (patient_id, updated_at, token)"
+                  " SELECT id, 0, 'south-token' FROM users WHERE email = 'south@example.com'")
+    south.commit()
+    assert app_module.archive_history(south, int(time.time()) - 86400, pause=0)[0] == 1
+    with app.app_context():
+        app_module.get_shard_directory().add_feed_token('south-token', 'south')
+
+    result = app.test_cli_runner().invoke(args=['set-clinic', 'south@example.com', 'north'])
+    assert result.exit_code == 0, result.output
+    assert 'Moved south@example.com from south to north with 2 schedule rows' in result.output
+
+    assert south.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
+    assert south.execute("SELECT COUNT(*) FROM schedule_archive").fetchone()[0] == 0
+    assert south.execute("SELECT COUNT(*) FROM adherence_weekly").fetchone()[0] == 0
+    north = sqlite3.connect(dest / 'north.db')
+    moved, = north.execute("SELECT id FROM users WHERE email = 'south@example.com'").fetchone()
+    assert north.execute("SELECT COUNT(*) FROM schedule WHERE patient_id = ?", (moved,)).fetchone()[0] == 1
+    assert north.execute("SELECT COUNT(*) FROM schedule_archive WHERE patient_id = ?", (moved,)).fetchone()[0] == 1
+    assert north.execute("SELECT SUM(assigned), SUM(completed) FROM adherence_weekly WHERE patient_id = ?",
+                         (moved,)).fetchone() == (2, 1)
+
+    client = app.test_client()
+    login(client, 'south@example.com')
+    with client.session_transaction() as session:
+        assert session['shard'] == 'north'
+    assert client.get('/patient').get_data(as_text=True).count('<tr data-item=') == 1
+    assert app.test_client().get('/calendar/south-token.ics').status_code == 200
+
+
+def test_set_clinic_to_a_new_clinic_creates_its_shard(sharded):
+    app, dest = sharded
+    result = app.test_cli_runner().invoke(args=['set-clinic', 'south@example.com', 'West End'])
+    assert result.exit_code == 0, result.output
+    west = sqlite3.connect(dest / 'west-end.db')
+    assert west.execute("SELECT email, clinic FROM users").fetchall() == [('south@example.com', 'West End')]
+    assert west.execute("SELECT name FROM exercises").fetchall() == [('Cat-Camel',)]
+    login(app.test_client(), 'south@example.com')
+
+
+def test_init_db_covers_every_shard(sharded):
+    app, _ = sharded
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    assert 'north: Database ready' in result.output
+    assert 'south: Database ready' in result.output
+    assert 'Created' not in result.output  # the demo users are already in north
+
+
+def test_seed_registers_missing_demo_users_in_the_first_shard(sharded):
+    app, dest = sharded
+    for path in (dest / 'north.db', dest / 'directory.db'):
+        conn = sqlite3.connect(path)
+        conn.execute(f"DELETE FROM {'users' if path.name == 'north.db' else 'user_shards'}"
+                     " WHERE email = 'physio@example.com'")
+        conn.commit()
+    result = app.test_cli_runner().invoke(args=['seed'])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == ['north: Created physio physio@example.com']
+    north = sqlite3.connect(dest / 'north.db')
+    assert north.execute("SELECT clinic FROM users WHERE email = 'physio@example.com'").fetchone() == ('north',)
+    login(app.test_client(), 'physio@example.com')
+
+
+def test_calendar_etag_names_the_shard(sharded):
+    app, dest = sharded
+    for path, shard in ((dest / 'north.db', 'north'), (dest / 'south.db', 'south')):
+        conn = sqlite3.connect(path)  # the same local patient id and feed version in both shards
+        conn.execute("UPDATE users SET id = 7 WHERE role = 'patient'")
+        conn.execute("UPDATE schedule SET patient_id = 7")
+        conn.execute("INSERT INTO calendar_feeds (patient_id, version, updated_at, token) VALUES (7, 1, 0, ?)",
+                     (shard + '-token',))
+        conn.commit()
+    with app.app_context():
+        for shard in ('north', 'south'):
+            app_module.get_shard_directory().add_feed_token(shard + '-token', shard)
+    north = app.test_client().get('/calendar/north-token.ics')
+    assert north.status_code == 200
+    south = app.test_client().get('/calendar/south-token.ics', headers={'If-None-Match': north.headers['ETag']})
+    assert south.status_code == 200
+    assert north.headers['ETag'] != south.headers['ETag']
+
+
+def test_patient_import_into_a_shard_keeps_emails_and_clinics_consistent(sharded, tmp_path):
+    app, dest = sharded
+    path = tmp_path / 'patients.csv'
+    path.write_text("email,clinic\r\nnew@example.com,\r\npatient@example.com,\r\nother@example.com,north\r\n")
+    result = app.test_cli_runner().invoke(args=['import-csv', 'patients', str(path), '--shard', 'south'])
+    assert result.exit_code == 0, result.output
+    assert 'imported 1 rows, skipped 2' in result.output
+    assert 'patient@example.com is already in shard north' in result.output
+    assert "clinic 'north' is not the one shard south holds" in result.output
+
+    south = sqlite3.connect(dest / 'south.db')
+    assert south.execute("SELECT email, clinic FROM users ORDER BY id").fetchall() == [
+        ('south@example.com', 'south'), ('new@example.com', 'south')]
+    with app.app_context():
+        directory = app_module.get_shard_directory()
+        assert directory.shard_for_email('patient@example.com') == 'north'
+        assert directory.shard_for_email('new@example.com') == 'south'
+
+
+def test_exercises_are_imported_into_every_shard(sharded, tmp_path):
+    app, dest = sharded
+    client = app.test_client()
+    login(client, 'physio@example.com')
+    assert client.post('/physio/import/exercises', data="name\r\nBird Dog\r\n").status_code == 400
+
+    path = tmp_path / 'exercises.csv'
+    path.write_text("name\r\nBird Dog\r\n")
+    result = app.test_cli_runner().invoke(args=['import-csv', 'exercises', str(path)])
+    assert result.exit_code == 0, result.output
+    for shard in ('north', 'south'):
+        assert f'{shard}: exercises: imported 1 rows' in result.output
+        names = sqlite3.connect(dest / f'{shard}.db').execute("SELECT name FROM exercises ORDER BY id").fetchall()
+        assert names == [('Cat-Camel',), ('Bird Dog',)]
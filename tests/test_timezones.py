@@ -0,0 +1,59 @@
+import datetime
+import re
+import zoneinfo
+
+import app as app_module
+from conftest import login, user_id
+
+ZURICH = zoneinfo.ZoneInfo('Europe/Zurich')
+
+
+def set_timezone(db, email, name):
+    db.execute("UPDATE users SET timezone = ? WHERE email = ?", (name, email))
+    db.commit()
+
+
+def test_day_window_follows_local_midnight_and_dst():
+    start, end = app_module.day_window(datetime.date(2026, 1, 15), ZURICH)
+    assert start == int(datetime.datetime(2026, 1, 14, 23, 0, tzinfo=datetime.timezone.utc).timestamp())
+    assert end - start == 24 * 3600
+    spring = app_module.day_window(datetime.date(2026, 3, 29), ZURICH)
+    autumn = app_module.day_window(datetime.date(2026, 10, 25), ZURICH)
+    assert spring[1] - spring[0] == 23 * 3600
+    assert autumn[1] - autumn[0] == 25 * 3600
+    assert app_module.to_epoch(datetime.datetime(2026, 7, 1, 8, 0), ZURICH) == \
+        int(datetime.datetime(2026, 7, 1, 6, 0, tzinfo=datetime.timezone.utc).timestamp())
+
+
+def test_patient_dashboard_shows_the_patients_own_today(client, db):
+    # UTC+14: the local day never lines up with the UTC one
+    zone_name = 'Pacific/Kiritimati'
+    set_timezone(db, 'patient@example.com', zone_name)
+    zone = zoneinfo.ZoneInfo(zone_name)
+    start, end = app_module.day_window(datetime.datetime.now(zone).date(), zone)
+    patient_id = user_id(db, 'patient@example.com')
+    yesterday, first, last, tomorrow = [
+        db.execute("INSERT INTO schedule (patient_id, exercise_id, scheduled_at) VALUES (?, 1, ?)",
+                   (patient_id, at)).lastrowid for at in (start - 60, start, end - 60, end)]
+    db.commit()
+
+    login(client, 'patient@example.com')
+    page = client.get('/patient').get_data(as_text=True)
+    assert [int(i) for i in re.findall(r'<tr data-item="(\d+)"', page)] == [first, last]
+    assert '12:00 AM' in page and '11:59 PM' in page  # shown on the patient's clock
+
+
+def test_assign_reads_the_time_on_the_patients_clock(client, db):
+    set_timezone(db, 'patient@example.com', 'Europe/Zurich')
+    login(client, 'physio@example.com')
+    client.post('/assign', data={'patient_id': user_id(db, 'patient@example.com'), 'exercise_id': 1,
+                                 'date': '2026-07-01', 'time': '08:00'})
+    scheduled, = db.execute("SELECT CAST(scheduled_at AS INTEGER) FROM schedule").fetchone()
+    assert scheduled == int(datetime.datetime(2026, 7, 1, 6, 0, tzinfo=datetime.timezone.utc).timestamp())
+
+
+def test_unknown_timezone_falls_back_to_utc(app, caplog):
+    with app.app_context():
+        assert app_module.get_zone('Mars/Olympus_Mons') is datetime.timezone.utc
+        assert app_module.get_zone(None) == zoneinfo.ZoneInfo('UTC')
+    assert "Unknown timezone 'Mars/Olympus_Mons'" in caplog.text